@@ -12,9 +12,10 @@ from typing import Dict, Any, Optional
 
 import zmq
 
-from inginious.common.message_meta import ZMQUtils
+from inginious.common.compression import get_codecs
+from inginious.common.message_meta import ZMQUtils, WIRE_VERSION
 from inginious.common.messages import AgentHello, BackendJobId, SPResult, AgentJobDone, BackendNewJob, BackendKillJob, \
-    AgentJobStarted, AgentJobSSHDebug, Ping, Pong
+    AgentJobStarted, AgentJobSSHDebug, Ping, Pong, BackendKillJobs
 
 """
 Various utils to implements new kind of agents easily.
@@ -49,12 +50,13 @@ class Agent(object, metaclass=ABCMeta):
     An INGInious agent, that grades specific kinds of jobs, and interacts with a Backend.
     """
 
-    def __init__(self, context, backend_addr, friendly_name, concurrency, tasks_filesystem):
+    def __init__(self, context, backend_addr, friendly_name, concurrency, tasks_filesystem, compression=None):
         """
         :param context: a ZMQ context to which the agent will be linked
         :param backend_addr: address of the backend to which the agent should connect. The format is the same as ZMQ
         :param concurrency: number of simultaneous jobs that can be run by this agent
         :param tasks_filesystem: FileSystemProvider to the course/tasks
+        :param compression: name of the codec used to compress the large messages sent to the backend, or None
         """
         # These fields can be read/modified/overridden in subclasses
         self._logger = logging.getLogger("inginious.agent")
@@ -67,6 +69,10 @@ class Agent(object, metaclass=ABCMeta):
         self.__backend_addr = backend_addr
         self.__context = context
         self.__friendly_name = friendly_name
+        self.__codec = compression
+        # version of the wire format of the messages sent to the backend. The backend writes in version 2 only to the agents
+        # that announced it in their hello, and reads it, so the agent switches to it once it received a message in it.
+        self.__wire_version = 1
         self.__backend_socket = self.__context.socket(zmq.DEALER)
         self.__backend_socket.ipv6 = True
 
@@ -99,6 +105,20 @@ class Agent(object, metaclass=ABCMeta):
         """
         return {}
 
+    @property
+    def resources(self):
+        """
+        :return: a dict of the resources shared between the jobs of this agent, in the form
+            {
+                "memory": 8192,  # in MB
+                "cpu": 4         # number of CPUs
+            }
+
+            The backend only sends a job to the agent if the resources asked in its limits are not reserved by other
+            jobs. Resources that are not in the dict are not limited. By default, only the number of jobs is limited.
+        """
+        return {}
+
     async def run(self):
         """
         Runs the agent. Answer to the requests made by the Backend.
@@ -107,9 +127,11 @@ class Agent(object, metaclass=ABCMeta):
         self._logger.info("Agent started")
         self.__backend_socket.connect(self.__backend_addr)
 
-        # Tell the backend we are up and have `concurrency` threads available
+        # Tell the backend we are up and have `concurrency` threads and `resources` available
         self._logger.info("Saying hello to the backend")
-        await ZMQUtils.send(self.__backend_socket, AgentHello(self.__friendly_name, self.__concurrency, self.environments))
+        self.__wire_version = 1
+        await ZMQUtils.send(self.__backend_socket, AgentHello(self.__friendly_name, self.__concurrency, self.environments,
+                                                              self.resources, get_codecs(), [1, WIRE_VERSION]))
         self.__backend_last_seen_time = time.time()
 
         run_listen = self._loop.create_task(self.__run_listen())
@@ -130,7 +152,8 @@ class Agent(object, metaclass=ABCMeta):
     async def __run_listen(self):
         """ Listen to the backend """
         while True:
-            message = await ZMQUtils.recv(self.__backend_socket)
+            message, wire_version = await ZMQUtils.recv_with_version(self.__backend_socket)
+            self.__wire_version = max(self.__wire_version, wire_version)
             await self.__handle_backend_message(message)
 
     async def __handle_backend_message(self, message):
@@ -139,6 +162,7 @@ class Agent(object, metaclass=ABCMeta):
         message_handlers = {
             BackendNewJob: self.__handle_new_job,
             BackendKillJob: self.kill_job,
+            BackendKillJobs: self.__handle_kill_jobs,
             Ping: self.__handle_ping
         }
         try:
@@ -149,7 +173,11 @@ class Agent(object, metaclass=ABCMeta):
 
     async def __handle_ping(self, _ : Ping):
         """ Handle a Ping message. Pong the backend """
-        await ZMQUtils.send(self.__backend_socket, Pong())
+        await ZMQUtils.send(self.__backend_socket, Pong(), wire_version=self.__wire_version)
+
+    async def __handle_kill_jobs(self, message: BackendKillJobs):
+        """ Handle a BackendKillJobs message. Kills each of the jobs """
+        await asyncio.gather(*[self.kill_job(BackendKillJob(job_id)) for job_id in message.job_ids])
 
     async def __handle_new_job(self, message: BackendNewJob):
         self._logger.info("Received request for jobid %s", message.job_id)
@@ -158,7 +186,7 @@ class Agent(object, metaclass=ABCMeta):
         self.__running_job[message.job_id] = False  # no ssh info sent
 
         # Tell the backend we started running the job
-        await ZMQUtils.send(self.__backend_socket, AgentJobStarted(message.job_id))
+        await ZMQUtils.send(self.__backend_socket, AgentJobStarted(message.job_id), wire_version=self.__wire_version)
 
         try:
             if message.environment not in self.environments:
@@ -198,7 +226,7 @@ class Agent(object, metaclass=ABCMeta):
         if self.__running_job[job_id]:
             raise TooManyCallsException()
         self.__running_job[job_id] = True  # now we have sent ssh info
-        await ZMQUtils.send(self.__backend_socket, AgentJobSSHDebug(job_id, host, port, key))
+        await ZMQUtils.send(self.__backend_socket, AgentJobSSHDebug(job_id, host, port, key), wire_version=self.__wire_version)
 
     async def send_job_result(self, job_id: BackendJobId, result: str, text: str = "", grade: float = None, problems: Dict[str, SPResult] = None,
                               tests: Dict[str, Any] = None, custom: Dict[str, Any] = None, state: str = "", archive: Optional[bytes] = None,
@@ -223,7 +251,8 @@ class Agent(object, metaclass=ABCMeta):
         if tests is None:
             tests = {}
 
-        await ZMQUtils.send(self.__backend_socket, AgentJobDone(job_id, (result, text), round(grade, 2), problems, tests, custom, state, archive, stdout, stderr))
+        await ZMQUtils.send(self.__backend_socket, AgentJobDone(job_id, (result, text), round(grade, 2), problems, tests, custom, state, archive, stdout, stderr),
+                            codec=self.__codec, wire_version=self.__wire_version)
 
     @abstractmethod
     async def new_job(self, message: BackendNewJob):
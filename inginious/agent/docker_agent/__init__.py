@@ -17,15 +17,20 @@ import psutil
 from inginious.agent.docker_agent._docker_interface import DockerInterface
 
 from inginious.agent import Agent, CannotCreateJobException
+from inginious.agent.docker_agent._container_pool import ContainerPool
+from inginious.agent.docker_agent._snapshot_cache import TaskSnapshotCache, clone_tree
 from inginious.agent.docker_agent._timeout_watcher import TimeoutWatcher
-from inginious.common.asyncio_utils import AsyncIteratorWrapper, AsyncProxy
-from inginious.common.base import id_checker, id_checker_tests
+from inginious.common.asyncio_utils import AsyncIteratorWrapper, AsyncProxy, get_executor
+from inginious.common.base import id_checker, id_checker_tests, DEFAULT_MEMORY_LIMIT, MIN_MEMORY_LIMIT
 from inginious.common.filesystems.provider import FileSystemProvider
 from inginious.common.messages import BackendNewJob, BackendKillJob
+from inginious.common.metrics import Metrics
 
 
 class DockerAgent(Agent):
-    def __init__(self, context, backend_addr, friendly_name, concurrency, tasks_fs: FileSystemProvider, address_host=None, external_ports=None, tmp_dir="./agent_tmp"):
+    def __init__(self, context, backend_addr, friendly_name, concurrency, tasks_fs: FileSystemProvider, address_host=None, external_ports=None,
+                 tmp_dir="./agent_tmp", compression=None, metrics=None, container_pool_size=0,
+                 snapshot_cache_size=0, cpu_watcher="stats"):
         """
         :param context: ZeroMQ context for this process
         :param backend_addr: address of the backend (for example, "tcp://127.0.0.1:2222")
@@ -35,11 +40,29 @@ class DockerAgent(Agent):
         :param address_host: hostname/ip/... to which external client should connect to access to the docker
         :param external_ports: iterable containing ports to which the docker instance can bind internal ports
         :param tmp_dir: temp dir that is used by the agent to start new containers
+        :param compression: name of the codec used to compress the large messages sent to the backend, or None
+        :param metrics: the Metrics object in which the duration of the calls to Docker is recorded, or None
+        :param container_pool_size: maximum number of containers created in advance for each grading environment (and
+                                    memory limit). 0 disables the pool
+        :param snapshot_cache_size: maximum size, in MB, of the local copies of the tasks kept between the jobs, mounted in
+                                    the containers (the task directory through an overlay). 0 disables the cache: the
+                                    files of the task are copied from tasks_fs for each job
+        :param cpu_watcher: how the CPU time of the containers is watched: "cgroup" (read from the cgroup filesystem by a
+                            single task, falling back to "stats" when the cgroup of a container is not found) or "stats"
+                            (a `docker stats` stream per container, the default)
         """
-        super(DockerAgent, self).__init__(context, backend_addr, friendly_name, concurrency, tasks_fs)
+        super(DockerAgent, self).__init__(context, backend_addr, friendly_name, concurrency, tasks_fs, compression)
         self._logger = logging.getLogger("inginious.agent.docker")
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._docker_threads = concurrency + 4
+        self._docker_connections = self._docker_threads + concurrency  # one per thread, one per stats stream of the jobs
+        self._container_pool_size = container_pool_size
+        self._snapshot_cache_size = snapshot_cache_size
+        self._cpu_watcher = cpu_watcher
 
-        self._max_memory_per_slot = int(psutil.virtual_memory().total / concurrency / 1024 / 1024)
+        # Memory and CPUs are shared by the jobs, the backend takes care of not sending more jobs than what fits
+        self._max_memory = int(psutil.virtual_memory().total / 1024 / 1024)
+        self._cpu_count = psutil.cpu_count() or 1
 
         self.tasks_fs = tasks_fs
 
@@ -51,8 +74,9 @@ class DockerAgent(Agent):
         self._external_ports = set(external_ports) if external_ports is not None else set()
 
         # Async proxy to os
-        self._aos = AsyncProxy(os)
-        self._ashutil = AsyncProxy(shutil)
+        self._io_executor = get_executor("io", self._metrics)
+        self._aos = AsyncProxy(os, executor=self._io_executor)
+        self._ashutil = AsyncProxy(shutil, executor=self._io_executor)
 
     async def _init_clean(self):
         """ Must be called when the agent is starting """
@@ -76,8 +100,10 @@ class DockerAgent(Agent):
         except OSError:
             pass
 
-        # Docker
-        self._docker = AsyncProxy(DockerInterface())
+        # Docker. The calls are made in their own threads, so that a slow daemon does not block the other blocking calls
+        # of the agent
+        self._docker_executor = get_executor("docker", self._metrics, self._docker_threads)
+        self._docker = AsyncProxy(DockerInterface(self._docker_connections, self._metrics), executor=self._docker_executor)
 
         # Auto discover containers
         self._logger.info("Discovering containers")
@@ -98,12 +124,29 @@ class DockerAgent(Agent):
             self._logger.info("External address for SSH remote debug is %s", self._address_host)
 
         # Watchers
-        self._timeout_watcher = TimeoutWatcher(self._docker)
+        self._timeout_watcher = TimeoutWatcher(self._docker, self._cpu_watcher)
+
+        # Local copies of the tasks
+        self._snapshots = None
+        if self._snapshot_cache_size > 0:
+            self._snapshots = TaskSnapshotCache(path_join(self._tmp_dir, "snapshots"), self._snapshot_cache_size * 1024 * 1024,
+                                                self._metrics)
+
+        # Containers created in advance
+        self._container_pool = None
+        if self._container_pool_size > 0:
+            self._container_pool = ContainerPool(self.__create_pooled_container, self.__remove_pooled_container,
+                                                 self._container_pool_size, metrics=self._metrics,
+                                                 executor=self._docker_executor)
+            self._container_pool.start()
 
     async def _end_clean(self):
         """ Must be called when the agent is closing """
         await self._timeout_watcher.clean()
 
+        if self._container_pool is not None:
+            await self._container_pool.close()
+
         async def close_and_delete(container_id):
             try:
                 await self._docker.remove_container(container_id)
@@ -115,10 +158,16 @@ class DockerAgent(Agent):
         for container_id  in self._student_containers_running:
             await close_and_delete(container_id)
 
+        self._docker.sync.close()
+
     @property
     def environments(self):
         return self._containers
 
+    @property
+    def resources(self):
+        return {"memory": self._max_memory, "cpu": self._cpu_count}
+
     async def _watch_docker_events(self):
         """ Get raw docker events and convert them to more readable objects, and then give them to self._docker_events_subscriber """
         try:
@@ -169,7 +218,7 @@ class DockerAgent(Agent):
             limits = message.environment_parameters.get("limits", {})
             time_limit = int(limits.get("time", 30))
             hard_time_limit = int(limits.get("hard_time", None) or time_limit * 3)
-            mem_limit = int(limits.get("memory", 200))
+            mem_limit = int(limits.get("memory", DEFAULT_MEMORY_LIMIT))
             run_cmd = message.environment_parameters.get("run_cmd", '')
         except:
             raise CannotCreateJobException('The agent is unable to parse the parameters')
@@ -183,12 +232,12 @@ class DockerAgent(Agent):
                              'If the error persists, please contact your course administrator.')
 
         # Check for realistic memory limit value
-        if mem_limit < 20:
-            mem_limit = 20
-        elif mem_limit > self._max_memory_per_slot:
+        if mem_limit < MIN_MEMORY_LIMIT:
+            mem_limit = MIN_MEMORY_LIMIT
+        elif mem_limit > self._max_memory:
             self._logger.warning("Task %s/%s ask for too much memory (%dMB)! Available: %dMB", course_id, task_id,
-                                 mem_limit, self._max_memory_per_slot)
-            raise CannotCreateJobException('Not enough memory on agent (available: %dMB). Please contact your course administrator.' % self._max_memory_per_slot)
+                                 mem_limit, self._max_memory)
+            raise CannotCreateJobException('Not enough memory on agent (available: %dMB). Please contact your course administrator.' % self._max_memory)
 
         if environment_name not in self._containers:
             self._logger.warning("Task %s/%s ask for an unknown environment %s (not in aliases)", course_id, task_id,
@@ -212,62 +261,91 @@ class DockerAgent(Agent):
                 raise CannotCreateJobException('No ports are available right now. Please retry later.')
             ports[p] = self._external_ports.pop()
 
-        # Create directories for storing all the data for the job
-        try:
-            container_path = tempfile.mkdtemp(dir=self._tmp_dir)
-        except Exception as e:
-            self._logger.error("Cannot make container temp directory! %s", str(e), exc_info=True)
-            for p in ports:
-                self._external_ports.add(ports[p])
-            raise CannotCreateJobException('Cannot make container temp directory.')
+        # Take a container created in advance, with its directories, if possible
+        pooled = None
+        if self._container_pool is not None and len(ports) == 0:
+            pooled = self._container_pool.claim((environment_name, environment, enable_network, mem_limit))
 
-        task_path = path_join(container_path, 'task')  # tmp_dir/id/task/
-        course_path = path_join(container_path, 'course')
+        # Create directories for storing all the data for the job
+        if pooled is not None:
+            container_id, container_path = pooled
+        else:
+            try:
+                container_path = self.__create_container_path()
+            except Exception as e:
+                self._logger.error("Cannot make container temp directory! %s", str(e), exc_info=True)
+                for p in ports:
+                    self._external_ports.add(ports[p])
+                raise CannotCreateJobException('Cannot make container temp directory.')
 
-        sockets_path = path_join(container_path, 'sockets')  # tmp_dir/id/socket/
+        task_path, sockets_path, course_common_path, course_common_student_path = self.__get_container_paths(container_path)
         student_path = path_join(task_path, 'student')  # tmp_dir/id/task/student/
         systemfiles_path = path_join(task_path, 'systemfiles')  # tmp_dir/id/task/systemfiles/
 
-        course_common_path = path_join(course_path, 'common')
-        course_common_student_path = path_join(course_path, 'common', 'student')
-
-        # Create the needed directories
-        os.mkdir(sockets_path)
-        os.chmod(container_path, 0o777)
-        os.chmod(sockets_path, 0o777)
-        os.mkdir(course_path)
-
-        # TODO: avoid copy
-        task_fs.copy_from(None, task_path)
-        os.chmod(task_path, 0o777)
-
-        if not os.path.exists(student_path):
-            os.mkdir(student_path)
-            os.chmod(student_path, 0o777)
+        task_layers = None
+        try:
+            if self._snapshots is not None:
+                task_snapshot = self._snapshots.acquire(task_fs, container_path)
+                common_snapshot = self._snapshots.acquire(course_fs.from_subfolder("$common"), container_path, ("student",))
+                if pooled is not None:
+                    # The mounts of pooled containers are already set: the files are cloned in their directories
+                    clone_tree(task_snapshot, task_path)
+                    clone_tree(common_snapshot, course_common_path)
+                else:
+                    # The task directory is an overlay whose lower layer is the read-only snapshot of the task, and the
+                    # common directories are mounted from their snapshot. Only the subdirectories shared with the student
+                    # containers are cloned, as they are mounted separately.
+                    student_path = path_join(container_path, 'student')
+                    systemfiles_path = path_join(container_path, 'systemfiles')
+                    work_path = path_join(container_path, 'task-work')
+                    os.mkdir(task_path)
+                    os.mkdir(work_path)
+                    for subfolder, path in (('student', student_path), ('systemfiles', systemfiles_path)):
+                        if os.path.isdir(path_join(task_snapshot, subfolder)):
+                            clone_tree(path_join(task_snapshot, subfolder), path)
+                    os.makedirs(systemfiles_path, exist_ok=True)  # mounted in the container even if the task has none
+                    task_layers = (task_snapshot, work_path, student_path, systemfiles_path)
+                    course_common_path = common_snapshot
+                    course_common_student_path = path_join(common_snapshot, "student")
+            else:
+                task_fs.copy_from(None, task_path)
 
-        # Copy common and common/student if needed
-        # TODO: avoid copy
-        if course_fs.from_subfolder("$common").exists():
-            course_fs.from_subfolder("$common").copy_from(None, course_common_path)
-        else:
-            os.mkdir(course_common_path)
+                # Copy common and common/student if needed
+                if course_fs.from_subfolder("$common").exists():
+                    course_fs.from_subfolder("$common").copy_from(None, course_common_path)
+                else:
+                    os.makedirs(course_common_path, exist_ok=True)
 
-        if course_fs.from_subfolder("$common").from_subfolder("student").exists():
-            course_fs.from_subfolder("$common").from_subfolder("student").copy_from(None, course_common_student_path)
-        else:
-            os.mkdir(course_common_student_path)
+                if course_fs.from_subfolder("$common").from_subfolder("student").exists():
+                    course_fs.from_subfolder("$common").from_subfolder("student").copy_from(None, course_common_student_path)
+                else:
+                    os.makedirs(course_common_student_path, exist_ok=True)
 
-        # Run the container
-        try:
-            container_id = self._docker.sync.create_container(environment, enable_network, mem_limit, task_path,
-                                                              sockets_path, course_common_path,
-                                                              course_common_student_path, ports)
+            os.chmod(task_path, 0o777)
+            if not os.path.exists(student_path):
+                os.mkdir(student_path)
+                os.chmod(student_path, 0o777)
         except Exception as e:
-            self._logger.warning("Cannot create container! %s", str(e), exc_info=True)
-            shutil.rmtree(container_path)
+            self._logger.warning("Cannot copy the files of the task! %s", str(e), exc_info=True)
+            self.__release_container_path(container_path)
+            if pooled is not None:
+                self.__remove_pooled_container(container_id, container_path)
             for p in ports:
                 self._external_ports.add(ports[p])
-            raise CannotCreateJobException('Cannot create container.')
+            raise CannotCreateJobException('Cannot copy the files of the task.')
+
+        # Run the container
+        if pooled is None:
+            try:
+                container_id = self._docker.sync.create_container(environment, enable_network, mem_limit, task_path,
+                                                                  sockets_path, course_common_path,
+                                                                  course_common_student_path, ports, task_layers)
+            except Exception as e:
+                self._logger.warning("Cannot create container! %s", str(e), exc_info=True)
+                self.__release_container_path(container_path)
+                for p in ports:
+                    self._external_ports.add(ports[p])
+                raise CannotCreateJobException('Cannot create container.')
 
         # Store info
         self._containers_running[container_id] = message, container_path, future_results
@@ -282,7 +360,7 @@ class DockerAgent(Agent):
             self._docker.sync.start_container(container_id)
         except Exception as e:
             self._logger.warning("Cannot start container! %s", str(e), exc_info=True)
-            shutil.rmtree(container_path)
+            self.__release_container_path(container_path)
             for p in ports:
                 self._external_ports.add(ports[p])
 
@@ -305,13 +383,62 @@ class DockerAgent(Agent):
             "run_cmd": run_cmd
         }
 
+    def __create_container_path(self):
+        """ Creates the directory in which the data of a job is stored, and the sockets directory. Returns its path """
+        container_path = tempfile.mkdtemp(dir=self._tmp_dir)
+        _, sockets_path, _, _ = self.__get_container_paths(container_path)
+        os.mkdir(sockets_path)
+        os.chmod(container_path, 0o777)
+        os.chmod(sockets_path, 0o777)
+        os.mkdir(path_join(container_path, 'course'))
+        return container_path
+
+    def __release_container_path(self, container_path):
+        """ Deletes the directory of a job, and releases the snapshots it used """
+        shutil.rmtree(container_path, ignore_errors=True)
+        if self._snapshots is not None:
+            self._snapshots.release(container_path)
+
+    @staticmethod
+    def __get_container_paths(container_path):
+        """ Returns the paths of the directories of a job mounted in its container """
+        task_path = path_join(container_path, 'task')  # tmp_dir/id/task/
+        sockets_path = path_join(container_path, 'sockets')  # tmp_dir/id/socket/
+        course_common_path = path_join(container_path, 'course', 'common')
+        course_common_student_path = path_join(container_path, 'course', 'common', 'student')
+        return task_path, sockets_path, course_common_path, course_common_student_path
+
+    def __create_pooled_container(self, key):
+        """
+        Creates a container for the pool, with its (empty) directories: as mounts are set at creation, the files of the
+        task are copied in these directories when the container is claimed by a job
+        """
+        _, environment, enable_network, mem_limit = key
+        container_path = self.__create_container_path()
+        task_path, sockets_path, course_common_path, course_common_student_path = self.__get_container_paths(container_path)
+        os.makedirs(course_common_student_path)
+        os.mkdir(task_path)
+        try:
+            container_id = self._docker.sync.create_container(environment, enable_network, mem_limit, task_path, sockets_path,
+                                                              course_common_path, course_common_student_path)
+        except:
+            shutil.rmtree(container_path)
+            raise
+        return container_id, container_path
+
+    def __remove_pooled_container(self, container_id, container_path):
+        try:
+            self._docker.sync.remove_container(container_id)
+        finally:
+            shutil.rmtree(container_path, ignore_errors=True)
+
     async def new_job(self, message: BackendNewJob):
         """
         Handles a new job: starts the grading container
         """
         self._logger.info("Received request for jobid %s", message.job_id)
         future_results = asyncio.Future()
-        out = await self._loop.run_in_executor(None, lambda: self.__new_job_sync(message, future_results))
+        out = await self._loop.run_in_executor(self._io_executor, lambda: self.__new_job_sync(message, future_results))
         self._create_safe_task(self.handle_running_container(**out, future_results=future_results))
         await self._timeout_watcher.register_container(out["container_id"], out["orig_time_limit"], out["orig_hard_time_limit"])
 
@@ -627,6 +754,8 @@ class DockerAgent(Agent):
             except PermissionError:
                 self._logger.debug("Cannot remove old container path!")
                 pass  # todo: run a docker container to force removal
+            if self._snapshots is not None:
+                await self._loop.run_in_executor(self._io_executor, self._snapshots.release, container_path)
 
             # Return!
             await self.send_job_result(message.job_id, result, error_msg, grade, problems, tests, custom, state, archive, stdout, stderr)
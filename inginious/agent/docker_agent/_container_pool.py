@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+from inginious.common.metrics import Metrics
+
+
+class ContainerPool(object):
+    """
+        Containers created in advance (but not started) for the grading environments in use, so that the jobs only have
+        to start them.
+
+        Containers are identified by a key (environment name, image id, network, memory limit), as these parameters
+        cannot be changed once a container is created. The number of containers kept for a key is the number of jobs
+        that asked for it during the last `window` seconds, bounded by `max_size`: the environments that are not used
+        anymore are drained.
+    """
+
+    def __init__(self, create, remove, max_size, window=60.0, metrics=None, executor=None):
+        """
+        :param create: function(key) creating a container for the key, returning a tuple (container_id, data). Blocking
+        :param remove: function(container_id, data) removing a container made by create. Blocking
+        :param max_size: maximum number of containers kept for each key
+        :param window: number of seconds during which the requests for a key are taken into account
+        :param metrics: the Metrics object in which the statistics of the pool are stored. A new one is created if None
+        :param executor: the executor in which create and remove are called. The default executor of the loop if None
+        """
+        self._create = create
+        self._remove = remove
+        self._max_size = max_size
+        self._window = window
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._executor = executor
+        self._logger = logging.getLogger("inginious.agent.docker")
+
+        self._lock = threading.Lock()  # containers are claimed from the threads creating the jobs
+        self._containers = {}  # key -> deque of (container_id, data, creation time in seconds), oldest first
+        self._requests = {}  # key -> deque of the times at which a container was asked for, oldest first
+        self._loop = asyncio.get_event_loop()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+
+    def claim(self, key):
+        """
+        Takes a container out of the pool. Thread-safe.
+        :return: a tuple (container_id, data), or None if no container is available for the key
+        """
+        with self._lock:
+            self._requests.setdefault(key, deque()).append(time.time())
+            containers = self._containers.get(key)
+            container = containers.popleft() if containers else None
+            self._set_size(key[0])
+
+        labels = {"environment": key[0]}
+        if container is None:
+            self._metrics.inc("agent_container_pool_requests_total", dict(labels, result="miss"))
+        else:
+            self._metrics.inc("agent_container_pool_requests_total", dict(labels, result="hit"))
+            self._metrics.inc("agent_container_pool_saved_seconds_total", labels, container[2])
+
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return container[:2] if container is not None else None
+
+    def start(self):
+        """ Starts creating and removing containers to follow the demand """
+        self._task = self._loop.create_task(self._run())
+
+    async def close(self):
+        """ Stops creating containers, and removes all the containers of the pool """
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task  # a container may be being created
+
+        with self._lock:
+            containers = [container for containers in self._containers.values() for container in containers]
+            environments = {key[0] for key in self._containers}
+            self._containers = {}
+            for environment in environments:
+                self._set_size(environment)
+        for container_id, data, _ in containers:
+            await self._remove_container(container_id, data)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await self._refill()
+            except Exception:
+                self._logger.exception("Error while refilling the container pool")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._window / 4)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _refill(self):
+        for key, target in self._get_targets().items():
+            while not self._closing:
+                with self._lock:
+                    containers = self._containers.setdefault(key, deque())
+                    surplus = containers.popleft() if len(containers) > target else None
+                    missing = len(containers) < target
+                    self._set_size(key[0])
+                if surplus is not None:
+                    await self._remove_container(*surplus[:2])
+                elif missing:
+                    try:
+                        start = time.time()
+                        container_id, data = await self._loop.run_in_executor(self._executor, self._create, key)
+                        duration = time.time() - start
+                    except Exception:
+                        self._logger.warning("Cannot create a container for the pool of %s", key[0], exc_info=True)
+                        break
+                    with self._lock:
+                        self._containers.setdefault(key, deque()).append((container_id, data, duration))
+                        self._set_size(key[0])
+                else:
+                    break
+
+            if target == 0:
+                with self._lock:
+                    if not self._containers.get(key):
+                        self._containers.pop(key, None)
+
+    def _get_targets(self):
+        """ Returns the number of containers to keep for each key, and forgets the keys that are not used anymore """
+        limit = time.time() - self._window
+        targets = {}
+        with self._lock:
+            for key in set(self._requests) | set(self._containers):
+                requests = self._requests.get(key, deque())
+                while requests and requests[0] < limit:
+                    requests.popleft()
+                targets[key] = min(self._max_size, len(requests))
+                if not requests:
+                    self._requests.pop(key, None)
+                if not targets[key] and not self._containers.get(key):
+                    self._containers.pop(key, None)
+                    del targets[key]
+        return targets
+
+    async def _remove_container(self, container_id, data):
+        try:
+            await self._loop.run_in_executor(self._executor, self._remove, container_id, data)
+        except Exception:
+            self._logger.warning("Cannot remove container %s of the pool", container_id, exc_info=True)
+
+    def _set_size(self, environment):
+        """ Updates the gauge of the number of containers of an environment. Must be called with the lock held """
+        size = sum(len(containers) for key, containers in self._containers.items() if key[0] == environment)
+        self._metrics.set("agent_container_pool_size", size, {"environment": environment})
@@ -7,24 +7,77 @@
     (not asyncio) Interface to Docker
 """
 import os
+import threading
+import time
 from datetime import datetime
+from functools import wraps
+
 import docker
 import logging
 
+from inginious.common.metrics import Metrics
+
 DOCKER_AGENT_VERSION = 2
 
+
+def _timed(func):
+    """
+        Records the duration of the calls to a method of DockerInterface, and their failures, in its metrics.
+        Not used on the methods returning a stream, as only the opening of the stream would be timed.
+    """
+    @wraps(func)
+    def timed(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        except Exception:
+            self._metrics.inc("docker_call_errors_total", {"call": func.__name__})
+            raise
+        finally:
+            self._metrics.observe("docker_call_seconds", time.perf_counter() - start, {"call": func.__name__})
+    return timed
+
+
 class DockerInterface(object):  # pragma: no cover
     """
         (not asyncio) Interface to Docker
 
+        A single Docker client is shared by all the threads using the interface: its HTTP connections to the daemon
+        are kept open and reused. The operations on existing containers use the low-level API, which avoids fetching
+        the description of the container before each of them.
+
         We do not test coverage here, as it is a bit complicated to interact with docker in tests.
         Docker-py itself is already well tested.
     """
 
+    def __init__(self, max_connections=10, metrics=None):
+        """
+        :param max_connections: number of HTTP connections to the daemon kept open. Should be at least the number of
+                                threads making calls to the interface, plus the number of open streams (stats, events)
+        :param metrics: the Metrics object in which the duration of the calls is recorded. A new one is created if None
+        """
+        self._max_connections = max_connections
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._client = None
+        self._client_lock = threading.Lock()
+
     @property
     def _docker(self):
-        return docker.from_env()
-    
+        """ The Docker client, created at the first use """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = docker.from_env(max_pool_size=self._max_connections)
+        return self._client
+
+    def close(self):
+        """ Closes the connections to the daemon """
+        with self._client_lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    @_timed
     def get_containers(self):
         """
         :return: a dict of available containers in the form
@@ -65,6 +118,7 @@ class DockerInterface(object):  # pragma: no cover
                 latest[img_c["title"]] = {"id": img_id, "created": img_c["created"], "ports": img_c["ports"]}
         return latest
 
+    @_timed
     def get_host_ip(self, env_with_dig='ingi/inginious-c-default'):
         """
         Get the external IP of the host of the docker daemon. Uses OpenDNS internally.
@@ -81,8 +135,9 @@ class DockerInterface(object):  # pragma: no cover
         except:
             return None
 
+    @_timed
     def create_container(self, environment, network_grading, mem_limit, task_path, sockets_path,
-                         course_common_path, course_common_student_path, ports=None):
+                         course_common_path, course_common_student_path, ports=None, task_layers=None):
         """
         Creates a container.
         :param environment: env to start (name/id of a docker image)
@@ -91,6 +146,11 @@ class DockerInterface(object):  # pragma: no cover
         :param task_path: path to the task directory that will be mounted in the container
         :param sockets_path: path to the socket directory that will be mounted in the container
         :param ports: dictionary in the form {docker_port: external_port}
+        :param task_layers: None, or a tuple (snapshot_path, work_path, student_path, systemfiles_path). The task directory
+                            is then an overlay of the read-only snapshot of the task, whose writable layer is task_path,
+                            and work_path is the (empty) work directory of the overlay, on the same filesystem. The student
+                            and systemfiles subdirectories are mounted from student_path and systemfiles_path, as they are
+                            shared with the student containers.
         :return: the container id
         """
         task_path = os.path.abspath(task_path)
@@ -100,6 +160,23 @@ class DockerInterface(object):  # pragma: no cover
         if ports is None:
             ports = {}
 
+        volumes = {
+            task_path: {'bind': '/task'},
+            sockets_path: {'bind': '/sockets'},
+            course_common_path: {'bind': '/course/common', 'mode': 'ro'},
+            course_common_student_path: {'bind': '/course/common/student', 'mode': 'ro'}
+        }
+        mounts = []
+        if task_layers is not None:
+            snapshot_path, work_path, student_path, systemfiles_path = (os.path.abspath(path) for path in task_layers)
+            # An anonymous volume: it is removed with the container
+            del volumes[task_path]
+            options = "lowerdir={},upperdir={},workdir={}".format(snapshot_path, task_path, work_path)
+            mounts.append(docker.types.Mount("/task", None, no_copy=True, driver_config=docker.types.DriverConfig(
+                "local", {"type": "overlay", "device": "overlay", "o": options})))
+            volumes[student_path] = {'bind': '/task/student'}
+            volumes[systemfiles_path] = {'bind': '/task/systemfiles'}
+
         response = self._docker.containers.create(
             environment,
             stdin_open=True,
@@ -109,15 +186,12 @@ class DockerInterface(object):  # pragma: no cover
             oom_kill_disable=True,
             network_mode=("bridge" if (network_grading or len(ports) > 0) else 'none'),
             ports=ports,
-            volumes={
-                task_path: {'bind': '/task'},
-                sockets_path: {'bind': '/sockets'},
-                course_common_path: {'bind': '/course/common', 'mode': 'ro'},
-                course_common_student_path: {'bind': '/course/common/student', 'mode': 'ro'}
-            }
+            volumes=volumes,
+            mounts=mounts
         )
         return response.id
 
+    @_timed
     def create_container_student(self, parent_container_id, environment, network_grading, mem_limit,  student_path,
                                  socket_path, systemfiles_path, course_common_student_path):
         """
@@ -154,14 +228,16 @@ class DockerInterface(object):  # pragma: no cover
         )
         return response.id
 
+    @_timed
     def start_container(self, container_id):
         """ Starts a container (obviously) """
-        self._docker.containers.get(container_id).start()
+        self._docker.api.start(container_id)
 
+    @_timed
     def attach_to_container(self, container_id):
         """ A socket attached to the stdin/stdout of a container. The object returned contains a get_socket() function to get a socket.socket
         object and  close_socket() to close the connection """
-        sock = self._docker.containers.get(container_id).attach_socket(params={
+        sock = self._docker.api.attach_socket(container_id, params={
             'stdin': 1,
             'stdout': 1,
             'stderr': 0,
@@ -170,10 +246,11 @@ class DockerInterface(object):  # pragma: no cover
         # fix a problem with docker-py; we must keep a reference of sock at every time
         return FixDockerSocket(sock)
 
+    @_timed
     def get_logs(self, container_id):
         """ Return the full stdout/stderr of a container"""
-        stdout = self._docker.containers.get(container_id).logs(stdout=True, stderr=False).decode('utf8')
-        stderr = self._docker.containers.get(container_id).logs(stdout=False, stderr=True).decode('utf8')
+        stdout = self._docker.api.logs(container_id, stdout=True, stderr=False).decode('utf8')
+        stderr = self._docker.api.logs(container_id, stdout=False, stderr=True).decode('utf8')
         return stdout, stderr
 
     def get_stats(self, container_id):
@@ -181,20 +258,22 @@ class DockerInterface(object):  # pragma: no cover
         :param container_id:
         :return: an iterable that contains dictionnaries with the stats of the running container. See the docker api for content.
         """
-        return self._docker.containers.get(container_id).stats(decode=True)
+        return self._docker.api.stats(container_id, decode=True)
 
+    @_timed
     def remove_container(self, container_id):
         """
         Removes a container (with fire)
         """
-        self._docker.containers.get(container_id).remove(v=True, link=False, force=True)
+        self._docker.api.remove_container(container_id, v=True, link=False, force=True)
 
+    @_timed
     def kill_container(self, container_id, signal=None):
         """
         Kills a container
         :param signal: custom signal. Default is SIGKILL.
         """
-        self._docker.containers.get(container_id).kill(signal)
+        self._docker.api.kill(container_id, signal)
 
     def event_stream(self, filters=None):
         """
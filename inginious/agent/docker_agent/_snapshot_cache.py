@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import msgpack
+
+from inginious.common.filesystems.provider import NotFoundException
+from inginious.common.metrics import Metrics
+
+FICLONE = 0x40049409  # ioctl cloning a file on the filesystems supporting reflinks (btrfs, xfs, ...)
+
+
+class TaskSnapshotCache(object):
+    """
+        Local copies (snapshots) of the directories of the tasks (the task itself, $common), identified by the version
+        of their files, so that the files are copied from the tasks filesystem once per version instead of once per
+        job. Snapshots must not be modified: they are either mounted read-only in the containers (alone, or as the lower
+        layer of an overlay), or cloned.
+
+        The version of a directory is computed from the modification times of all its files. It is computed again only
+        when the modification time of the directory changes, or after `key_ttl` seconds, as the files modified in place
+        do not change the modification time of their directory.
+
+        The snapshots that are not used by a job are evicted, least recently used first, when their total size exceeds
+        `max_size` bytes.
+    """
+
+    def __init__(self, path, max_size, metrics=None, key_ttl=10.0):
+        """
+        :param path: directory in which the snapshots are stored
+        :param max_size: maximum total size of the snapshots, in bytes
+        :param metrics: the Metrics object in which the statistics of the cache are stored. A new one is created if None
+        :param key_ttl: maximum time, in seconds, during which the version of a directory whose modification time did not
+                        change is reused
+        """
+        self._path = path
+        self._max_size = max_size
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._lock = threading.Lock()  # jobs are created in several threads
+        self._snapshots = OrderedDict()  # key -> [path, size in bytes, set of users], least recently used first
+        self._key_locks = {}  # key -> lock held while the snapshot is materialized
+        self._key_ttl = key_ttl
+        self._keys = {}  # (prefix, subfolders) -> (modification time of the directory, time of the computation, key)
+        self._size = 0
+        os.makedirs(path, exist_ok=True)
+
+    def acquire(self, fs, user, subfolders=()):
+        """
+        Returns the path of a snapshot of the current version of a directory, and marks it as used by `user` until
+        release(user) is called. Thread-safe.
+        :param fs: FileSystemProvider of the directory. If the directory does not exist, the snapshot is empty
+        :param user: an hashable identifying the user of the snapshot (for example, the directory of a job)
+        :param subfolders: subfolders created in the snapshot if they do not exist
+        """
+        key = self._get_key(fs, subfolders)
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None:
+                snapshot[2].add(user)
+                self._snapshots.move_to_end(key)
+                self._metrics.inc("agent_task_snapshot_requests_total", {"result": "hit"})
+                return snapshot[0]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:  # the same version may be asked for by several jobs at once
+            with self._lock:
+                snapshot = self._snapshots.get(key)
+                if snapshot is not None:
+                    snapshot[2].add(user)
+                    self._metrics.inc("agent_task_snapshot_requests_total", {"result": "hit"})
+                    return snapshot[0]
+
+            try:
+                path, size = self._materialize(fs, key, subfolders)
+            except:
+                with self._lock:
+                    del self._key_locks[key]
+                raise
+            self._metrics.inc("agent_task_snapshot_requests_total", {"result": "miss"})
+            with self._lock:
+                self._snapshots[key] = [path, size, {user}]
+                self._size += size
+                del self._key_locks[key]
+                evicted = self._evict()
+
+        for evicted_path in evicted:
+            shutil.rmtree(evicted_path, ignore_errors=True)
+        return path
+
+    def release(self, user):
+        """ Marks the snapshots used by `user` as unused """
+        with self._lock:
+            for snapshot in self._snapshots.values():
+                snapshot[2].discard(user)
+            evicted = self._evict()
+        for path in evicted:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _get_key(self, fs, subfolders):
+        """ Returns an id of the current version of the files of fs """
+        try:
+            mtime = fs.get_last_modification_time("")
+        except NotFoundException:
+            mtime = None
+        now = time.time()
+        with self._lock:
+            cached = self._keys.get((fs.prefix, subfolders))
+        if cached is not None and cached[0] == mtime and now - cached[1] < self._key_ttl:
+            return cached[2]
+
+        files = []
+        if mtime is not None:
+            files = sorted((path, fs.get_last_modification_time(path))
+                           for path in fs.list(folders=False, files=True, recursive=True))
+        key = hashlib.sha256(msgpack.dumps((fs.prefix, files, subfolders), use_bin_type=True)).hexdigest()
+        with self._lock:
+            self._keys[(fs.prefix, subfolders)] = (mtime, now, key)
+        return key
+
+    def _materialize(self, fs, key, subfolders):
+        """ Copies the files of fs in a new snapshot. Returns its path and its size """
+        path = tempfile.mkdtemp(dir=self._path, prefix=key[:16] + "-")  # an evicted version may still be being removed
+        try:
+            if fs.exists():
+                fs.copy_from(None, path)
+            for subfolder in subfolders:
+                os.makedirs(os.path.join(path, subfolder), exist_ok=True)
+            os.chmod(path, 0o755)  # mkdtemp only allows the owner
+            size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+        except:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        self._metrics.inc("agent_task_snapshot_copied_bytes_total", value=size)
+        return path, size
+
+    def _evict(self):
+        """ Forgets the least recently used snapshots until the budget is met. Must be called with the lock held """
+        evicted = []
+        for key in list(self._snapshots):
+            if self._size <= self._max_size:
+                break
+            path, size, users = self._snapshots[key]
+            if not users:
+                del self._snapshots[key]
+                self._size -= size
+                evicted.append(path)
+        self._metrics.set("agent_task_snapshot_bytes", self._size)
+        return evicted
+
+
+def clone_tree(src, dest):
+    """
+    Copies the content of the directory src in dest (which may already exist). Files are cloned (they share their
+    blocks until they are modified) on the filesystems supporting it, and copied otherwise.
+    """
+    os.makedirs(dest, exist_ok=True)
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dest_path = os.path.join(dest, name)
+        if os.path.isdir(src_path) and not os.path.islink(src_path):
+            clone_tree(src_path, dest_path)
+        else:
+            clone_file(src_path, dest_path)
+
+
+def clone_file(src, dest):
+    if os.path.islink(src):
+        shutil.copyfile(src, dest, follow_symlinks=False)
+        return
+    with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+        try:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            shutil.copyfileobj(src_file, dest_file)
@@ -9,13 +9,37 @@
 
 import asyncio
 import logging
+import os
 
 from inginious.common.asyncio_utils import AsyncIteratorWrapper
 
+# Files giving the CPU time used by the processes of a container, relative to the root of the cgroup filesystem, for
+# cgroup v2 and v1, with the systemd and cgroupfs drivers of Docker
+CGROUP_CPU_USAGE_FILES = [
+    "system.slice/docker-{}.scope/cpu.stat",
+    "docker/{}/cpu.stat",
+    "cpuacct/system.slice/docker-{}.scope/cpuacct.usage",
+    "cpuacct/docker/{}/cpuacct.usage",
+    "cpu,cpuacct/system.slice/docker-{}.scope/cpuacct.usage",
+    "cpu,cpuacct/docker/{}/cpuacct.usage"
+]
+
+
 class TimeoutWatcher(object):
-    """ Looks for container timeouts """
-    def __init__(self, docker_interface):
-        """ docker_interface is an ASYNC interface to docker """
+    """
+        Looks for container timeouts.
+
+        With the "cgroup" mode, the CPU time of all the containers is read from the cgroup filesystem by a single task,
+        every `interval` seconds. The containers whose cgroup cannot be found or read (for example, when the agent cannot
+        see the cgroup filesystem of the host) are watched with a `docker stats` stream, as with the "stats" mode.
+    """
+    def __init__(self, docker_interface, mode="stats", cgroup_root="/sys/fs/cgroup", interval=1.0):
+        """
+        :param docker_interface: an ASYNC interface to docker
+        :param mode: "cgroup" or "stats"
+        :param cgroup_root: path to the cgroup filesystem of the host
+        :param interval: number of seconds between two reads of the CPU time of the containers, in the "cgroup" mode
+        """
 
         self._logger = logging.getLogger("inginious.agent.docker")
         self._loop = asyncio.get_event_loop()
@@ -23,6 +47,11 @@ class TimeoutWatcher(object):
         self._watching = set()
         self._docker_interface = docker_interface
         self._running_asyncio_tasks = set()
+        self._mode = mode
+        self._cgroup_root = cgroup_root
+        self._interval = interval
+        self._cgroup_watching = {}  # container_id -> (path of the file giving its CPU time, timeout in seconds)
+        self._cgroup_task = None
 
     async def clean(self):
         """ Close all the running tasks watching for a container timeout. All references to
@@ -30,9 +59,13 @@ class TimeoutWatcher(object):
         """
         for x in self._running_asyncio_tasks:
             x.cancel()
+        if self._cgroup_task is not None:
+            self._cgroup_task.cancel()
         self._container_had_error = set()
         self._watching = set()
         self._running_asyncio_tasks = set()
+        self._cgroup_watching = {}
+        self._cgroup_task = None
 
 
     async def was_killed(self, container_id):
@@ -43,6 +76,7 @@ class TimeoutWatcher(object):
         """
         if container_id in self._watching:
             self._watching.remove(container_id)
+        self._cgroup_watching.pop(container_id, None)
         if container_id in self._container_had_error:
             self._container_had_error.remove(container_id)
             return "timeout"
@@ -50,18 +84,29 @@ class TimeoutWatcher(object):
 
     async def register_container(self, container_id, timeout, hard_timeout):
         self._watching.add(container_id)
+        cpu_usage_path = self._find_cpu_usage_file(container_id) if self._mode == "cgroup" else None
+        if cpu_usage_path is not None:
+            self._cgroup_watching[container_id] = (cpu_usage_path, timeout)
+            if self._cgroup_task is None:
+                self._cgroup_task = self._loop.create_task(self._watch_cgroups())
+        else:
+            self._watch_stats(container_id, timeout)
+
+        self._loop.call_later(hard_timeout, asyncio.ensure_future, self._handle_container_hard_timeout(container_id, hard_timeout))
+
+    def _watch_stats(self, container_id, timeout):
+        """ Starts a task checking the timeout of a container with docker stats """
         task = self._loop.create_task(self._handle_container_timeout(container_id, timeout))
         self._running_asyncio_tasks.add(task)
         task.add_done_callback(self._remove_safe_task)
 
-        self._loop.call_later(hard_timeout, asyncio.ensure_future, self._handle_container_hard_timeout(container_id, hard_timeout))
-
     async def _handle_container_timeout(self, container_id, timeout):
         """
         Check timeout with docker stats
         :param container_id:
         :param timeout: in seconds (cpu time)
         """
+        source = None
         try:
             docker_stats = await self._docker_interface.get_stats(container_id)
             source = AsyncIteratorWrapper(docker_stats)
@@ -79,6 +124,57 @@ class TimeoutWatcher(object):
             pass
         except:
             self._logger.exception("Exception in _handle_container_timeout")
+        finally:
+            if source is not None:
+                source.close()  # stops the thread reading the stream
+
+    def _find_cpu_usage_file(self, container_id):
+        """ Returns the path of the file giving the CPU time used by a container, or None if it cannot be found """
+        for path in CGROUP_CPU_USAGE_FILES:
+            path = os.path.join(self._cgroup_root, path.format(container_id))
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def _read_cpu_usage(path):
+        """ Returns the CPU time, in nanoseconds, in a cpu.stat (cgroup v2) or cpuacct.usage (cgroup v1) file """
+        with open(path) as f:
+            content = f.read()
+        if path.endswith("cpuacct.usage"):
+            return int(content)
+        for line in content.splitlines():
+            name, value = line.split()
+            if name == "usage_usec":
+                return int(value) * 1000
+        raise ValueError("No usage_usec in %s" % path)
+
+    async def _watch_cgroups(self):
+        """ Checks the timeout of all the containers watched through their cgroup, every `interval` seconds """
+        try:
+            while True:
+                for container_id, (path, timeout) in list(self._cgroup_watching.items()):
+                    try:
+                        usage = self._read_cpu_usage(path)  # files of the cgroup filesystem are in memory
+                    except (OSError, ValueError):
+                        # the cgroup may have been moved or be unreadable while the container still runs
+                        self._cgroup_watching.pop(container_id, None)
+                        if container_id in self._watching:
+                            self._logger.debug("Cannot read the CPU time of container %s in %s, watching it with docker stats",
+                                               container_id, path)
+                            self._watch_stats(container_id, timeout)
+                        continue
+                    if usage > timeout * (10 ** 9):
+                        self._logger.info("Killing container %s as it used %i CPU seconds (max was %i)",
+                                          container_id, int(usage / (10 ** 9)), timeout)
+                        self._cgroup_watching.pop(container_id, None)
+                        await self._kill_it_with_fire(container_id)
+                await asyncio.sleep(self._interval)
+        except asyncio.CancelledError:
+            pass
+        except:
+            self._logger.exception("Exception in _watch_cgroups")
+            self._cgroup_task = None
 
     async def _handle_container_hard_timeout(self, container_id, hard_timeout):
         """
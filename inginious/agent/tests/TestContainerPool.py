@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import asyncio
+import itertools
+
+from inginious.agent.docker_agent._container_pool import ContainerPool
+
+KEY = ("default", "sha256:1234", False, 100)
+
+
+class TestContainerPool(object):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.ids = itertools.count()
+        self.created = []
+        self.removed = []
+        self.pool = ContainerPool(self.create, self.remove, 2, window=60.0)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def create(self, key):
+        container_id = "%s-%i" % (key[0], next(self.ids))
+        self.created.append(container_id)
+        return container_id, "/tmp/" + container_id
+
+    def remove(self, container_id, data):
+        self.removed.append(container_id)
+
+    def refill(self):
+        self.loop.run_until_complete(self.pool._refill())
+
+    def test_demand(self):
+        """ Containers are created for the keys that were asked for, up to the maximum size """
+        assert self.pool.claim(KEY) is None
+        self.refill()
+        assert self.created == ["default-0"]
+
+        assert self.pool.claim(KEY) == ("default-0", "/tmp/default-0")
+        assert self.pool.claim(KEY) is None
+        self.refill()
+        assert len(self.created) == 3  # 3 requests, but at most 2 containers in the pool
+
+        stats = self.pool._metrics.collect()["counters"]
+        assert stats[("agent_container_pool_requests_total", (("environment", "default"), ("result", "hit")))] == 1
+        assert stats[("agent_container_pool_requests_total", (("environment", "default"), ("result", "miss")))] == 2
+
+    def test_drain_unused(self):
+        self.pool.claim(KEY)
+        self.refill()
+        self.pool._window = 0.0  # the request is now too old
+        self.refill()
+        assert self.removed == ["default-0"]
+        assert self.pool._containers == {} and self.pool._requests == {}
+
+    def test_close(self):
+        self.pool.claim(KEY)
+        self.pool.start()
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.loop.run_until_complete(self.pool.close())
+        assert self.created == ["default-0"] and self.removed == ["default-0"]
+        assert self.pool._metrics.collect()["gauges"] == {("agent_container_pool_size", (("environment", "default"),)): 0}
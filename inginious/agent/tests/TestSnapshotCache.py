@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import os
+import shutil
+import tempfile
+import time
+
+from inginious.agent.docker_agent._snapshot_cache import TaskSnapshotCache, clone_tree
+from inginious.common.filesystems.local import LocalFSProvider
+
+
+class TestSnapshotCache(object):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fs = LocalFSProvider(os.path.join(self.dir, "tasks"))
+        for task in ("task1", "task2"):
+            self.fs.put(task + "/run", "#!/bin/bash\necho " + task)
+            self.fs.put(task + "/student/template.py", "x" * 100)
+        self.cache = TaskSnapshotCache(os.path.join(self.dir, "snapshots"), 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def requests(self):
+        counters = self.cache._metrics.collect()["counters"]
+        return {result: counters.get(("agent_task_snapshot_requests_total", (("result", result),)), 0) for result in ("hit", "miss")}
+
+    def test_versions(self):
+        """ Files are copied once per version of the task """
+        path = self.cache.acquire(self.fs.from_subfolder("task1"), "job1")
+        assert self.cache.acquire(self.fs.from_subfolder("task1"), "job2") == path
+        with open(os.path.join(path, "student", "template.py")) as f:
+            assert f.read() == "x" * 100
+
+        self.fs.put("task1/run", "#!/bin/bash\necho changed")
+        os.utime(os.path.join(self.fs.prefix, "task1", "run"), (time.time() + 10, time.time() + 10))
+        os.utime(os.path.join(self.fs.prefix, "task1"), (time.time() + 10, time.time() + 10))
+        new_path = self.cache.acquire(self.fs.from_subfolder("task1"), "job3")
+        assert new_path != path
+        with open(os.path.join(new_path, "run")) as f:
+            assert f.read() == "#!/bin/bash\necho changed"
+        assert self.requests() == {"hit": 1, "miss": 2}
+
+    def test_cached_versions(self):
+        """ The files are listed again only when the directory changes, or when the version is too old """
+        path = self.cache.acquire(self.fs.from_subfolder("task1"), "job1")
+        self.fs.put("task1/run", "#!/bin/bash\necho changed")
+        os.utime(os.path.join(self.fs.prefix, "task1", "run"), (time.time() + 10, time.time() + 10))
+        assert self.cache.acquire(self.fs.from_subfolder("task1"), "job2") == path
+
+        self.cache._key_ttl = 0
+        assert self.cache.acquire(self.fs.from_subfolder("task1"), "job3") != path
+
+    def test_missing(self):
+        """ A missing directory gives an empty snapshot, with the subfolders asked for """
+        path = self.cache.acquire(self.fs.from_subfolder("$common"), "job1", ("student",))
+        assert os.listdir(path) == ["student"]
+
+    def test_eviction(self):
+        """ Unused snapshots are removed when the budget is exceeded, the least recently used first """
+        self.cache = TaskSnapshotCache(os.path.join(self.dir, "snapshots"), 150)
+        path1 = self.cache.acquire(self.fs.from_subfolder("task1"), "job1")
+        path2 = self.cache.acquire(self.fs.from_subfolder("task2"), "job2")
+        assert os.path.exists(path1)  # still used by job1
+
+        self.cache.release("job1")
+        assert not os.path.exists(path1)
+        assert os.path.exists(path2)
+        assert self.cache._metrics.collect()["gauges"][("agent_task_snapshot_bytes", ())] == self.cache._size
+
+        self.cache.release("job2")
+        assert os.path.exists(path2)  # within the budget
+
+    def test_clone(self):
+        path = self.cache.acquire(self.fs.from_subfolder("task1"), "job1")
+        dest = os.path.join(self.dir, "job1", "task")
+        clone_tree(path, dest)
+        with open(os.path.join(dest, "student", "template.py"), "w") as f:
+            f.write("modified")
+        with open(os.path.join(path, "student", "template.py")) as f:
+            assert f.read() == "x" * 100
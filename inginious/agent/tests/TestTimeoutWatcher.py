@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import asyncio
+import os
+import shutil
+import tempfile
+
+from inginious.agent.docker_agent._timeout_watcher import TimeoutWatcher
+
+
+class FakeDockerInterface(object):
+    """ Async interface to docker, giving stats streams with a fixed CPU time """
+    def __init__(self):
+        self.killed = []
+        self.stats = {}
+
+    async def get_stats(self, container_id):
+        return iter([{"cpu_stats": {"cpu_usage": {"total_usage": self.stats[container_id]}}}])
+
+    async def kill_container(self, container_id):
+        self.killed.append(container_id)
+
+
+class TestTimeoutWatcher(object):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.cgroup_root = tempfile.mkdtemp()
+        self.docker = FakeDockerInterface()
+        self.watcher = TimeoutWatcher(self.docker, "cgroup", self.cgroup_root, interval=0.01)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.watcher.clean())
+        self.loop.close()
+        shutil.rmtree(self.cgroup_root)
+
+    def set_usage(self, path, content):
+        path = os.path.join(self.cgroup_root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def run(self, duration=0.1):
+        self.loop.run_until_complete(asyncio.sleep(duration))
+
+    def test_cgroup(self):
+        """ The containers of cgroup v1 and v2 are watched by a single task, and killed when they exceed their timeout """
+        self.set_usage("system.slice/docker-a.scope/cpu.stat", "usage_usec 1000000\nuser_usec 900000\nsystem_usec 100000\n")
+        self.set_usage("cpuacct/docker/b/cpuacct.usage", "1000000000\n")
+        self.loop.run_until_complete(self.watcher.register_container("a", 2, 60))
+        self.loop.run_until_complete(self.watcher.register_container("b", 2, 60))
+        self.run()
+        assert self.docker.killed == []
+        assert len(self.watcher._running_asyncio_tasks) == 0
+
+        self.set_usage("cpuacct/docker/b/cpuacct.usage", "3000000000\n")
+        self.run()
+        assert self.docker.killed == ["b"]
+        assert self.loop.run_until_complete(self.watcher.was_killed("b")) == "timeout"
+        assert self.loop.run_until_complete(self.watcher.was_killed("a")) is None
+        assert self.watcher._cgroup_watching == {}
+
+    def test_gone(self):
+        """ Containers whose cgroup cannot be read anymore are watched with docker stats, until they are done """
+        self.docker.stats["a"] = 3 * 10 ** 9
+        self.set_usage("docker/a/cpu.stat", "usage_usec 1000\n")
+        self.set_usage("docker/b/cpu.stat", "usage_usec 1000\n")
+        self.loop.run_until_complete(self.watcher.register_container("a", 2, 60))
+        self.loop.run_until_complete(self.watcher.register_container("b", 2, 60))
+        self.loop.run_until_complete(self.watcher.was_killed("b"))
+        self.watcher._cgroup_watching["b"] = self.watcher._cgroup_watching["a"]  # b is done, but still in the cgroup loop
+        shutil.rmtree(os.path.join(self.cgroup_root, "docker"))
+        self.run()
+        assert self.watcher._cgroup_watching == {}
+        assert self.docker.killed == ["a"]
+
+    def test_fallback(self):
+        """ Containers whose cgroup is not found are watched with docker stats """
+        self.docker.stats["a"] = 3 * 10 ** 9
+        self.loop.run_until_complete(self.watcher.register_container("a", 2, 60))
+        self.run()
+        assert self.docker.killed == ["a"]
+        assert self.watcher._cgroup_task is None
+
+    def test_hard_timeout(self):
+        self.set_usage("docker/a/cpu.stat", "usage_usec 1000\n")
+        self.loop.run_until_complete(self.watcher.register_container("a", 2, 0.05))
+        self.run()
+        assert self.docker.killed == ["a"]
+        assert self.loop.run_until_complete(self.watcher.was_killed("a")) == "timeout"
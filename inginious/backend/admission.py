@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+
+class AdmissionController(object):
+    """
+        Refuses the new jobs that would make the queue grow beyond a given length, or that would give a single
+        submitter too many jobs in flight (waiting or running).
+
+        The submitter of a job is its user (the @username field of the input data, as sent by the frontend), or its
+        launcher when there is no user (for example, jobs launched by plugins). Submitters are distinguished by client,
+        as two frontends may have users with the same name.
+    """
+
+    QUEUE_FULL_MESSAGE = "Too many submissions are waiting to be graded. Please retry in a few minutes."
+    TOO_MANY_JOBS_MESSAGE = "You already have {} submissions being graded. Please wait for their results before submitting again."
+
+    def __init__(self, max_queue_length=None, max_jobs_per_submitter=None):
+        """
+        :param max_queue_length: maximum number of waiting jobs per environment, or None
+        :param max_jobs_per_submitter: maximum number of waiting or running jobs per submitter, or None
+        """
+        self._max_queue_length = max_queue_length
+        self._max_jobs_per_submitter = max_jobs_per_submitter
+        self._in_flight = {}  # submitter -> number of waiting or running jobs
+
+    def get_submitter(self, client_addr, message):
+        """ Returns the submitter of a ClientNewJob message """
+        username = message.inputdata.get("@username") if isinstance(message.inputdata, dict) else None
+        return client_addr, ("user", username) if username else ("launcher", message.launcher)
+
+    def check(self, client_addr, message, queue_length):
+        """
+        Checks if a new job can be added to the queue
+        :param queue_length: the number of jobs waiting for the environment of the job
+        :return: None if the job is accepted, or a tuple (reason, message to show to the submitter)
+        """
+        if self._max_queue_length is not None and queue_length >= self._max_queue_length:
+            return "queue_full", self.QUEUE_FULL_MESSAGE
+
+        if self._max_jobs_per_submitter is not None and \
+                self._in_flight.get(self.get_submitter(client_addr, message), 0) >= self._max_jobs_per_submitter:
+            return "too_many_jobs", self.TOO_MANY_JOBS_MESSAGE.format(self._max_jobs_per_submitter)
+
+        return None
+
+    def add(self, client_addr, message):
+        """ Must be called when a job enters the queue """
+        submitter = self.get_submitter(client_addr, message)
+        self._in_flight[submitter] = self._in_flight.get(submitter, 0) + 1
+
+    def remove(self, client_addr, message):
+        """ Must be called when a job leaves the backend (it is done, killed or lost) """
+        submitter = self.get_submitter(client_addr, message)
+        nb_jobs = self._in_flight.get(submitter, 0) - 1
+        if nb_jobs > 0:
+            self._in_flight[submitter] = nb_jobs
+        else:
+            self._in_flight.pop(submitter, None)
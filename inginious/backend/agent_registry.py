@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+
+class AgentRegistry(object):
+    """
+        Registry of the agents connected to the backend, with their number of free job slots and their free resources.
+
+        Agents that have at least one free slot are indexed by environment, which allows to find the agents able to
+        run a job in a set of environments without visiting every slot of every agent.
+
+        Info about an agent is available as a dict, via registry[agent_addr], in the form
+        {
+            "name": "friendly_name",
+            "environments": environment_dict,        # as described in AgentHello
+            "topics": frozenset(environment_names),
+            "slots": total_number_of_job_slots,
+            "free_slots": number_of_free_job_slots,
+            "resources": {"memory": 8192, "cpu": 4},  # resources of the agent, as described in AgentHello
+            "free_resources": {"memory": 2048, "cpu": 3}  # resources not reserved by running jobs
+        }
+
+        Resources are reserved by take_slot() and released by release_slot(), according to the demand of the job (a dict
+        in the same form, see Backend._get_resource_demand). A resource that is not announced by an agent is not limited
+        on this agent.
+    """
+
+    def __init__(self):
+        self._agents = {}
+        self._free_by_environment = {}  # environment -> {agent_addr: None}, agents having at least one free slot
+
+    def __contains__(self, agent_addr):
+        return agent_addr in self._agents
+
+    def __getitem__(self, agent_addr):
+        return self._agents[agent_addr]
+
+    def __iter__(self):
+        return iter(self._agents)
+
+    def __len__(self):
+        return len(self._agents)
+
+    def items(self):
+        return self._agents.items()
+
+    def register(self, agent_addr, friendly_name, environments, slots, resources=None):
+        """ Registers an agent. Any previous registration of the same address must have been removed before """
+        resources = dict(resources or {})
+        self._agents[agent_addr] = {"name": friendly_name, "environments": environments, "topics": frozenset(environments),
+                                    "slots": slots, "free_slots": 0, "resources": resources, "free_resources": dict(resources)}
+        for _ in range(slots):
+            self.release_slot(agent_addr)
+
+    def __delitem__(self, agent_addr):
+        agent = self._agents.pop(agent_addr)
+        if agent["free_slots"] > 0:
+            self._unindex(agent_addr, agent)
+
+    def take_slot(self, agent_addr, demand=None):
+        """ Marks a slot of the agent as used, and reserves the resources in demand. The agent must have at least one free slot """
+        agent = self._agents[agent_addr]
+        self._reserve(agent, demand, -1)
+        agent["free_slots"] -= 1
+        if agent["free_slots"] == 0:
+            self._unindex(agent_addr, agent)
+
+    def release_slot(self, agent_addr, demand=None):
+        """ Marks a slot of the agent as free, and releases the resources in demand """
+        agent = self._agents[agent_addr]
+        self._reserve(agent, demand, 1)
+        agent["free_slots"] += 1
+        if agent["free_slots"] == 1:
+            for environment in agent["topics"]:
+                self._free_by_environment.setdefault(environment, {})[agent_addr] = None
+
+    def available_agents(self, environments):
+        """
+        :param environments: an iterable of environment names
+        :return: a list of the addresses of the agents with at least one free slot that can run at least one of the environments
+        """
+        if len(environments) == 1:
+            return list(self._free_by_environment.get(next(iter(environments)), ()))
+        agents = {}
+        for environment in environments:
+            agents.update(self._free_by_environment.get(environment, {}))
+        return list(agents)
+
+    def fits(self, agent_addr, demand, free=True):
+        """
+        :param demand: the resources needed by a job
+        :param free: if True, checks the free resources of the agent. Else, checks its total resources.
+        :return: True if the demand can be satisfied by the agent
+        """
+        resources = self._agents[agent_addr]["free_resources" if free else "resources"]
+        for resource, amount in demand.items():
+            if resource in resources and resources[resource] < amount:
+                return False
+        return True
+
+    def can_ever_run(self, environment, demand):
+        """ Returns True if at least one agent can run the environment and has enough resources in total for the demand """
+        for agent_addr, agent in self._agents.items():
+            if environment in agent["topics"] and self.fits(agent_addr, demand, free=False):
+                return True
+        return False
+
+    def _reserve(self, agent, demand, sign):
+        """ Adds sign * demand to the free resources of the agent """
+        if demand:
+            free = agent["free_resources"]
+            for resource, amount in demand.items():
+                if resource in free:
+                    free[resource] += sign * amount
+
+    def _unindex(self, agent_addr, agent):
+        """ Removes the agent from the index of agents having a free slot """
+        for environment in agent["topics"]:
+            free = self._free_by_environment.get(environment)
+            if free is not None:
+                free.pop(agent_addr, None)
+                if not free:
+                    del self._free_by_environment[environment]
@@ -3,17 +3,25 @@
 # This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
 # more information about the licensing of this file.
 import asyncio
+import heapq
 import logging
 import queue
 import time
+import uuid
 import zmq
 from zmq.asyncio import Poller
 
-from inginious.backend.topic_priority_queue import TopicPriorityQueue
-from inginious.common.message_meta import ZMQUtils
+from inginious.backend.agent_registry import AgentRegistry
+from inginious.backend.runtime_stats import RuntimeStatistics
+from inginious.backend.topic_priority_queue import IndexedTopicPriorityQueue
+from inginious.common import compression
+from inginious.common.base import DEFAULT_MEMORY_LIMIT, MIN_MEMORY_LIMIT
+from inginious.common.message_meta import ZMQUtils, WIRE_VERSION
+from inginious.common.metrics import Metrics
 from inginious.common.messages import BackendNewJob, AgentJobStarted, AgentJobDone, AgentJobSSHDebug, \
     BackendJobDone, BackendJobStarted, BackendJobSSHDebug, ClientNewJob, ClientKillJob, BackendKillJob, AgentHello, ClientHello, \
-    BackendUpdateEnvironments, Unknown, Ping, Pong, ClientGetQueue, BackendGetQueue
+    BackendUpdateEnvironments, Unknown, Ping, Pong, ClientGetQueue, BackendGetQueue, ClientSubscribeQueue, BackendQueueSnapshot, \
+    BackendQueueDelta, BackendQueueEstimates, ClientKillJobs, BackendKillJobs
 
 
 class Backend(object):
@@ -22,7 +30,31 @@ class Backend(object):
         Schedule jobs on agents.
     """
 
-    def __init__(self, context, agent_addr, client_addr):
+    # Maximum number of waiting jobs that are set aside, during a dispatch pass, because they need more resources than an agent has free
+    RESOURCE_LOOKAHEAD = 100
+
+    def __init__(self, context, agent_addr, client_addr, fair_share=None, journal=None, batch_size=1000, locality=None,
+                 max_waits=None, admission=None, max_retries=1, compression=None):
+        """
+        :param context: ZeroMQ context for this process
+        :param agent_addr: address to which the agents connect
+        :param client_addr: address to which the clients connect
+        :param fair_share: a FairShareScheduler used to share the agents between tenants (courses, launchers or clients),
+                           or None to order the waiting jobs by priority and insertion time only
+        :param journal: a QueueJournal in which the waiting and running jobs are recorded, and from which they are recovered
+                        when the backend starts, or None
+        :param batch_size: maximum number of messages handled before the waiting jobs are dispatched to the agents
+        :param locality: a LocalityTracker used to send the jobs to the agents that recently ran the same task, or None
+        :param max_waits: a dict {priority: seconds}. Waiting jobs of these priorities that have waited for more than the
+                          given number of seconds are started before any other job, so that jobs of low priority are not
+                          delayed forever by jobs of higher priority
+        :param admission: an AdmissionController that refuses the new jobs when the queue is too long, or None
+        :param max_retries: number of times a job is put back in the queue when the agent running it is lost, before
+                            being answered with a crash
+        :param compression: list of the names of the codecs that can be used to compress the large messages sent to the
+                            agents and the clients, by order of preference. Each agent or client receives messages
+                            compressed with the first codec it supports, if any
+        """
         self._content = context
         self._loop = asyncio.get_event_loop()
         self._agent_addr = agent_addr
@@ -36,6 +68,9 @@ class Backend(object):
         self._agent_socket.ipv6 = True
         self._client_socket.ipv6 = True
 
+        # Clients have a fixed identity; let a reconnecting client take over its previous connection
+        self._client_socket.router_handover = 1
+
         self._poller = Poller()
         self._poller.register(self._agent_socket, zmq.POLLIN)
         self._poller.register(self._client_socket, zmq.POLLIN)
@@ -47,24 +82,58 @@ class Backend(object):
         self._environments = {}
         self._registered_clients = set()  # addr of registered clients
 
-        # Dict of registered agents
-        # {
-        #     agent_address: {"name": "friendly_name", "environments": environment_dict}
-        # } environment_dict is a described in AgentHello.
-        self._registered_agents = {}
-
-        # addr of available agents. May contain multiple times the same agent, because some agent can
-        # manage multiple jobs at once!
-        self._available_agents = []
+        # Registered agents, with their number of free job slots, indexed by environment
+        # agent_address: {"name": "friendly_name", "environments": environment_dict, ...}
+        # environment_dict is a described in AgentHello. See AgentRegistry.
+        self._registered_agents = AgentRegistry()
 
         # ping count per addr of agents
         self._ping_count = {}
+        self._ping_sent_time = {}  # time at which the last ping was sent, per addr of agents
 
-        # These two share the same objects! Tuples should never be recreated.
-        self._waiting_jobs_pq = TopicPriorityQueue() # priority queue for waiting jobs
+        # These two share the same objects! Tuples should never be recreated, as the priority queue identifies them by identity.
+        self._waiting_jobs_pq = IndexedTopicPriorityQueue() # priority queue for waiting jobs
         self._waiting_jobs = {}  # mapping job to job message, with key: [(client_addr_as_bytes, ClientNewJob])]
-
-        self._job_running = {}  # indicates on which agent which job is running. format: {BackendJobId:(addr_as_bytes,ClientNewJob,start_time)}
+        # format of the jobs: (priority, fair_share_tag, insert_time, client_addr_as_bytes, job_id, ClientNewJob)
+        self._fair_share = fair_share
+        self._journal = journal
+        self._locality = locality
+        self._admission = admission
+
+        # Jobs whose priority has a maximum waiting time are also indexed by deadline (the time at which they should start)
+        self._max_waits = dict(max_waits or {})
+        self._deadlines_pq = IndexedTopicPriorityQueue()  # priority queue of (deadline, job) tuples
+        self._deadlines = {}  # (client_addr_as_bytes, job_id) -> (deadline, job) tuple in _deadlines_pq
+
+        self._job_running = {}  # indicates on which agent which job is running. format: {BackendJobId:(addr_as_bytes,ClientNewJob,start_time,insert_time,fair_share_tag)}
+        self._max_retries = max_retries
+        self._compression = list(compression or [])
+        self._peer_codecs = {}  # addr_as_bytes -> compression codec of the large messages sent to this agent or client
+        self._peer_wire_versions = {}  # addr_as_bytes -> version of the wire format of the messages sent to this agent or client
+        self._job_retries = {}  # BackendJobId -> number of times the job was put back in the queue after losing its agent
+        self._recovered_running = {}  # client_addr -> ids of its jobs that were running when the backend stopped, not answered yet
+        self._runtime_stats = RuntimeStatistics()  # run times of the last jobs of each task, used to estimate the waiting times
+
+        # Clients subscribed to the queue updates, and queue changes not sent yet to them
+        self._queue_subscribers = set()
+        self._queue_epoch = uuid.uuid4().hex  # identifies this run of the backend in the queue updates
+        self._queue_seq = 0  # sequence number of the last BackendQueueDelta sent
+        self._queue_events = []
+        self._queue_events_delay = 1.0  # changes are grouped and sent at most once per delay, in seconds
+        self._queue_events_flush_scheduled = False
+        self._queue_estimates_delay = 10.0  # estimates are computed and sent at most once per delay, in seconds
+        self._queue_estimates_tolerance = 5.0  # an estimate is sent again when it moves by more than this, in seconds
+        self._queue_estimates_time = 0.0  # time at which the estimates were last computed
+        self._queue_estimates_scheduled = False
+        self._sent_estimates = {}  # (client_addr, job_id) -> time at which the job should start or end, as last sent
+
+        # Messages are handled by batches, followed by a single dispatch of the waiting jobs
+        self._batch_size = batch_size
+        self._in_batch = False
+        self._update_queue_needed = False
+
+        self._metrics = Metrics()
+        self._metrics.add_collector(self._collect_metrics)
 
     async def handle_agent_message(self, agent_addr, message):
         """Dispatch messages received from agents to the right handlers"""
@@ -79,78 +148,184 @@ class Backend(object):
             func = message_handlers[message.__class__]
         except:
             raise TypeError("Unknown message type %s" % message.__class__)
-        self._create_safe_task(func(agent_addr, message))
+        await self._call_handler(func(agent_addr, message))
 
     async def handle_client_message(self, client_addr, message):
         """Dispatch messages received from clients to the right handlers"""
 
         # Verify that the client is registered
         if message.__class__ != ClientHello and client_addr not in self._registered_clients:
-            await ZMQUtils.send_with_addr(self._client_socket, client_addr, Unknown())
+            await self._send_to_client(client_addr, Unknown())
             return
 
+        # The client is connected again after a restart of the backend
+        if client_addr in self._recovered_running:
+            await self._answer_recovered_running(client_addr)
+
         message_handlers = {
             ClientHello: self.handle_client_hello,
             ClientNewJob: self.handle_client_new_job,
             ClientKillJob: self.handle_client_kill_job,
+            ClientKillJobs: self.handle_client_kill_jobs,
             ClientGetQueue: self.handle_client_get_queue,
+            ClientSubscribeQueue: self.handle_client_subscribe_queue,
             Ping: self.handle_client_ping
         }
         try:
             func = message_handlers[message.__class__]
         except:
             raise TypeError("Unknown message type %s" % message.__class__)
-        self._create_safe_task(func(client_addr, message))
+        await self._call_handler(func(client_addr, message))
 
     async def send_environment_update_to_client(self, client_addrs):
         """ :param client_addrs: list of clients to which we should send the update """
         self._logger.debug("Sending environments updates...")
         available_environments = {idx: environment[3] for idx, environment in self._environments.items()}
-        msg = BackendUpdateEnvironments(available_environments)
+        environment_versions = {idx: environment[0] for idx, environment in self._environments.items()}
+        msg = BackendUpdateEnvironments(available_environments, environment_versions)
         for client in client_addrs:
-            await ZMQUtils.send_with_addr(self._client_socket, client, msg)
+            await self._send_to_client(client, msg)
 
-    async def handle_client_hello(self, client_addr, _: ClientHello):
+    async def handle_client_hello(self, client_addr, message: ClientHello):
         """ Handle an ClientHello message. Send available environments to the client """
         self._logger.info("New client connected %s", client_addr)
         self._registered_clients.add(client_addr)
+        self._set_peer_codec(client_addr, message.compression)
+        self._set_peer_wire_version(client_addr, message.wire_versions)
+        self._queue_subscribers.discard(client_addr)  # the client restarted, it will subscribe again if needed
         await self.send_environment_update_to_client([client_addr])
 
     async def handle_client_ping(self, client_addr, _: Ping):
         """ Handle an Ping message. Pong the client """
-        await ZMQUtils.send_with_addr(self._client_socket, client_addr, Pong())
+        await self._send_to_client(client_addr, Pong())
 
     async def handle_client_new_job(self, client_addr, message: ClientNewJob):
         """ Handle an ClientNewJob message. Add a job to the queue and triggers an update """
+        if self._admission is not None:
+            rejection = self._admission.check(client_addr, message, self._waiting_jobs_pq.topic_sizes().get(message.environment, 0))
+            if rejection is not None:
+                reason, text = rejection
+                self._logger.info("Rejecting new job %s %s: %s", client_addr, message.job_id, reason)
+                self._metrics.inc("backend_jobs_rejected_total", {"environment": message.environment, "reason": reason})
+                await self._send_to_client(client_addr, BackendJobDone(message.job_id, ("crash", text),
+                                                                       0.0, {}, {}, {}, "", None, "", ""))
+                return
+
         self._logger.info("Adding a new job %s %s to the queue", client_addr, message.job_id)
 
-        job = (message.priority, time.time(), client_addr, message.job_id, message)
+        insert_time = time.time()
+        self._add_waiting_job(client_addr, message, insert_time)
+        self._metrics.inc("backend_jobs_received_total", {"environment": message.environment})
+        if self._journal is not None:
+            self._journal.job_waiting(client_addr, message, insert_time)
+
+        self._request_update_queue()
+
+    def _add_waiting_job(self, client_addr, message: ClientNewJob, insert_time, fair_share_tag=None):
+        """
+        Adds a job to the waiting queue. fair_share_tag is the tag of a job that was already in the queue, and is put back
+        in it; new jobs receive a new tag.
+        """
+        if self._fair_share is None:
+            fair_share_tag = 0.0
+        elif fair_share_tag is None:
+            fair_share_tag = self._fair_share.enqueue(self._fair_share.get_tenant(client_addr, message))
+        else:
+            self._fair_share.requeue(self._fair_share.get_tenant(client_addr, message))
+
+        if self._admission is not None:
+            self._admission.add(client_addr, message)
+
+        job = (message.priority, fair_share_tag, insert_time, client_addr, message.job_id, message)
         self._waiting_jobs[(client_addr, message.job_id)] = job
         self._waiting_jobs_pq.put(message.environment, job)
-
-        await self.update_queue()
+        if message.priority in self._max_waits:
+            deadline = (insert_time + self._max_waits[message.priority], job)
+            self._deadlines[(client_addr, message.job_id)] = deadline
+            self._deadlines_pq.put(message.environment, deadline)
+        self._add_queue_event(("waiting", client_addr, message.job_id, message.course_id + "/" + message.task_id, message.launcher,
+                               self._get_time_limit_estimate(message), job[:3]))
 
     async def handle_client_kill_job(self, client_addr, message: ClientKillJob):
         """ Handle an ClientKillJob message. Remove a job from the waiting list or send the kill message to the right agent. """
         # Check if the job is not in the queue
         if (client_addr, message.job_id) in self._waiting_jobs:
 
-            # Erase the job reference in priority queue
-            job = self._waiting_jobs.pop((client_addr, message.job_id))
-            job[-1] = None
+            # Erase the job from the priority queue
+            self._discard_waiting_job(client_addr, message.job_id)
 
             # Do not forget to send a JobDone
-            await ZMQUtils.send_with_addr(self._client_socket, client_addr, BackendJobDone(message.job_id, ("killed", "You killed the job"),
-                                                                                           0.0, {}, {}, {}, "", None, "", ""))
+            await self._send_to_client(client_addr, BackendJobDone(message.job_id, ("killed", "You killed the job"),
+                                                                   0.0, {}, {}, {}, "", None, "", ""))
         # If the job is running, transmit the info to the agent
         elif (client_addr, message.job_id) in self._job_running:
             agent_addr = self._job_running[(client_addr, message.job_id)][0]
-            await ZMQUtils.send_with_addr(self._agent_socket, agent_addr, BackendKillJob((client_addr, message.job_id)))
+            await self._send_to_agent(agent_addr, BackendKillJob((client_addr, message.job_id)))
         else:
             self._logger.warning("Client %s attempted to kill unknown job %s", str(client_addr), str(message.job_id))
 
+    async def handle_client_kill_jobs(self, client_addr, message: ClientKillJobs):
+        """
+        Handle a ClientKillJobs message. Remove the matching jobs from the waiting list, and send the kill messages for the
+        matching running jobs, grouped by agent.
+        """
+        def matches(job_client_addr, job_msg):
+            return (message.all_clients or job_client_addr == client_addr) \
+                   and (message.course_id is None or job_msg.course_id == message.course_id) \
+                   and (message.task_id is None or job_msg.task_id == message.task_id) \
+                   and (message.launcher is None or job_msg.launcher == message.launcher)
+
+        waiting = [job_id for job_id, job in self._waiting_jobs.items() if matches(job_id[0], job[-1])]
+        for job_client_addr, job_id in waiting:
+            self._discard_waiting_job(job_client_addr, job_id)
+            await self._send_to_client(job_client_addr, BackendJobDone(job_id, ("killed", "The job was killed"),
+                                                                       0.0, {}, {}, {}, "", None, "", ""))
+
+        running = {}  # agent_addr -> list of BackendJobId
+        for job_id, (agent_addr, job_msg, _, _, _) in self._job_running.items():
+            if matches(job_id[0], job_msg):
+                running.setdefault(agent_addr, []).append(job_id)
+        for agent_addr, job_ids in running.items():
+            await self._send_to_agent(agent_addr, BackendKillJobs(job_ids))
+
+        self._logger.info("Client %s killed %i waiting jobs and %i running jobs", str(client_addr), len(waiting),
+                          sum(len(job_ids) for job_ids in running.values()))
+
+    def _discard_waiting_job(self, client_addr, job_id):
+        """ Removes a job from the waiting jobs, without running it """
+        job = self._waiting_jobs.pop((client_addr, job_id))
+        self._waiting_jobs_pq.remove(job[-1].environment, job)  # no-op if the job was already taken from the queue
+        deadline = self._deadlines.pop((client_addr, job_id), None)
+        if deadline is not None:
+            self._deadlines_pq.remove(job[-1].environment, deadline)
+        if self._fair_share is not None:
+            self._fair_share.cancel(self._fair_share.get_tenant(client_addr, job[-1]))
+        if self._admission is not None:
+            self._admission.remove(client_addr, job[-1])
+        if self._journal is not None:
+            self._journal.job_done(client_addr, job_id)
+        self._job_retries.pop((client_addr, job_id), None)
+        self._add_queue_event(("done", client_addr, job_id))
+
     async def handle_client_get_queue(self, client_addr, _: ClientGetQueue):
         """ Handles a ClientGetQueue message. Send back info about the job queue"""
+        await self._send_to_client(client_addr, BackendGetQueue(*self._get_queue_snapshot(client_addr)))
+
+    async def handle_client_subscribe_queue(self, client_addr, _: ClientSubscribeQueue):
+        """ Handles a ClientSubscribeQueue message. Send back a snapshot of the job queue, and subscribe the client to the changes """
+        await self._flush_queue_events()  # the snapshot must include all the changes sent until now
+        self._queue_subscribers.add(client_addr)
+        snapshot = BackendQueueSnapshot(self._queue_epoch, self._queue_seq, *self._get_queue_snapshot(client_addr, True))
+        now = time.time()
+        for job_id, estimate in snapshot.estimates.items():
+            self._sent_estimates[(client_addr, job_id)] = now + estimate
+        await self._send_to_client(client_addr, snapshot)
+
+    def _get_queue_snapshot(self, client_addr, order_keys=False):
+        """
+        Returns the lists of running and waiting jobs, as sent in BackendGetQueue, from the point of view of a client.
+        If order_keys is True, the order key of each waiting job is appended to its tuple, as in BackendQueueSnapshot.
+        """
         #jobs_running: a list of tuples in the form
         #(job_id, is_current_client_job, agent_name, info, launcher, started_at, max_time)
         jobs_running = list()
@@ -165,60 +340,204 @@ class Backend(object):
         #(job_id, is_current_client_job, info, launcher, max_time)
         jobs_waiting = list()
 
-        for job_client_addr, job in self._waiting_jobs.items():
+        for job in sorted(self._waiting_jobs.values()):
             msg = job[-1]
             if isinstance(msg, ClientNewJob):
-                jobs_waiting.append((msg.job_id, job_client_addr[0] == client_addr, msg.course_id+"/"+msg.task_id, msg.launcher,
-                                     self._get_time_limit_estimate(msg)))
+                jobs_waiting.append((msg.job_id, job[3] == client_addr, msg.course_id+"/"+msg.task_id, msg.launcher,
+                                     self._get_time_limit_estimate(msg)) + ((job[:3],) if order_keys else ()))
 
-        await ZMQUtils.send_with_addr(self._client_socket, client_addr, BackendGetQueue(jobs_running, jobs_waiting))
+        estimates = {job_id: estimate for (job_client_addr, job_id), estimate in self._get_estimates().items()
+                     if job_client_addr == client_addr}
+
+        return jobs_running, jobs_waiting, estimates
+
+    def _get_estimates(self):
+        """
+            Returns the estimated time before each running job ends and before each waiting job starts, in the form
+            {(client_addr, job_id): seconds}. The waiting jobs are placed, in the order of the queue, on the first job slot
+            that becomes free among the slots of the agents that can run their environment. Each slot of an agent is
+            shared between all the environments of the agent.
+        """
+        now = time.time()
+
+        # The slots of the agents that have the same environments are interchangeable: they are pooled
+        slots = {}  # environments of the agents -> number of job slots of these agents
+        for _, agent in self._registered_agents.items():
+            slots[agent["topics"]] = slots.get(agent["topics"], 0) + agent["slots"]
+
+        estimates = {}
+        free_at = {topics: [] for topics in slots}  # environments of the agents -> heap of the times at which their slots are free
+        for job_id, (agent_addr, job_msg, start_time, _, _) in self._job_running.items():
+            estimates[job_id] = self._get_remaining_time_estimate(job_msg, now - start_time)
+            if agent_addr in self._registered_agents:
+                free_at[self._registered_agents[agent_addr]["topics"]].append(now + estimates[job_id])
+        for topics, nb_slots in slots.items():
+            free_at[topics] = heapq.nsmallest(nb_slots, free_at[topics]) + [now] * (nb_slots - len(free_at[topics]))
+            heapq.heapify(free_at[topics])
+
+        candidates = {}  # environment -> heaps of the slots able to run it
+        for job in sorted(self._waiting_jobs.values()):
+            job_msg = job[-1]
+            if job_msg.environment not in candidates:
+                candidates[job_msg.environment] = [heap for topics, heap in free_at.items() if job_msg.environment in topics and heap]
+            if candidates[job_msg.environment]:
+                slots_free_at = min(candidates[job_msg.environment], key=lambda heap: heap[0])
+                start_time = heapq.heappop(slots_free_at)
+                estimates[(job[3], job[4])] = start_time - now
+                heapq.heappush(slots_free_at, start_time + self._get_runtime_estimate(job_msg))
+        return estimates
+
+    def _add_queue_event(self, event):
+        """ Adds a change of the queue (see BackendQueueDelta) to the next delta sent to the subscribed clients """
+        if not self._queue_subscribers:
+            return
+        self._queue_events.append(event)
+        if not self._queue_events_flush_scheduled:
+            self._queue_events_flush_scheduled = True
+            self._loop.call_later(self._queue_events_delay, self._create_safe_task, self._flush_queue_events())
+
+    async def _flush_queue_events(self):
+        """ Sends the pending changes of the queue to the subscribed clients """
+        self._queue_events_flush_scheduled = False
+        if not self._queue_events:
+            return
+        events, self._queue_events = self._queue_events, []
+        self._queue_seq += 1
+        await self._send_to_clients(self._queue_subscribers, BackendQueueDelta(self._queue_epoch, self._queue_seq, events))
+
+        # The changes of the queue change the estimated waiting times of the jobs
+        if not self._queue_estimates_scheduled:
+            self._queue_estimates_scheduled = True
+            delay = max(0.0, self._queue_estimates_time + self._queue_estimates_delay - time.time())
+            self._loop.call_later(delay, self._create_safe_task, self._send_queue_estimates())
+
+    async def _send_queue_estimates(self):
+        """ Sends to the subscribed clients the estimates of their jobs that changed noticeably since they were last sent """
+        self._queue_estimates_scheduled = False
+        self._queue_estimates_time = now = time.time()
+
+        changed = {}  # client_addr -> {job_id: estimate}
+        sent_estimates = {}
+        for (client_addr, job_id), estimate in self._get_estimates().items():
+            if client_addr not in self._queue_subscribers:
+                continue
+            sent = self._sent_estimates.get((client_addr, job_id))
+            if sent is None or abs(now + estimate - sent) > self._queue_estimates_tolerance:
+                changed.setdefault(client_addr, {})[job_id] = estimate
+                sent = now + estimate
+            sent_estimates[(client_addr, job_id)] = sent
+        self._sent_estimates = sent_estimates
+
+        for client_addr, client_estimates in changed.items():
+            await self._send_to_client(client_addr, BackendQueueEstimates(client_estimates))
 
     async def update_queue(self):
         """
         Send waiting jobs to available agents
         """
 
-        jobs_ignored = []
+        if self._waiting_jobs_pq.empty():
+            return  # nothing to do
+
+        # Only visit the agents that have a free slot and can run at least one of the waiting environments
+        available_agents = self._registered_agents.available_agents(self._waiting_jobs_pq.topics())
 
-        available_agents = list(self._available_agents) # do a copy to avoid bad things
+        # Fill the agents with the least free memory first, to keep room for large jobs on the others (best fit)
+        available_agents.sort(key=lambda addr: self._registered_agents[addr]["free_resources"].get("memory", float("inf")))
 
         # Loop on available agents to maximize running jobs, and break if priority queue empty
         for agent_addr in available_agents:
-            if self._waiting_jobs_pq.empty():
-                break  # nothing to do
-
-            try:
-                job = None
-                while job is None:
-                    # keep the object, do not unzip it directly! It's sometimes modified when a job is killed.
-                    job = self._waiting_jobs_pq.get(self._registered_agents[agent_addr]["environments"].keys())
-                    priority, insert_time, client_addr, job_id, job_msg = job
-
-                    # Killed job, removing it from the mapping
-                    if not job_msg:
-                        del self._waiting_jobs[(client_addr, job_id)]
-                        job = None  # repeat the while loop. we need a job
-            except queue.Empty:
-                continue  # skip agent, nothing to do!
-
-            # We have found a job, let's remove the agent from the available list
-            self._available_agents.remove(agent_addr)
-
-            # Remove the job from the queue
-            del self._waiting_jobs[(client_addr, job_id)]
-
-            # Send the job to agent
-            job_id = (client_addr, job_msg.job_id)
-            self._job_running[job_id] = (agent_addr, job_msg, time.time())
-            self._logger.info("Sending job %s %s to agent %s", client_addr, job_msg.job_id, agent_addr)
-            await ZMQUtils.send_with_addr(self._agent_socket, agent_addr, BackendNewJob(job_id, job_msg.course_id, job_msg.task_id,
-                                                                                        job_msg.inputdata, job_msg.environment,
-                                                                                        job_msg.environment_parameters,
-                                                                                        job_msg.debug))
-
-        # Let's not forget to add again the ignored jobs to the PQ.
-        for entry in jobs_ignored:
-            self._waiting_jobs_pq.put(entry)
+            set_aside = []  # jobs that need more resources than the agent has free
+            # the agent may have been removed while we were sending a job
+            while agent_addr in self._registered_agents and self._registered_agents[agent_addr]["free_slots"] > 0:
+                try:
+                    job = self._get_waiting_job(self._registered_agents[agent_addr]["topics"])
+                    priority, fair_share_tag, insert_time, client_addr, job_id, job_msg = job
+                except queue.Empty:
+                    break  # skip agent, nothing to do!
+
+                demand = self._get_resource_demand(job_msg)
+
+                # Send the job to an agent that recently ran the same task, if one is available
+                target_addr = self._get_preferred_agent(job_msg, demand, agent_addr)
+                if target_addr is None and not self._registered_agents.fits(agent_addr, demand):
+                    if not self._registered_agents.can_ever_run(job_msg.environment, demand):
+                        self._logger.warning("Job %s %s needs more resources (%s) than any agent has", client_addr, job_id, demand)
+                        self._discard_waiting_job(client_addr, job_id)
+                        await self._send_to_client(client_addr, BackendJobDone(
+                            job_id, ("crash", "Not enough resources on the agents. Please contact your course administrator."),
+                            0.0, {}, {}, {}, "", None, "", ""))
+                        continue
+                    # The job will fit once other jobs are done, or on another agent; look for smaller jobs meanwhile
+                    set_aside.append(job)
+                    if len(set_aside) >= self.RESOURCE_LOOKAHEAD:
+                        break
+                    continue
+
+                if target_addr is None:
+                    target_addr = agent_addr
+
+                if self._fair_share is not None:
+                    self._fair_share.dispatch(self._fair_share.get_tenant(client_addr, job_msg), fair_share_tag)
+
+                # Remove the job from the queue
+                del self._waiting_jobs[(client_addr, job_id)]
+                self._deadlines.pop((client_addr, job_id), None)
+
+                # We have found a job, let's take a slot of the agent and reserve the resources it needs
+                self._registered_agents.take_slot(target_addr, demand)
+                if self._journal is not None:
+                    self._journal.job_running(client_addr, job_id)
+
+                if self._locality is not None:
+                    self._locality.record(target_addr, job_msg.course_id, job_msg.task_id, job_msg.environment)
+
+                # Send the job to agent
+                job_id = (client_addr, job_msg.job_id)
+                start_time = time.time()
+                self._job_running[job_id] = (target_addr, job_msg, start_time, insert_time, fair_share_tag)
+                self._metrics.inc("backend_jobs_dispatched_total", {"environment": job_msg.environment})
+                self._add_queue_event(("running", client_addr, job_msg.job_id, self._registered_agents[target_addr]["name"],
+                                       job_msg.course_id + "/" + job_msg.task_id, job_msg.launcher, int(start_time),
+                                       self._get_time_limit_estimate(job_msg)))
+                self._metrics.observe("backend_job_wait_seconds", start_time - insert_time, {"environment": job_msg.environment})
+                self._metrics.observe("backend_job_wait_seconds_by_course", start_time - insert_time, {"course": job_msg.course_id})
+                self._logger.info("Sending job %s %s to agent %s", client_addr, job_msg.job_id, target_addr)
+                await self._send_to_agent(target_addr, BackendNewJob(job_id, job_msg.course_id, job_msg.task_id,
+                                                                     job_msg.inputdata, job_msg.environment,
+                                                                     job_msg.environment_parameters,
+                                                                     job_msg.debug))
+
+            for job in set_aside:
+                self._put_back_waiting_job(job)
+
+    def _get_waiting_job(self, topics):
+        """
+            Takes the next job to start among the waiting jobs of the given environments: the job whose deadline is the
+            most exceeded, if any, or else the first job in the order of the queue.
+            :raises: queue.Empty if there is no waiting job for these environments
+        """
+        deadline = self._deadlines_pq.peek(topics)
+        if deadline is not None and deadline[0] <= time.time():
+            self._deadlines_pq.get(topics)
+            job = deadline[1]
+            self._waiting_jobs_pq.remove(job[-1].environment, job)
+            return job
+
+        job = self._waiting_jobs_pq.get(topics)
+        deadline = self._deadlines.get((job[3], job[4]))
+        if deadline is not None:
+            self._deadlines_pq.remove(job[-1].environment, deadline)
+        return job
+
+    def _put_back_waiting_job(self, job):
+        """ Puts back in the queue a job taken with _get_waiting_job, unless it was killed meanwhile """
+        if self._waiting_jobs.get((job[3], job[4])) is not job:
+            return
+        self._waiting_jobs_pq.put(job[-1].environment, job)
+        deadline = self._deadlines.get((job[3], job[4]))
+        if deadline is not None:
+            self._deadlines_pq.put(job[-1].environment, deadline)
 
     async def handle_agent_hello(self, agent_addr, message: AgentHello):
         """
@@ -230,9 +549,11 @@ class Backend(object):
             # Delete previous instance of this agent, if any
             await self._delete_agent(agent_addr)
 
-        self._registered_agents[agent_addr] = {"name": message.friendly_name, "environments": message.available_environments}
-        self._available_agents.extend([agent_addr for _ in range(0, message.available_job_slots)])
+        self._registered_agents.register(agent_addr, message.friendly_name, message.available_environments,
+                                         message.available_job_slots, message.available_resources)
         self._ping_count[agent_addr] = 0
+        self._set_peer_codec(agent_addr, message.compression)
+        self._set_peer_wire_version(agent_addr, message.wire_versions)
 
         # update information about available environments
         for environment_name, environment_info in message.available_environments.items():
@@ -271,7 +592,7 @@ class Backend(object):
                                                     environment_info["type"])
 
         # update the queue
-        await self.update_queue()
+        self._request_update_queue()
 
         # update clients
         await self.send_environment_update_to_client(self._registered_clients)
@@ -279,7 +600,7 @@ class Backend(object):
     async def handle_agent_job_started(self, agent_addr, message: AgentJobStarted):
         """Handle an AgentJobStarted message. Send the data back to the client"""
         self._logger.debug("Job %s %s started on agent %s", message.job_id[0], message.job_id[1], agent_addr)
-        await ZMQUtils.send_with_addr(self._client_socket, message.job_id[0], BackendJobStarted(message.job_id[1]))
+        await self._send_to_client(message.job_id[0], BackendJobStarted(message.job_id[1]))
 
     async def handle_agent_job_done(self, agent_addr, message: AgentJobDone):
         """Handle an AgentJobDone message. Send the data back to the client, and start new job if needed"""
@@ -287,32 +608,44 @@ class Backend(object):
         if agent_addr in self._registered_agents:
 
 
-            if message.job_id in self._job_running:
+            if message.job_id in self._job_running and self._job_running[message.job_id][0] == agent_addr:
                 self._logger.info("Job %s %s finished on agent %s", message.job_id[0], message.job_id[1], agent_addr)
                 # Remove the job from the list of running jobs
-                del self._job_running[message.job_id]
+                _, job_msg, start_time, _, _ = self._job_running.pop(message.job_id)
+                self._job_retries.pop(message.job_id, None)
+                run_time = time.time() - start_time
+                if message.result[0] not in ("killed", "crash"):
+                    self._runtime_stats.record(job_msg.course_id, job_msg.task_id, run_time)
+                self._metrics.inc("backend_jobs_done_total", {"environment": job_msg.environment, "result": message.result[0]})
+                self._metrics.observe("backend_job_run_seconds", run_time, {"environment": job_msg.environment})
+                self._metrics.observe("backend_job_run_seconds_by_course", run_time, {"course": job_msg.course_id})
+                if self._admission is not None:
+                    self._admission.remove(message.job_id[0], job_msg)
+                if self._journal is not None:
+                    self._journal.job_done(*message.job_id)
+                self._add_queue_event(("done",) + tuple(message.job_id))
                 # The agent is available now
-                self._available_agents.append(agent_addr)
+                self._registered_agents.release_slot(agent_addr, self._get_resource_demand(job_msg))
             else:
                 self._logger.warning("Job result %s %s from agent %s was not running", message.job_id[0], message.job_id[1], agent_addr)
 
             # Sent the data back to the client, even if we didn't know the job. This ensure everything can recover
             # in case of problems.
-            await ZMQUtils.send_with_addr(self._client_socket, message.job_id[0], BackendJobDone(message.job_id[1], message.result,
-                                                                                                 message.grade, message.problems,
-                                                                                                 message.tests, message.custom,
-                                                                                                 message.state, message.archive,
-                                                                                                 message.stdout, message.stderr))
+            await self._send_to_client(message.job_id[0], BackendJobDone(message.job_id[1], message.result,
+                                                                         message.grade, message.problems,
+                                                                         message.tests, message.custom,
+                                                                         message.state, message.archive,
+                                                                         message.stdout, message.stderr))
         else:
             self._logger.warning("Job result %s %s from non-registered agent %s", message.job_id[0], message.job_id[1], agent_addr)
 
         # update the queue
-        await self.update_queue()
+        self._request_update_queue()
 
     async def handle_agent_job_ssh_debug(self, _, message: AgentJobSSHDebug):
         """Handle an AgentJobSSHDebug message. Send the data back to the client"""
-        await ZMQUtils.send_with_addr(self._client_socket, message.job_id[0], BackendJobSSHDebug(message.job_id[1], message.host, message.port,
-                                                                                                 message.password))
+        await self._send_to_client(message.job_id[0], BackendJobSSHDebug(message.job_id[1], message.host, message.port,
+                                                                         message.password))
 
     async def run(self):
         self._logger.info("Backend started")
@@ -320,20 +653,42 @@ class Backend(object):
         self._client_socket.bind(self._client_addr)
         self._loop.call_later(1, self._create_safe_task, self._do_ping())
 
+        if self._journal is not None:
+            self._recover_journal()
+            self._create_safe_task(self._journal.run())
+
         try:
             while True:
-                socks = await self._poller.poll()
-                socks = dict(socks)
-
-                # New message from agent
-                if self._agent_socket in socks:
-                    agent_addr, message = await ZMQUtils.recv_with_addr(self._agent_socket)
-                    await self.handle_agent_message(agent_addr, message)
+                await self._poller.poll()
 
-                # New message from client
-                if self._client_socket in socks:
-                    client_addr, message = await ZMQUtils.recv_with_addr(self._client_socket)
-                    await self.handle_client_message(client_addr, message)
+                # Handle all the messages that are ready (up to batch_size), alternating between agents and clients
+                self._in_batch = True
+                try:
+                    nb_messages = 0
+                    while nb_messages < self._batch_size:
+                        handled = False
+
+                        # New message from agent
+                        if self._agent_socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                            agent_addr, message = await ZMQUtils.recv_with_addr(self._agent_socket)
+                            await self.handle_agent_message(agent_addr, message)
+                            handled = True
+                            nb_messages += 1
+
+                        # New message from client
+                        if self._client_socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                            client_addr, message = await ZMQUtils.recv_with_addr(self._client_socket)
+                            await self.handle_client_message(client_addr, message)
+                            handled = True
+                            nb_messages += 1
+
+                        if not handled:
+                            break
+                finally:
+                    self._in_batch = False
+
+                # Then dispatch the waiting jobs once for the whole batch
+                await self._update_queue_if_needed()
 
         except asyncio.CancelledError:
             return
@@ -343,6 +698,10 @@ class Backend(object):
     async def _handle_pong(self, agent_addr, _ : Pong):
         """ Handle a pong """
         self._ping_count[agent_addr] = 0
+        if agent_addr in self._ping_sent_time and agent_addr in self._registered_agents:
+            round_trip_time = time.time() - self._ping_sent_time.pop(agent_addr)
+            self._metrics.observe("backend_agent_ping_seconds", round_trip_time, {"agent": self._registered_agents[agent_addr]["name"]},
+                                  buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
 
     async def _do_ping(self):
         """ Ping the agents """
@@ -358,7 +717,8 @@ class Backend(object):
                     delete_agent = True
                 else:
                     self._ping_count[agent_addr] = ping_count + 1
-                    await ZMQUtils.send_with_addr(self._agent_socket, agent_addr, Ping())
+                    self._ping_sent_time[agent_addr] = time.time()
+                    await self._send_to_agent(agent_addr, Ping())
                     delete_agent = False
             except:
                 # This should not happen, but it's better to check anyway.
@@ -375,20 +735,184 @@ class Backend(object):
 
     async def _delete_agent(self, agent_addr):
         """ Deletes an agent """
-        self._available_agents = [agent for agent in self._available_agents if agent != agent_addr]
         del self._registered_agents[agent_addr]
+        self._ping_sent_time.pop(agent_addr, None)
+        self._peer_codecs.pop(agent_addr, None)
+        self._peer_wire_versions.pop(agent_addr, None)
+        if self._locality is not None:
+            self._locality.forget_agent(agent_addr)
         await self._recover_jobs()
 
     async def _recover_jobs(self):
-        """ Recover the jobs sent to a crashed agent """
-        for (client_addr, job_id), (agent_addr, job_msg, _) in reversed(list(self._job_running.items())):
+        """
+        Recover the jobs sent to a crashed agent: put them back in the queue, with their original insertion time and fair
+        share tag, or answer them with a crash when they were already retried max_retries times
+        """
+        for (client_addr, job_id), (agent_addr, job_msg, _, insert_time, fair_share_tag) in reversed(list(self._job_running.items())):
             if agent_addr not in self._registered_agents:
-                await ZMQUtils.send_with_addr(self._client_socket, client_addr,
-                                              BackendJobDone(job_id, ("crash", "Agent restarted"),
-                                                             0.0, {}, {}, {}, "", None, None, None))
                 del self._job_running[(client_addr, job_id)]
+                if self._admission is not None:
+                    self._admission.remove(client_addr, job_msg)
+                self._add_queue_event(("done", client_addr, job_id))
+
+                retries = self._job_retries.get((client_addr, job_id), 0)
+                if retries < self._max_retries:
+                    self._logger.info("Putting job %s %s back in the queue after losing its agent (retry %i/%i)", client_addr,
+                                      job_id, retries + 1, self._max_retries)
+                    self._job_retries[(client_addr, job_id)] = retries + 1
+                    self._metrics.inc("backend_jobs_retried_total", {"environment": job_msg.environment})
+                    self._add_waiting_job(client_addr, job_msg, insert_time, fair_share_tag)
+                    if self._journal is not None:
+                        self._journal.job_waiting(client_addr, job_msg, insert_time)
+                    continue
+
+                self._job_retries.pop((client_addr, job_id), None)
+                await self._send_to_client(client_addr,
+                      BackendJobDone(job_id, ("crash", "Agent restarted"),
+                                     0.0, {}, {}, {}, "", None, None, None))
+                if self._journal is not None:
+                    self._journal.job_done(client_addr, job_id)
+
+        self._request_update_queue()
+
+    def _recover_journal(self):
+        """
+        Puts back in the queue the jobs that were waiting when the backend stopped. The jobs that were running are answered
+        with a crash once their client is connected again: the agents running them do not know this backend, which would
+        drop their results, so running them again would only run them twice.
+        """
+        jobs = self._journal.load()
+        for client_addr, message, insert_time, running in jobs:
+            # The client may still be waiting for the result: do not ask it to register again. As it does not subscribe
+            # again either, the queue updates are sent to it: their new epoch makes it ask for a new snapshot.
+            self._registered_clients.add(client_addr)
+            self._queue_subscribers.add(client_addr)
+            if running:
+                self._recovered_running.setdefault(client_addr, []).append(message.job_id)
+            else:
+                self._add_waiting_job(client_addr, message, insert_time)
+        if jobs:
+            self._logger.info("Recovered %i jobs from the journal (%i were running)", len(jobs), sum(1 for job in jobs if job[3]))
+
+    async def _answer_recovered_running(self, client_addr):
+        """ Answers with a crash the jobs of a client that were running when the backend stopped """
+        for job_id in self._recovered_running.pop(client_addr):
+            self._logger.info("Job %s %s was running when the backend stopped", client_addr, job_id)
+            await self._send_to_client(client_addr, BackendJobDone(job_id, ("crash", "The backend restarted while the job was running"),
+                                                                   0.0, {}, {}, {}, "", None, "", ""))
+            self._journal.job_done(client_addr, job_id)
+
+    def _set_peer_codec(self, addr, peer_codecs):
+        """ Chooses the codec used to compress the large messages sent to an agent or a client, given the codecs it supports """
+        codec = next((codec for codec in self._compression if codec in (peer_codecs or ())), None)
+        if codec is None:
+            self._peer_codecs.pop(addr, None)
+        else:
+            self._peer_codecs[addr] = codec
 
-        await self.update_queue()
+    def _set_peer_wire_version(self, addr, peer_wire_versions):
+        """ Chooses the version of the wire format of the messages sent to an agent or a client, given the versions it can load """
+        if WIRE_VERSION in (peer_wire_versions or ()):
+            self._peer_wire_versions[addr] = WIRE_VERSION
+        else:
+            self._peer_wire_versions.pop(addr, None)
+
+    async def _send_to_client(self, client_addr, message):
+        """ Sends a message to a client, in the wire format and with the compression codec chosen for it """
+        await ZMQUtils.send_with_addr(self._client_socket, client_addr, message, codec=self._peer_codecs.get(client_addr),
+                                      wire_version=self._peer_wire_versions.get(client_addr, 1))
+
+    async def _send_to_clients(self, client_addrs, message):
+        """ Sends the same message to several clients, serializing it only once per wire format """
+        clients = {}  # wire version -> client addrs
+        for client_addr in client_addrs:
+            clients.setdefault(self._peer_wire_versions.get(client_addr, 1), []).append(client_addr)
+        for wire_version, addrs in clients.items():
+            await ZMQUtils.send_to_many(self._client_socket, addrs, message, wire_version=wire_version)
+
+    async def _send_to_agent(self, agent_addr, message):
+        """ Sends a message to an agent, in the wire format and with the compression codec chosen for it """
+        await ZMQUtils.send_with_addr(self._agent_socket, agent_addr, message, codec=self._peer_codecs.get(agent_addr),
+                                      wire_version=self._peer_wire_versions.get(agent_addr, 1))
+
+    def _request_update_queue(self):
+        """
+        Asks for the waiting jobs to be dispatched. During a batch of messages, this is done once at the end of the batch;
+        otherwise, it is done in a new task.
+        """
+        self._update_queue_needed = True
+        if not self._in_batch:
+            self._create_safe_task(self._update_queue_if_needed())
+
+    async def _update_queue_if_needed(self):
+        """ Calls update_queue if it was requested since the last call """
+        if self._update_queue_needed:
+            self._update_queue_needed = False
+            await self.update_queue()
+
+    async def _call_handler(self, coroutine):
+        """ Runs a message handler, logging its exceptions """
+        try:
+            await coroutine
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._logger.exception("An exception occurred while handling a message")
+
+    def get_metrics(self):
+        """ Returns the Metrics object of the backend """
+        return self._metrics
+
+    def _collect_metrics(self, metrics):
+        """ Sets the gauges describing the current state of the backend """
+        metrics.clear_gauges("backend_jobs_waiting")
+        for environment, nb_jobs in self._waiting_jobs_pq.topic_sizes().items():
+            metrics.set("backend_jobs_waiting", nb_jobs, {"environment": environment})
+
+        metrics.clear_gauges("backend_job_oldest_wait_seconds")
+        oldest = {}
+        for priority, _, insert_time, _, _, _ in self._waiting_jobs.values():
+            oldest[priority] = min(oldest.get(priority, insert_time), insert_time)
+        now = time.time()
+        for priority, insert_time in oldest.items():
+            metrics.set("backend_job_oldest_wait_seconds", now - insert_time, {"priority": str(priority)})
+
+        metrics.clear_gauges("backend_jobs_running")
+        running = {}
+        for agent_addr, job_msg, _, _, _ in self._job_running.values():
+            running[job_msg.environment] = running.get(job_msg.environment, 0) + 1
+        for environment, nb_jobs in running.items():
+            metrics.set("backend_jobs_running", nb_jobs, {"environment": environment})
+
+        for gauge in ("backend_agent_slots", "backend_agent_slots_used", "backend_agent_utilization", "backend_agent_resources",
+                      "backend_agent_resources_reserved"):
+            metrics.clear_gauges(gauge)
+        for agent_addr, agent in self._registered_agents.items():
+            labels = {"agent": agent["name"], "addr": agent_addr.hex()}
+            used = agent["slots"] - agent["free_slots"]
+            metrics.set("backend_agent_slots", agent["slots"], labels)
+            metrics.set("backend_agent_slots_used", used, labels)
+            metrics.set("backend_agent_utilization", used / agent["slots"] if agent["slots"] else 0.0, labels)
+            for resource, total in agent["resources"].items():
+                resource_labels = dict(labels, resource=resource)
+                metrics.set("backend_agent_resources", total, resource_labels)
+                metrics.set("backend_agent_resources_reserved", total - agent["free_resources"][resource], resource_labels)
+
+        metrics.set("backend_agents", len(self._registered_agents))
+        metrics.set("backend_clients", len(self._registered_clients))
+
+        if self._fair_share is not None:
+            metrics.clear_gauges("backend_fair_share_jobs_waiting")
+            for tenant, stats in self._fair_share.get_stats().items():
+                metrics.set("backend_fair_share_jobs_waiting", stats["waiting"], {"tenant": tenant})
+                metrics.set("backend_fair_share_jobs_dispatched", stats["dispatched"], {"tenant": tenant})
+
+        for (codec, operation), stats in compression.get_statistics().items():
+            labels = {"codec": codec, "operation": operation}
+            metrics.set("backend_compression_operations", stats["count"], labels)
+            metrics.set("backend_compression_uncompressed_bytes", stats["uncompressed_bytes"], labels)
+            metrics.set("backend_compression_compressed_bytes", stats["compressed_bytes"], labels)
+            metrics.set("backend_compression_seconds", stats["seconds"], labels)
 
     def _create_safe_task(self, coroutine):
         """ Calls self._loop.create_task with a safe (== with logged exception) coroutine """
@@ -409,4 +933,53 @@ class Backend(object):
         try:
             return int(job_info.environment_parameters["limits"]["time"])
         except:
-            return -1 # unknown
\ No newline at end of file
+            return -1 # unknown
+
+    def _get_preferred_agent(self, job_info: ClientNewJob, demand, default_agent_addr):
+        """
+            Returns the agent that recently ran the task of a job, has a free slot and enough free resources for it, or
+            None if there is no such agent, or if default_agent_addr is as good as the others.
+        """
+        if self._locality is None:
+            return None
+        for agent_addr in self._locality.preferred_agents(job_info.course_id, job_info.task_id, job_info.environment):
+            if agent_addr == default_agent_addr:
+                return None
+            agent = self._registered_agents[agent_addr] if agent_addr in self._registered_agents else None
+            if agent is not None and agent["free_slots"] > 0 and job_info.environment in agent["topics"] \
+                    and self._registered_agents.fits(agent_addr, demand):
+                return agent_addr
+        return None
+
+    def _get_runtime_estimate(self, job_info: ClientNewJob):
+        """
+            Returns an estimate of the run time of a job: the mean run time of the last jobs of its task, or its time limit
+            if no job of the task ran recently, or 0 if it is unknown.
+        """
+        mean = self._runtime_stats.get_mean(job_info.course_id, job_info.task_id)
+        if mean is not None:
+            return mean
+        return max(self._get_time_limit_estimate(job_info), 0)
+
+    def _get_remaining_time_estimate(self, job_info: ClientNewJob, elapsed):
+        """ Returns an estimate of the remaining run time of a job that has been running for `elapsed` seconds """
+        remaining = self._runtime_stats.get_remaining(job_info.course_id, job_info.task_id, elapsed)
+        if remaining is not None:
+            return remaining
+        return max(self._get_time_limit_estimate(job_info) - elapsed, 0)
+
+    def _get_resource_demand(self, job_info: ClientNewJob):
+        """
+            Returns the resources to reserve on an agent for a given job, as given in environment_parameters["limits"].
+            The memory is in MB, and the CPU in number of CPUs. The memory defaults to the one the agents give to a
+            container without limits; the CPU is not reserved if it is not given.
+        """
+        demand = {}
+        try:
+            limits = job_info.environment_parameters.get("limits", {})
+            demand["memory"] = max(int(limits.get("memory", DEFAULT_MEMORY_LIMIT)), MIN_MEMORY_LIMIT)
+            if "cpu" in limits:
+                demand["cpu"] = float(limits["cpu"])
+        except:
+            pass  # invalid limits, the agent will refuse the job
+        return demand
\ No newline at end of file
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+
+class FairShareScheduler(object):
+    """
+        Weighted fair queuing of the waiting jobs across tenants (courses, launchers or clients).
+
+        Uses start-time fair queuing: each new job receives a virtual start tag, which is the maximum of the current
+        virtual time and the finish tag of the previous job of the same tenant. The finish tag of a job is its start
+        tag plus its cost divided by the weight of its tenant. Waiting jobs are then ordered by (priority, start tag),
+        so a tenant that enqueues thousands of jobs only delays its own jobs, and tenants share the agents
+        proportionally to their weights.
+
+        As tags never change once given, they can be used as keys in the priority queue of the backend.
+    """
+
+    TENANT_KEYS = {
+        "course": lambda client_addr, message: message.course_id,
+        "launcher": lambda client_addr, message: message.launcher,
+        "client": lambda client_addr, message: client_addr.hex() if isinstance(client_addr, bytes) else str(client_addr)
+    }
+
+    def __init__(self, tenant_key="course", weights=None, default_weight=1.0):
+        """
+        :param tenant_key: how to identify the tenant of a job. Either "course", "launcher" or "client"
+        :param weights: a dict {tenant: weight}. Tenants with a greater weight get a greater share of the agents
+        :param default_weight: weight of the tenants that are not in `weights`
+        """
+        if tenant_key not in self.TENANT_KEYS:
+            raise ValueError("Unknown fair share key %s, should be one of %s" % (tenant_key, ", ".join(self.TENANT_KEYS)))
+        if default_weight <= 0 or any(weight <= 0 for weight in (weights or {}).values()):
+            raise ValueError("Fair share weights should be positive")
+
+        self._tenant_key = tenant_key
+        self._get_tenant = self.TENANT_KEYS[tenant_key]
+        self._weights = dict(weights or {})
+        self._default_weight = default_weight
+
+        self._virtual_time = 0.0
+        self._finish_tags = {}  # tenant -> finish tag of the last job enqueued
+        self._waiting = {}  # tenant -> number of waiting jobs
+        self._dispatched = {}  # tenant -> number of jobs dispatched
+
+    def get_tenant(self, client_addr, message):
+        """ Returns the tenant of a ClientNewJob message """
+        return self._get_tenant(client_addr, message)
+
+    def get_weight(self, tenant):
+        return self._weights.get(tenant, self._default_weight)
+
+    def enqueue(self, tenant, cost=1.0):
+        """
+        Registers a new waiting job for a tenant
+        :return: the start tag of the job
+        """
+        start_tag = max(self._virtual_time, self._finish_tags.get(tenant, 0.0))
+        self._finish_tags[tenant] = start_tag + cost / self.get_weight(tenant)
+        self._waiting[tenant] = self._waiting.get(tenant, 0) + 1
+        return start_tag
+
+    def requeue(self, tenant):
+        """
+        Registers again a job of the tenant that was dispatched, but is put back in the queue (after losing its agent).
+        The job keeps its start tag, so that it does not go behind the jobs the tenant enqueued since.
+        """
+        self._waiting[tenant] = self._waiting.get(tenant, 0) + 1
+
+    def dispatch(self, tenant, start_tag):
+        """ Must be called when a job of the tenant, with the given start tag, leaves the queue to run on an agent """
+        self._virtual_time = max(self._virtual_time, start_tag)
+        self._dispatched[tenant] = self._dispatched.get(tenant, 0) + 1
+        self._remove_waiting(tenant)
+
+    def cancel(self, tenant):
+        """ Must be called when a waiting job of the tenant is removed from the queue without running """
+        self._remove_waiting(tenant)
+
+    def get_stats(self):
+        """
+        :return: a dict {tenant: {"waiting": nb_waiting_jobs, "dispatched": nb_dispatched_jobs, "weight": weight}} for all the
+                 tenants seen by the scheduler
+        """
+        return {tenant: {"waiting": self._waiting.get(tenant, 0), "dispatched": self._dispatched.get(tenant, 0),
+                         "weight": self.get_weight(tenant)}
+                for tenant in self._finish_tags}
+
+    def _remove_waiting(self, tenant):
+        self._waiting[tenant] -= 1
+        if self._waiting[tenant] == 0:
+            del self._waiting[tenant]
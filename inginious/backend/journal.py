@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+"""
+    Append-only journal of the jobs handled by the backend, allowing to recover them after a restart
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+
+import msgpack
+
+from inginious.common.message_meta import MessageMeta
+
+
+class QueueJournal(object):
+    """
+        Append-only journal of the waiting and running jobs of the backend.
+
+        Each event (new job, job sent to an agent, job done) is only appended to an in-memory buffer by the backend.
+        The buffer is written to the journal file and fsync'ed periodically, from an executor, so all the events that
+        happened during an interval are committed together (group commit) and the event loop never waits for the disk.
+        Events that happened in the last interval before a crash may be lost.
+
+        When the journal contains too many events about jobs that are done, it is compacted: it is rewritten with
+        only the jobs that are still waiting or running.
+
+        The file is a sequence of msgpack arrays:
+        - ("w", client_addr, job_id, insert_time, dumped ClientNewJob): a job was added to the queue
+        - ("r", client_addr, job_id): the job was sent to an agent
+        - ("d", client_addr, job_id): the job is done (or killed) and can be forgotten
+    """
+
+    def __init__(self, path, flush_interval=0.05, compact_threshold=10000):
+        """
+        :param path: path to the journal file. It is created if needed.
+        :param flush_interval: interval, in seconds, between two writes of the journal
+        :param compact_threshold: minimum number of events written before a compaction is considered
+        """
+        self._logger = logging.getLogger("inginious.backend.journal")
+        self._path = path
+        self._flush_interval = flush_interval
+        self._compact_threshold = compact_threshold
+
+        self._jobs = OrderedDict()  # (client_addr, job_id) -> [ClientNewJob, insert_time, running]
+        self._pending = []  # events not written yet
+        self._nb_events = 0  # number of events in the file
+        self._writing = None  # future of the write running in the executor, if any
+
+    def load(self):
+        """
+        Reads the journal file, and rewrites it with only the jobs that are not done.
+        Must be called once, before any other method.
+        :return: a list of tuples (client_addr, ClientNewJob, insert_time, running), sorted by insertion time
+        """
+        if os.path.exists(self._path):
+            with open(self._path, "rb") as journal_file:
+                try:
+                    for event in msgpack.Unpacker(journal_file, encoding="utf8", use_list=False):
+                        self._apply(event)
+                except Exception:
+                    # the end of the file may have been partially written when the backend stopped
+                    self._logger.warning("Journal %s is corrupted, ignoring its end", self._path, exc_info=True)
+
+        self._write_snapshot(list(self._jobs.items()))
+        return sorted(((client_addr, message, insert_time, running)
+                       for (client_addr, _), (message, insert_time, running) in self._jobs.items()),
+                      key=lambda job: job[2])
+
+    def job_waiting(self, client_addr, message, insert_time):
+        """ Records a new job in the queue """
+        self._jobs[(client_addr, message.job_id)] = [message, insert_time, False]
+        self._pending.append(("w", client_addr, message.job_id, insert_time, message))
+
+    def job_running(self, client_addr, job_id):
+        """ Records that a job has been sent to an agent """
+        if (client_addr, job_id) in self._jobs:
+            self._jobs[(client_addr, job_id)][2] = True
+            self._pending.append(("r", client_addr, job_id))
+
+    def job_done(self, client_addr, job_id):
+        """ Records that a job is done, killed or lost, and should not be recovered """
+        if self._jobs.pop((client_addr, job_id), None) is not None:
+            self._pending.append(("d", client_addr, job_id))
+
+    async def run(self):
+        """ Periodically writes the journal. Runs forever """
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                await asyncio.sleep(self._flush_interval)
+                await self.flush(loop)
+        except asyncio.CancelledError:
+            await self.flush(loop)
+            return
+
+    async def flush(self, loop=None):
+        """ Writes the pending events to the journal, or compacts it if it contains too many events """
+        loop = loop or asyncio.get_event_loop()
+        if not self._pending:
+            return
+
+        # A write started by a flush that was cancelled (e.g. when the backend stops) may still be running in the
+        # executor: wait for it, so the file is never written by two threads at once
+        while self._writing is not None and not self._writing.done():
+            await asyncio.wait([self._writing])
+
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        if self._nb_events + len(pending) > max(self._compact_threshold, 2 * len(self._jobs)):
+            snapshot = list(self._jobs.items())
+            self._writing = loop.run_in_executor(None, self._write_snapshot, snapshot)
+        else:
+            self._writing = loop.run_in_executor(None, self._append, pending)
+        # the write goes on even if this flush is cancelled
+        await asyncio.shield(self._writing)
+
+    def _apply(self, event):
+        """ Applies an event read from the journal """
+        if event[0] == "w":
+            _, client_addr, job_id, insert_time, message = event
+            self._jobs[(client_addr, job_id)] = [MessageMeta.load(message), insert_time, False]
+        elif event[0] == "r":
+            if (event[1], event[2]) in self._jobs:
+                self._jobs[(event[1], event[2])][2] = True
+        elif event[0] == "d":
+            self._jobs.pop((event[1], event[2]), None)
+        else:
+            raise TypeError("Unknown journal event %s" % str(event[0]))
+
+    @classmethod
+    def _encode(cls, event):
+        if event[0] == "w":
+            event = event[:4] + (event[4].dump(),)
+        return msgpack.dumps(event, encoding="utf8", use_bin_type=True)
+
+    def _append(self, events):
+        """ Appends events to the journal file (blocking) """
+        data = b"".join(self._encode(event) for event in events)
+        with open(self._path, "ab") as journal_file:
+            journal_file.write(data)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self._nb_events += len(events)
+
+    def _write_snapshot(self, jobs):
+        """ Atomically replaces the journal file by one containing only the given jobs (blocking) """
+        events = []
+        for (client_addr, job_id), (message, insert_time, running) in jobs:
+            events.append(("w", client_addr, job_id, insert_time, message))
+            if running:
+                events.append(("r", client_addr, job_id))
+
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "wb") as journal_file:
+            journal_file.write(b"".join(self._encode(event) for event in events))
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(tmp_path, self._path)
+        self._nb_events = len(events)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import time
+from collections import OrderedDict
+
+
+class LocalityTracker(object):
+    """
+        Remembers which agents recently ran jobs of a given task, to send the next jobs of the same task (or, failing
+        that, of the same course) to the agents that already have the task files and the environment in their caches.
+
+        Only the choice of the agent is affected: the order in which the waiting jobs are dispatched (priority, fair
+        share) is left unchanged.
+    """
+
+    def __init__(self, window=600.0, max_agents_per_key=16):
+        """
+        :param window: number of seconds during which an agent is considered to have a task in cache after running it
+        :param max_agents_per_key: maximum number of agents remembered for each task and for each course
+        """
+        self._window = window
+        self._max_agents_per_key = max_agents_per_key
+        self._task_agents = {}  # (course_id, task_id, environment) -> OrderedDict {agent_addr: last run}, oldest first
+        self._course_agents = {}  # (course_id, environment) -> OrderedDict {agent_addr: last run}, oldest first
+
+    def record(self, agent_addr, course_id, task_id, environment):
+        """ Records that a job of the given task has been sent to an agent """
+        now = time.time()
+        self._touch(self._task_agents, (course_id, task_id, environment), agent_addr, now)
+        self._touch(self._course_agents, (course_id, environment), agent_addr, now)
+
+    def forget_agent(self, agent_addr):
+        """ Forgets everything about an agent (for example, because it disconnected) """
+        for index in (self._task_agents, self._course_agents):
+            for key in [key for key, agents in index.items() if agent_addr in agents]:
+                del index[key][agent_addr]
+                if not index[key]:
+                    del index[key]
+
+    def preferred_agents(self, course_id, task_id, environment):
+        """
+        :return: the list of the agents that ran the task recently, most recent first, followed by the agents that
+                 ran other tasks of the course recently, most recent first
+        """
+        limit = time.time() - self._window
+        task_agents = self._recent(self._task_agents, (course_id, task_id, environment), limit)
+        course_agents = self._recent(self._course_agents, (course_id, environment), limit)
+        return task_agents + [agent_addr for agent_addr in course_agents if agent_addr not in task_agents]
+
+    def _touch(self, index, key, agent_addr, now):
+        agents = index.setdefault(key, OrderedDict())
+        agents[agent_addr] = now
+        agents.move_to_end(agent_addr)
+        if len(agents) > self._max_agents_per_key:
+            agents.popitem(last=False)
+
+    def _recent(self, index, key, limit):
+        """ Returns the agents of index[key] seen after limit, most recent first, and drops the older ones """
+        agents = index.get(key)
+        if agents is None:
+            return []
+        while agents and next(iter(agents.values())) < limit:
+            agents.popitem(last=False)
+        if not agents:
+            del index[key]
+            return []
+        return list(reversed(agents))
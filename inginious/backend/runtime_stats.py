@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import bisect
+from collections import deque
+
+
+class RuntimeStatistics(object):
+    """
+        Run times of the last jobs of each task, used to estimate how long the next jobs of the task will run.
+    """
+
+    def __init__(self, window=100):
+        """
+        :param window: number of run times kept for each task
+        """
+        self._window = window
+        self._runs = {}  # (course_id, task_id) -> deque of the last run times, oldest first
+        self._sorted_runs = {}  # (course_id, task_id) -> sorted list of the same run times
+
+    def record(self, course_id, task_id, run_time):
+        """ Records the run time of a job of a task """
+        key = (course_id, task_id)
+        runs = self._runs.get(key)
+        if runs is None:
+            runs = self._runs[key] = deque()
+            self._sorted_runs[key] = []
+        sorted_runs = self._sorted_runs[key]
+        if len(runs) == self._window:
+            del sorted_runs[bisect.bisect_left(sorted_runs, runs.popleft())]
+        runs.append(run_time)
+        bisect.insort(sorted_runs, run_time)
+
+    def get_mean(self, course_id, task_id):
+        """ Returns the mean of the last run times of a task, or None if no job of the task was recorded """
+        runs = self._runs.get((course_id, task_id))
+        if not runs:
+            return None
+        return sum(runs) / len(runs)
+
+    def get_remaining(self, course_id, task_id, elapsed):
+        """
+            Returns an estimate of the remaining run time of a job of a task that has been running for `elapsed` seconds:
+            the mean of the last run times that were longer than `elapsed`, minus `elapsed`. Returns None if no job of
+            the task was recorded, and 0 if no job ran that long.
+        """
+        sorted_runs = self._sorted_runs.get((course_id, task_id))
+        if not sorted_runs:
+            return None
+        longer = sorted_runs[bisect.bisect_right(sorted_runs, elapsed):]
+        if not longer:
+            return 0.0
+        return sum(longer) / len(longer) - elapsed
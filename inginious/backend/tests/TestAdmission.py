@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+from inginious.backend.admission import AdmissionController
+from inginious.common.messages import ClientNewJob
+
+
+def new_job(job_id, username=None, launcher="Frontend"):
+    inputdata = {"@username": username} if username else {}
+    return ClientNewJob(job_id, 0, "course", "task", inputdata, "env", {}, False, launcher)
+
+
+class TestAdmissionController(object):
+    def test_unlimited(self):
+        admission = AdmissionController()
+        for i in range(100):
+            assert admission.check(b"client", new_job(str(i), "user"), i) is None
+            admission.add(b"client", new_job(str(i), "user"))
+
+    def test_queue_length(self):
+        admission = AdmissionController(max_queue_length=10)
+        assert admission.check(b"client", new_job("1"), 9) is None
+        assert admission.check(b"client", new_job("1"), 10)[0] == "queue_full"
+
+    def test_jobs_per_submitter(self):
+        admission = AdmissionController(max_jobs_per_submitter=2)
+        jobs = [new_job(str(i), "user") for i in range(2)]
+        for job in jobs:
+            assert admission.check(b"client", job, 0) is None
+            admission.add(b"client", job)
+        assert admission.check(b"client", new_job("2", "user"), 0)[0] == "too_many_jobs"
+
+        # Other users, other clients and jobs without user are counted separately
+        assert admission.check(b"client", new_job("2", "other"), 0) is None
+        assert admission.check(b"other client", new_job("2", "user"), 0) is None
+        assert admission.check(b"client", new_job("2"), 0) is None
+
+        admission.remove(b"client", jobs[0])
+        assert admission.check(b"client", new_job("2", "user"), 0) is None
+
+    def test_launcher(self):
+        admission = AdmissionController(max_jobs_per_submitter=1)
+        admission.add(b"client", new_job("1", launcher="Plugin"))
+        assert admission.check(b"client", new_job("2", launcher="Plugin"), 0)[0] == "too_many_jobs"
+        assert admission.check(b"client", new_job("2", launcher="Frontend"), 0) is None
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+from inginious.backend.agent_registry import AgentRegistry
+
+
+class TestAgentRegistry(object):
+    def make_registry(self):
+        registry = AgentRegistry()
+        registry.register(b"a1", "agent 1", {"python": {}, "java": {}}, 2)
+        registry.register(b"a2", "agent 2", {"python": {}}, 1)
+        registry.register(b"a3", "agent 3", {"mcq": {}}, 1)
+        return registry
+
+    def test_available_agents(self):
+        registry = self.make_registry()
+        assert registry.available_agents(["python"]) == [b"a1", b"a2"]
+        assert registry.available_agents(["java", "mcq"]) == [b"a1", b"a3"]
+        assert registry.available_agents(["unknown"]) == []
+
+    def test_slots(self):
+        registry = self.make_registry()
+        registry.take_slot(b"a1")
+        assert registry[b"a1"]["free_slots"] == 1
+        assert registry.available_agents(["java"]) == [b"a1"]
+        registry.take_slot(b"a1")
+        assert registry.available_agents(["java"]) == []
+        assert registry.available_agents(["python"]) == [b"a2"]
+        registry.release_slot(b"a1")
+        assert registry.available_agents(["python", "java"]) == [b"a2", b"a1"]
+
+    def test_delete(self):
+        registry = self.make_registry()
+        del registry[b"a1"]
+        assert b"a1" not in registry
+        assert len(registry) == 2
+        assert registry.available_agents(["python", "java"]) == [b"a2"]
+
+    def test_resources(self):
+        registry = AgentRegistry()
+        registry.register(b"a1", "agent 1", {"python": {}}, 4, {"memory": 1024, "cpu": 2})
+        assert registry.fits(b"a1", {"memory": 1024})
+        assert not registry.fits(b"a1", {"memory": 2048})
+        assert registry.fits(b"a1", {"disk": 100000})  # not limited on this agent
+        registry.take_slot(b"a1", {"memory": 768, "cpu": 1})
+        assert registry[b"a1"]["free_resources"] == {"memory": 256, "cpu": 1}
+        assert not registry.fits(b"a1", {"memory": 512})
+        assert registry.fits(b"a1", {"memory": 512}, free=False)
+        assert registry.can_ever_run("python", {"memory": 1024})
+        assert not registry.can_ever_run("python", {"memory": 4096})
+        assert not registry.can_ever_run("java", {})
+        registry.release_slot(b"a1", {"memory": 768, "cpu": 1})
+        assert registry[b"a1"]["free_resources"] == {"memory": 1024, "cpu": 2}
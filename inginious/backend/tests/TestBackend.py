@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import asyncio
+import os
+import shutil
+import tempfile
+
+from zmq.asyncio import Context
+
+from inginious.backend.backend import Backend
+from inginious.backend.journal import QueueJournal
+from inginious.backend.fair_share import FairShareScheduler
+from inginious.common.base import DEFAULT_MEMORY_LIMIT
+from inginious.common.messages import AgentHello, AgentJobDone, ClientKillJob, ClientKillJobs, BackendJobDone, BackendKillJobs, BackendNewJob, ClientNewJob, Ping, Pong, ClientSubscribeQueue, \
+    BackendQueueSnapshot, BackendQueueDelta, BackendQueueEstimates, ClientHello
+
+ENVIRONMENTS = {"default": {"id": "id", "created": 0, "ports": [], "type": "docker"}}
+
+
+def new_job(job_id, course_id="course", task_id="task", launcher="test", memory=None, environment="default"):
+    limits = {"time": 10} if memory is None else {"time": 10, "memory": memory}
+    return ClientNewJob(job_id, 0, course_id, task_id, {"input": "data"}, environment, {"limits": limits}, False, launcher)
+
+
+class RecordingBackend(Backend):
+    """ A Backend whose messages are recorded instead of being sent """
+
+    def __init__(self, **kwargs):
+        super().__init__(Context(), "inproc://agents", "inproc://clients", **kwargs)
+        self.sent = []  # (addr, message)
+        self.on_send = None  # coroutine function called with each message sent, after it is recorded
+
+    def close(self):
+        self._agent_socket.close(linger=0)
+        self._client_socket.close(linger=0)
+        self._content.term()
+
+    async def _send_to_client(self, client_addr, message):
+        self.sent.append((client_addr, message))
+
+    async def _send_to_agent(self, agent_addr, message):
+        self.sent.append((agent_addr, message))
+        if self.on_send is not None:
+            await self.on_send(message)
+
+    async def _send_to_clients(self, client_addrs, message):
+        for client_addr in client_addrs:
+            self.sent.append((client_addr, message))
+
+    def pop_sent(self, message_cls):
+        """ Returns and forgets the recorded messages of the given class, as (addr, message) """
+        sent = [item for item in self.sent if isinstance(item[1], message_cls)]
+        self.sent = [item for item in self.sent if not isinstance(item[1], message_cls)]
+        return sent
+
+
+class TestBackend(object):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.dir_path = tempfile.mkdtemp()
+        self.backends = []
+
+    def tearDown(self):
+        for backend in self.backends:
+            backend.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.dir_path)
+
+    def new_backend(self, **kwargs):
+        backend = RecordingBackend(**kwargs)
+        self.backends.append(backend)
+        return backend
+
+    def handle(self, backend, *messages):
+        """ Handles a batch of (addr, message), as Backend.run does, then dispatches the waiting jobs """
+        async def handle_batch():
+            backend._in_batch = True
+            for addr, message in messages:
+                if addr.startswith(b"agent"):
+                    await backend.handle_agent_message(addr, message)
+                else:
+                    await backend.handle_client_message(addr, message)
+            backend._in_batch = False
+            await backend._update_queue_if_needed()
+        self.loop.run_until_complete(handle_batch())
+
+    def test_recover_journal(self):
+        """ After a restart, the waiting jobs are queued again, and the running ones are answered when their client is back """
+        path = os.path.join(self.dir_path, "journal")
+        journal = QueueJournal(path)
+        journal.load()
+        for job_id in ("1", "2"):
+            journal.job_waiting(b"client", new_job(job_id), 10.0)
+        journal.job_running(b"client", "1")
+        self.loop.run_until_complete(journal.flush())
+
+        backend = self.new_backend(journal=QueueJournal(path))
+        backend._recover_journal()
+        assert list(backend._waiting_jobs) == [(b"client", "2")]
+        assert backend.sent == []
+
+        self.handle(backend, (b"client", Ping()))
+        assert [(addr, message.job_id, message.result[0]) for addr, message in backend.pop_sent(BackendJobDone)] == [(b"client", "1", "crash")]
+        assert len(backend.pop_sent(Pong)) == 1
+
+        self.handle(backend, (b"agent", AgentHello("agent", 2, ENVIRONMENTS)))
+        assert [message.job_id for _, message in backend.pop_sent(BackendNewJob)] == [(b"client", "2")]
+        self.loop.run_until_complete(backend._journal.flush())
+        assert [(client_addr, message.job_id) for client_addr, message, _, _ in QueueJournal(path).load()] == [(b"client", "2")]
+
+    def test_queue_updates_after_restart(self):
+        """ The clients recovered from the journal receive the queue updates, with the epoch of the new backend """
+        path = os.path.join(self.dir_path, "journal")
+        journal = QueueJournal(path)
+        journal.load()
+        journal.job_waiting(b"client", new_job("1"), 10.0)
+        self.loop.run_until_complete(journal.flush())
+
+        backend = self.new_backend(journal=QueueJournal(path))
+        backend._recover_journal()
+        self.handle(backend, (b"client", new_job("2")))
+        self.loop.run_until_complete(backend._flush_queue_events())
+        (_, delta), = backend.pop_sent(BackendQueueDelta)
+        assert delta.epoch == backend._queue_epoch and [event[2] for event in delta.events] == ["1", "2"]
+
+    def test_queue_order_keys(self):
+        """ The waiting jobs are sent with the key giving their position in the queue """
+        backend = self.new_backend(fair_share=FairShareScheduler("course"))
+        self.handle(backend, (b"client", ClientHello("client")), (b"client", ClientSubscribeQueue()))
+        backend.sent = []
+        self.handle(backend, (b"client", new_job("1", course_id="a")), (b"client", new_job("2", course_id="a")),
+                    (b"client", new_job("3", course_id="b")))
+        self.loop.run_until_complete(backend._flush_queue_events())
+        (_, delta), = backend.pop_sent(BackendQueueDelta)
+        assert [event[2] for event in sorted(delta.events, key=lambda event: event[-1])] == ["1", "3", "2"]
+
+        self.handle(backend, (b"client", ClientSubscribeQueue()))
+        (_, snapshot), = backend.pop_sent(BackendQueueSnapshot)
+        assert [job[0] for job in snapshot.jobs_waiting] == ["1", "3", "2"]
+        assert sorted(snapshot.jobs_waiting, key=lambda job: job[-1]) == snapshot.jobs_waiting
+
+    def test_resource_lookahead(self):
+        """ A job that does not fit in the free resources of an agent does not keep smaller jobs from running on it """
+        backend = self.new_backend()
+        self.handle(backend, (b"client", ClientHello("client")), (b"agent", AgentHello("agent", 3, ENVIRONMENTS, {"memory": 1024})))
+        self.handle(backend, (b"client", new_job("1", memory=600)), (b"client", new_job("2", memory=600)),
+                    (b"client", new_job("3", memory=200)))
+        assert [message.job_id[1] for _, message in backend.pop_sent(BackendNewJob)] == ["1", "3"]
+
+        self.handle(backend, (b"agent", AgentJobDone((b"client", "1"), ("success", ""), 100.0, {}, {}, {}, "", None, "", "")))
+        assert [message.job_id[1] for _, message in backend.pop_sent(BackendNewJob)] == ["2"]
+
+    def test_default_memory(self):
+        """ A job without memory limit reserves the memory the agents give it by default """
+        backend = self.new_backend()
+        self.handle(backend, (b"client", ClientHello("client")), (b"agent", AgentHello("agent", 3, ENVIRONMENTS, {"memory": 300})))
+        self.handle(backend, (b"client", new_job("1")), (b"client", new_job("2")))
+        assert [message.job_id[1] for _, message in backend.pop_sent(BackendNewJob)] == ["1"]
+        assert backend._registered_agents[b"agent"]["free_resources"] == {"memory": 300 - DEFAULT_MEMORY_LIMIT}
+
+    def test_killed_while_set_aside(self):
+        """ A job killed while it is set aside by a dispatch is not put back in the queue """
+        backend = self.new_backend()
+        self.handle(backend, (b"client", ClientHello("client")), (b"agent", AgentHello("agent", 3, ENVIRONMENTS, {"memory": 1024})))
+        self.handle(backend, (b"client", new_job("1", memory=600)))
+
+        async def kill_2(message):
+            if message.job_id[1] == "3":
+                await backend.handle_client_kill_job(b"client", ClientKillJob("2"))
+        backend.on_send = kill_2
+        self.handle(backend, (b"client", new_job("2", memory=600)), (b"client", new_job("3", memory=200)))
+        assert backend._waiting_jobs == {} and backend._waiting_jobs_pq.empty()
+
+        backend.on_send = None
+        self.handle(backend, (b"client", new_job("4", memory=200)))
+        assert [message.job_id[1] for _, message in backend.pop_sent(BackendNewJob)] == ["1", "3", "4"]
+        assert backend._registered_agents[b"agent"]["free_slots"] == 0
+
+    def test_estimates_shared_slots(self):
+        """ The slots of an agent are shared between its environments in the estimated waiting times """
+        backend = self.new_backend()
+        environments = dict(ENVIRONMENTS, other=ENVIRONMENTS["default"])
+        self.handle(backend, (b"client", ClientHello("client")), (b"agent", AgentHello("agent", 1, environments)))
+        self.handle(backend, (b"client", new_job("1")), (b"client", new_job("2", environment="other")),
+                    (b"client", new_job("3")))
+        estimates = backend._get_estimates()
+        assert estimates[(b"client", "1")] > 0
+        assert estimates[(b"client", "2")] >= estimates[(b"client", "1")]
+        assert estimates[(b"client", "3")] >= estimates[(b"client", "2")] + estimates[(b"client", "1")]
+
+    def test_estimates_sent_when_changed(self):
+        """ Only the estimates that changed noticeably since they were last sent are sent again """
+        backend = self.new_backend()
+        self.handle(backend, (b"client", ClientHello("client")), (b"agent", AgentHello("agent", 1, ENVIRONMENTS)),
+                    (b"client", new_job("1")))
+        self.handle(backend, (b"client", ClientSubscribeQueue()))
+        (_, snapshot), = backend.pop_sent(BackendQueueSnapshot)
+        assert list(snapshot.estimates) == ["1"]
+
+        self.handle(backend, (b"client", new_job("2")))
+        self.loop.run_until_complete(backend._send_queue_estimates())
+        (_, estimates), = backend.pop_sent(BackendQueueEstimates)
+        assert list(estimates.estimates) == ["2"]
+
+        self.loop.run_until_complete(backend._send_queue_estimates())
+        assert backend.pop_sent(BackendQueueEstimates) == []
+
+    def test_retry_keeps_fair_share_tag(self):
+        """ A job put back in the queue after losing its agent goes before the jobs its tenant submitted since """
+        backend = self.new_backend(fair_share=FairShareScheduler("course"))
+        self.handle(backend, (b"client", ClientHello("client")), (b"agent", AgentHello("agent", 1, ENVIRONMENTS)))
+        self.handle(backend, (b"client", new_job("1")), (b"client", new_job("2")))
+        assert [message.job_id[1] for _, message in backend.pop_sent(BackendNewJob)] == ["1"]
+
+        # The agent restarted: the job it was running is retried
+        self.handle(backend, (b"agent", AgentHello("agent", 1, ENVIRONMENTS)))
+        assert [message.job_id[1] for _, message in backend.pop_sent(BackendNewJob)] == ["1"]
+        assert list(backend._waiting_jobs) == [(b"client", "2")]
+        assert backend._fair_share.get_stats()["course"]["waiting"] == 1
+
+    def test_kill_jobs(self):
+        """ The matching waiting jobs are answered, and the matching running jobs are killed with one message per agent """
+        backend = self.new_backend()
+        self.handle(backend, (b"client", ClientHello("client")), (b"other", ClientHello("other")),
+                    (b"agent1", AgentHello("agent1", 2, ENVIRONMENTS)), (b"agent2", AgentHello("agent2", 1, ENVIRONMENTS)))
+        self.handle(backend, (b"client", new_job("1")), (b"client", new_job("2", task_id="other")), (b"client", new_job("3")),
+                    (b"client", new_job("4")), (b"client", new_job("5", course_id="other")), (b"other", new_job("6")))
+        assert len(backend.pop_sent(BackendNewJob)) == 3
+
+        self.handle(backend, (b"client", ClientKillJobs("course", "task", None, False)))
+        assert [(addr, message.job_id) for addr, message in backend.pop_sent(BackendJobDone)] == [(b"client", "4")]
+        expected = {}
+        for job_id, (agent_addr, _, _, _, _) in backend._job_running.items():
+            if job_id[1] in ("1", "3"):
+                expected.setdefault(agent_addr, []).append(job_id)
+        assert {addr: message.job_ids for addr, message in backend.pop_sent(BackendKillJobs)} == expected
+
+        self.handle(backend, (b"client", ClientKillJobs(None, "task", "test", True)))
+        assert sorted((addr, message.job_id) for addr, message in backend.pop_sent(BackendJobDone)) == [(b"client", "5"), (b"other", "6")]
+        assert backend._waiting_jobs == {}
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+from inginious.backend.fair_share import FairShareScheduler
+from inginious.backend.topic_priority_queue import IndexedTopicPriorityQueue
+
+
+class TestFairShareScheduler(object):
+    def run(self, scheduler, jobs, nb_dispatch):
+        """ Enqueue the jobs (list of (priority, tenant)), dispatch nb_dispatch of them and returns their tenants """
+        pq = IndexedTopicPriorityQueue()
+        for idx, (priority, tenant) in enumerate(jobs):
+            pq.put("env", (priority, scheduler.enqueue(tenant), idx, tenant))
+        dispatched = []
+        for _ in range(nb_dispatch):
+            priority, tag, _, tenant = pq.get(["env"])
+            scheduler.dispatch(tenant, tag)
+            dispatched.append(tenant)
+        return dispatched
+
+    def test_replay_does_not_starve(self):
+        scheduler = FairShareScheduler()
+        jobs = [(0, "replayed")] * 1000 + [(0, "course%d" % i) for i in range(3)]
+        dispatched = self.run(scheduler, jobs, 4)
+        assert sorted(dispatched) == ["course0", "course1", "course2", "replayed"]
+
+    def test_weights(self):
+        scheduler = FairShareScheduler(weights={"big": 3})
+        jobs = [(0, "big")] * 100 + [(0, "small")] * 100
+        dispatched = self.run(scheduler, jobs, 40)
+        assert dispatched.count("big") == 30
+        assert dispatched.count("small") == 10
+
+    def test_priority_first(self):
+        scheduler = FairShareScheduler()
+        jobs = [(1, "a")] * 10 + [(0, "a")] * 10 + [(0, "b")]
+        dispatched = self.run(scheduler, jobs, 11)
+        assert dispatched.count("b") == 1
+
+    def test_stats(self):
+        scheduler = FairShareScheduler("launcher", {"API": 0.5})
+        tag = scheduler.enqueue("API")
+        scheduler.enqueue("API")
+        scheduler.enqueue("Frontend")
+        scheduler.dispatch("API", tag)
+        scheduler.cancel("Frontend")
+        assert scheduler.get_stats() == {"API": {"waiting": 1, "dispatched": 1, "weight": 0.5},
+                                         "Frontend": {"waiting": 0, "dispatched": 0, "weight": 1.0}}
+
+    def test_requeue(self):
+        scheduler = FairShareScheduler()
+        tag = scheduler.enqueue("a")
+        scheduler.dispatch("a", tag)
+        scheduler.requeue("a")
+        assert scheduler.enqueue("a") > tag
+        assert scheduler.get_stats()["a"]["waiting"] == 2
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from inginious.backend.journal import QueueJournal
+from inginious.common.messages import ClientNewJob
+
+
+def new_job(job_id):
+    return ClientNewJob(job_id, 0, "course", "task", {"input": "data"}, "default", {"limits": {"time": 10}}, False, "test")
+
+
+class TestQueueJournal(object):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir_path, "journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def flush(self, journal):
+        asyncio.new_event_loop().run_until_complete(journal.flush())
+
+    def test_recover(self):
+        journal = QueueJournal(self.path)
+        assert journal.load() == []
+        journal.job_waiting(b"client", new_job("1"), 10.0)
+        journal.job_waiting(b"client", new_job("2"), 11.0)
+        journal.job_waiting(b"client", new_job("3"), 9.0)
+        journal.job_running(b"client", "1")
+        journal.job_done(b"client", "2")
+        self.flush(journal)
+
+        jobs = QueueJournal(self.path).load()
+        assert [(client_addr, message.job_id, insert_time, running) for client_addr, message, insert_time, running in jobs] == \
+               [(b"client", "3", 9.0, False), (b"client", "1", 10.0, True)]
+        assert jobs[0][1].inputdata == {"input": "data"}
+
+    def test_compaction(self):
+        journal = QueueJournal(self.path, compact_threshold=10)
+        journal.load()
+        for i in range(20):
+            journal.job_waiting(b"client", new_job(str(i)), float(i))
+            if i != 5:
+                journal.job_done(b"client", str(i))
+        self.flush(journal)
+
+        journal = QueueJournal(self.path)
+        assert [message.job_id for _, message, _, _ in journal.load()] == ["5"]
+        assert journal._nb_events == 1
+
+    def test_truncated(self):
+        journal = QueueJournal(self.path)
+        journal.load()
+        journal.job_waiting(b"client", new_job("1"), 1.0)
+        journal.job_waiting(b"client", new_job("2"), 2.0)
+        self.flush(journal)
+        with open(self.path, "r+b") as journal_file:
+            journal_file.truncate(os.path.getsize(self.path) - 3)
+
+        assert [message.job_id for _, message, _, _ in QueueJournal(self.path).load()] == ["1"]
+        # the journal was rewritten without the truncated event
+        assert [message.job_id for _, message, _, _ in QueueJournal(self.path).load()] == ["1"]
+
+    def test_cancelled_flush(self):
+        """ A flush waits for the write of a cancelled flush before writing the journal """
+        journal = QueueJournal(self.path, flush_interval=0.01)
+        journal.load()
+        writing = threading.Event()
+        events = []
+        append = journal._append
+
+        def slow_append(pending):
+            events.append("start")
+            writing.set()
+            time.sleep(0.2)
+            append(pending)
+            events.append("end")
+        journal._append = slow_append
+
+        async def run():
+            task = asyncio.ensure_future(journal.run())
+            journal.job_waiting(b"client", new_job("1"), 1.0)
+            while not writing.is_set():
+                await asyncio.sleep(0.01)
+            journal.job_waiting(b"client", new_job("2"), 2.0)
+            task.cancel()
+            await task
+
+        asyncio.new_event_loop().run_until_complete(run())
+        assert events == ["start", "end", "start", "end"]
+        assert [message.job_id for _, message, _, _ in QueueJournal(self.path).load()] == ["1", "2"]
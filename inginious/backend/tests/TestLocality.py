@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import time
+
+from inginious.backend.locality import LocalityTracker
+
+
+class TestLocalityTracker(object):
+    def test_preferred_agents(self):
+        locality = LocalityTracker()
+        locality.record(b"a1", "course", "task1", "python")
+        locality.record(b"a2", "course", "task2", "python")
+        locality.record(b"a3", "course", "task1", "python")
+        locality.record(b"a4", "other", "task1", "python")
+        # agents that ran the task first, then the ones that ran the course, most recent first
+        assert locality.preferred_agents("course", "task1", "python") == [b"a3", b"a1", b"a2"]
+        assert locality.preferred_agents("course", "task3", "python") == [b"a3", b"a2", b"a1"]
+        assert locality.preferred_agents("course", "task1", "java") == []
+
+    def test_forget_agent(self):
+        locality = LocalityTracker()
+        locality.record(b"a1", "course", "task1", "python")
+        locality.record(b"a2", "course", "task1", "python")
+        locality.forget_agent(b"a1")
+        assert locality.preferred_agents("course", "task1", "python") == [b"a2"]
+        locality.forget_agent(b"a2")
+        assert locality.preferred_agents("course", "task1", "python") == []
+
+    def test_window(self):
+        locality = LocalityTracker(window=0.05)
+        locality.record(b"a1", "course", "task1", "python")
+        time.sleep(0.1)
+        locality.record(b"a2", "course", "task2", "python")
+        assert locality.preferred_agents("course", "task1", "python") == [b"a2"]
+
+    def test_max_agents(self):
+        locality = LocalityTracker(max_agents_per_key=2)
+        for agent_addr in (b"a1", b"a2", b"a3"):
+            locality.record(agent_addr, "course", "task1", "python")
+        assert locality.preferred_agents("course", "task1", "python") == [b"a3", b"a2"]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+from inginious.backend.runtime_stats import RuntimeStatistics
+
+
+class TestRuntimeStatistics(object):
+    def test_mean(self):
+        stats = RuntimeStatistics(window=3)
+        assert stats.get_mean("course", "task") is None
+        for run_time in (10.0, 2.0, 4.0):
+            stats.record("course", "task", run_time)
+        assert stats.get_mean("course", "task") == 16.0 / 3
+        stats.record("course", "task", 6.0)  # 10.0 leaves the window
+        assert stats.get_mean("course", "task") == 4.0
+        assert stats.get_mean("course", "other") is None
+
+    def test_remaining(self):
+        stats = RuntimeStatistics()
+        assert stats.get_remaining("course", "task", 1.0) is None
+        for run_time in (2.0, 4.0, 6.0, 8.0):
+            stats.record("course", "task", run_time)
+        assert stats.get_remaining("course", "task", 0.0) == 5.0
+        assert stats.get_remaining("course", "task", 5.0) == 2.0  # mean of 6 and 8, minus 5
+        assert stats.get_remaining("course", "task", 10.0) == 0.0
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import queue
+import random
+
+from inginious.backend.topic_priority_queue import TopicPriorityQueue, IndexedTopicPriorityQueue
+
+
+class TestIndexedTopicPriorityQueue(object):
+    def test_get_order(self):
+        pq = IndexedTopicPriorityQueue()
+        pq.put("a", (1, 1))
+        pq.put("b", (0, 2))
+        pq.put("a", (0, 3))
+        assert len(pq) == 3
+        assert pq.get(["a", "b"]) == (0, 2)
+        assert pq.get(["a"]) == (0, 3)
+        assert pq.get(["a", "b"]) == (1, 1)
+        assert pq.empty()
+
+    def test_get_empty(self):
+        pq = IndexedTopicPriorityQueue()
+        pq.put("a", (0, 1))
+        try:
+            pq.get(["b", "c"])
+            assert False
+        except queue.Empty:
+            pass
+        assert pq.empty(["b"])
+        assert not pq.empty(["a", "b"])
+
+    def test_remove(self):
+        pq = IndexedTopicPriorityQueue()
+        items = [(0, i) for i in range(5)]
+        for item in items:
+            pq.put("a", item)
+        assert pq.remove("a", items[0])
+        assert pq.remove("a", items[3])
+        assert not pq.remove("a", items[3])
+        assert not pq.remove("b", items[1])
+        assert len(pq) == 3
+        assert [pq.get(["a"]) for _ in range(3)] == [items[1], items[2], items[4]]
+        assert pq.empty()
+
+    def test_peek(self):
+        pq = IndexedTopicPriorityQueue()
+        assert pq.peek(["a"]) is None
+        first, second = (0, "first"), (1, "second")
+        pq.put("a", second)
+        pq.put("b", first)
+        assert pq.peek(["a", "b"]) is first
+        assert pq.peek(["a"]) is second
+        assert len(pq) == 2
+        assert pq.get(["a", "b"]) is first
+
+    def test_put_removed(self):
+        pq = IndexedTopicPriorityQueue()
+        items = [(i, "item") for i in range(3)]
+        for item in items:
+            pq.put("a", item)
+        assert pq.remove("a", items[1])
+        pq.put("a", items[1])
+        assert len(pq) == 3
+        assert [pq.get(["a"]) for _ in range(3)] == items
+        assert pq.empty()
+
+    def test_compaction(self):
+        pq = IndexedTopicPriorityQueue()
+        items = [(0, i) for i in range(1000)]
+        for item in items:
+            pq.put("a", item)
+        for item in items[1:900]:
+            pq.remove("a", item)
+        assert len(pq.queues["a"]) < 1000
+        assert pq.get(frozenset(["a"])) == items[0]
+        assert [pq.get(["a"]) for _ in range(100)] == items[900:]
+
+    def test_same_as_topic_priority_queue(self):
+        """ Both queues should return the same elements, whatever the order of the operations """
+        rand = random.Random(42)
+        topics = ["t%d" % i for i in range(10)]
+        topic_sets = [rand.sample(topics, rand.randint(1, 5)) for _ in range(5)]
+        old, new = TopicPriorityQueue(), IndexedTopicPriorityQueue()
+        for i in range(5000):
+            if rand.random() < 0.6:
+                item = (rand.randint(0, 3), i)
+                topic = rand.choice(topics)
+                old.put(topic, item)
+                new.put(topic, item)
+            else:
+                topic_set = rand.choice(topic_sets)
+                try:
+                    expected = old.get(topic_set)
+                except queue.Empty:
+                    expected = None
+                try:
+                    got = new.get(topic_set)
+                except queue.Empty:
+                    got = None
+                assert expected == got
+        assert len(old) == len(new)
@@ -1,5 +1,5 @@
 import queue
-from heapq import heappush, heappop
+from heapq import heappush, heappop, heapify
 
 
 class TopicPriorityQueue:
@@ -46,3 +46,197 @@ class TopicPriorityQueue:
             raise queue.Empty()
         self.size -= 1
         return heappop(self.queues[best_topic])
+
+
+class IndexedTopicPriorityQueue:
+    """
+    A queue which supports getting elements by topics, indexed by the sets of topics that are asked for.
+
+    Each topic has its own heap. For each distinct set of topics given to get(), an index heap containing the heads
+    of the heaps of the topics in the set is maintained, which allows to find the best element among these topics
+    without scanning them. Removed elements are discarded lazily and the heaps are compacted in bulk when they
+    contain too many of them.
+
+    Items must be unique (in the sense of `is`) and totally ordered.
+    """
+
+    # Compact a heap when it contains at least this number of removed items, and more removed items than live ones
+    COMPACT_MIN_REMOVED = 64
+
+    def __init__(self):
+        self.queues = {}  # topic -> heap of items (may contain removed items)
+        self.size = 0
+        self._live = {}  # topic -> set of id() of the live items in the heap
+        self._removed = {}  # topic -> set of id() of removed items still in the heap
+        self._groups = {}  # frozenset of topics -> heap of (item, topic) containing the head of each topic
+        self._topic_groups = {}  # topic -> list of frozensets containing this topic
+
+    def __len__(self):
+        return self.size
+
+    def empty(self, topics=None):
+        if topics is None:
+            return self.size == 0
+        for topic in topics:
+            if self._live.get(topic):
+                return False
+        return True
+
+    def put(self, topic, item):
+        """
+        This operation is in O(k log n), where n is the size of the queue for the given topic and k the number of
+        distinct sets of topics containing this topic
+        """
+        self._add_topic(topic)
+        heap = self.queues[topic]
+        if id(item) in self._removed[topic]:
+            # The item was removed but is still in the heap, at a valid position: revive it
+            self._removed[topic].remove(id(item))
+        else:
+            heappush(heap, item)
+        self._live[topic].add(id(item))
+        self.size += 1
+
+        if self._head(topic) is item:
+            self._push_head(topic)
+
+    def get(self, topics=None):
+        """
+        This operation is in O(k log n) (amortized) where n is the size of the queue and k the number of distinct
+        sets of topics containing the topic of the returned element. The first call with a new set of topics is in
+        O(m) where m is the number of topics.
+
+        :param topics: a list of topics. Giving a frozenset avoids rebuilding it at each call.
+        :return: the smallest elements that fits in one of the topics
+        :raises: queue.Empty exception if the queue has no elements that fits in any of the topics
+        """
+        item, topic, group = self._peek(topics)
+        if item is None:
+            raise queue.Empty()
+
+        heappop(self.queues[topic])
+        heappop(group)
+        self._live[topic].remove(id(item))
+        self.size -= 1
+        self._push_head(topic)
+        return item
+
+    def peek(self, topics=None):
+        """
+        Same as get(), but does not remove the element from the queue.
+
+        :return: the smallest elements that fits in one of the topics, or None if there is no such element
+        """
+        return self._peek(topics)[0]
+
+    def remove(self, topic, item):
+        """
+        Removes an item from the queue. This operation is in O(1) (amortized), unless the item is the head of its
+        topic, in which case it has the same complexity as put().
+
+        :return: True if the item was in the queue, False else
+        """
+        if id(item) not in self._live.get(topic, ()):
+            return False
+
+        was_head = self._head(topic) is item
+        self._live[topic].remove(id(item))
+        self._removed[topic].add(id(item))
+        self.size -= 1
+
+        if was_head:
+            self._push_head(topic)
+        elif len(self._removed[topic]) >= self.COMPACT_MIN_REMOVED and len(self._removed[topic]) > len(self._live[topic]):
+            self._compact(topic)
+        return True
+
+    def topics(self):
+        """ Returns the list of topics that have at least one element in the queue """
+        return [topic for topic, live in self._live.items() if live]
+
+    def topic_sizes(self):
+        """ Returns a dict {topic: number of elements} for the topics that have at least one element in the queue """
+        return {topic: len(live) for topic, live in self._live.items() if live}
+
+    def items(self):
+        """ Returns an iterator over the (topic, item) pairs in the queue, in no particular order """
+        for topic, heap in self.queues.items():
+            removed = self._removed[topic]
+            for item in heap:
+                if id(item) not in removed:
+                    yield topic, item
+
+    def _peek(self, topics):
+        """ Returns the smallest element that fits in one of the topics, its topic, and the index heap of the topics """
+        if topics is None:
+            topics = self.queues.keys()
+        group = self._get_group(topics if isinstance(topics, frozenset) else frozenset(topics))
+
+        while group:
+            item, topic = group[0]
+            if self._head(topic) is not item:
+                heappop(group)  # outdated entry
+                continue
+            return item, topic, group
+        return None, None, group
+
+    def _add_topic(self, topic):
+        """ Creates the internal structures for a topic, if needed """
+        if topic not in self.queues:
+            self.queues[topic] = []
+            self._live[topic] = set()
+            self._removed[topic] = set()
+            self._topic_groups[topic] = []
+
+    def _head(self, topic):
+        """ Returns the smallest live item of a topic, or None. Drops the removed items found on the top of the heap """
+        heap = self.queues.get(topic)
+        if not heap:
+            return None
+        removed = self._removed[topic]
+        while heap and id(heap[0]) in removed:
+            removed.remove(id(heappop(heap)))
+        return heap[0] if heap else None
+
+    def _push_head(self, topic):
+        """ Adds the current head of a topic in the index of each set of topics containing it """
+        head = self._head(topic)
+        if head is None:
+            return
+        for group_topics in self._topic_groups[topic]:
+            group = self._groups[group_topics]
+            heappush(group, (head, topic))
+            if len(group) > 2 * len(group_topics) + self.COMPACT_MIN_REMOVED:
+                self._build_group(group_topics)
+
+    def _get_group(self, topics):
+        """ Returns the index heap for a given frozenset of topics, creating it if needed """
+        group = self._groups.get(topics)
+        if group is None:
+            for topic in topics:
+                self._add_topic(topic)
+                self._topic_groups[topic].append(topics)
+            group = self._build_group(topics)
+        return group
+
+    def _build_group(self, topics):
+        """ (Re)builds the index heap of a set of topics from the current heads """
+        group = []
+        for topic in topics:
+            head = self._head(topic)
+            if head is not None:
+                group.append((head, topic))
+        heapify(group)
+        self._groups[topics] = group
+        return group
+
+    def _compact(self, topic):
+        """ Drops all the removed items of a topic from its heap, in O(n) """
+        head = self._head(topic)
+        removed = self._removed[topic]
+        heap = [x for x in self.queues[topic] if id(x) not in removed]
+        heapify(heap)
+        self.queues[topic] = heap
+        self._removed[topic] = set()
+        if heap and heap[0] is not head:
+            self._push_head(topic)
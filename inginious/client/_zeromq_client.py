@@ -4,6 +4,8 @@
 # more information about the licensing of this file.
 import abc
 import asyncio
+import logging
+import uuid
 
 import zmq
 
@@ -27,6 +29,14 @@ class BetterParanoidPirateClient(object, metaclass=abc.ABCMeta):
         self._router_addr = router_addr
         self._socket = self._context.socket(zmq.DEALER)
         self._socket.ipv6 = True
+        # The identity is kept when the client reconnects (but not when the process restarts), so that a restarted server
+        # can still route the answers of the pending transactions to this client
+        self._socket.identity = ("client-" + uuid.uuid4().hex).encode()
+        self._logger = logging.getLogger("inginious.client")
+        self._codec = None  # compression codec of the messages sent to the server, or None
+        # version of the wire format of the messages sent to the server. The server writes in version 2 only to the clients
+        # that announced it in their hello, and reads it, so the client switches to it once it received a message in it.
+        self._wire_version = 1
         self._loop = asyncio.get_event_loop()
 
         self._msgs_registered = {}
@@ -96,13 +106,13 @@ class BetterParanoidPirateClient(object, metaclass=abc.ABCMeta):
             # If that's not the case, add us in the queue, and send the message
             for recv_msg in recv_msgs:
                 self._transactions[recv_msg][key] = [(args, kwargs)]
-            await ZMQUtils.send(self._socket, msg)
+            await ZMQUtils.send(self._socket, msg, codec=self._codec, wire_version=self._wire_version)
 
     async def _simple_send(self, msg):
         """
         Send a msg to the distant server
         """
-        await ZMQUtils.send(self._socket, msg)
+        await ZMQUtils.send(self._socket, msg, codec=self._codec, wire_version=self._wire_version)
 
     async def _handle_pong(self, _):
         """
@@ -130,7 +140,7 @@ class BetterParanoidPirateClient(object, metaclass=abc.ABCMeta):
                     await self._reconnect()
                 else:
                     self._ping_count += 1
-                    await ZMQUtils.send(self._socket, Ping())
+                    await ZMQUtils.send(self._socket, Ping(), wire_version=self._wire_version)
         except asyncio.CancelledError:
             return
         except KeyboardInterrupt:
@@ -173,8 +183,9 @@ class BetterParanoidPirateClient(object, metaclass=abc.ABCMeta):
             task.cancel()
         self._restartable_tasks = []
 
-        # 4. Restart socket
+        # 4. Restart socket. The server may have changed: go back to the first version of the wire format
         self._socket.disconnect(self._router_addr)
+        self._wire_version = 1
 
         # 5. Re-do start sequence
         await self.client_start()
@@ -207,7 +218,8 @@ class BetterParanoidPirateClient(object, metaclass=abc.ABCMeta):
         """
         try:
             while True:
-                message = await ZMQUtils.recv(self._socket)
+                message, wire_version = await ZMQUtils.recv_with_version(self._socket)
+                self._wire_version = max(self._wire_version, wire_version)
                 self._ping_count = 0  # restart ping count
                 msg_class = message.__msgtype__
                 if msg_class in self._handlers_registered:
@@ -225,8 +237,9 @@ class BetterParanoidPirateClient(object, metaclass=abc.ABCMeta):
                         for key2 in responsible:
                             del self._transactions[key2][key]
                     else:
-                        # key does not exist
-                        raise Exception("Received message %s for an unknown transaction %s", msg_class, key)
+                        # key does not exist: the transaction was aborted when the client reconnected, and the server
+                        # answers it anyway (for example, after a restart of the server)
+                        self._logger.warning("Received message %s for an unknown transaction %s", msg_class, key)
                 else:
                     raise Exception("Received unknown message %s", msg_class)
         except asyncio.CancelledError:
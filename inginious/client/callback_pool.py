@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+""" Threads running the callbacks of the jobs, out of the thread of the event loop """
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from inginious.common.metrics import Metrics
+
+
+class CallbackPool(object):
+    """
+        Runs the callbacks of the jobs in a fixed number of threads. Callbacks are usually slow (the webapp stores the
+        results in the database, updates the statistics of the users, calls plugins, ...); running them in the thread of
+        the event loop would delay all the other messages of the backend.
+
+        All the callbacks of a job (identified by a key) run in the same thread, in the order in which they were submitted.
+        When `max_pending` callbacks are waiting, submit() waits for one of them to end. This only bounds the work queued
+        to the threads: the messages received from the backend are still read, and the handlers waiting in submit()
+        keep their arguments (such as the archives of the jobs) in memory. Leaving the messages in the socket instead
+        would make the backend drop them once the ZMQ high water mark is reached.
+    """
+
+    def __init__(self, loop, nb_threads=4, max_pending=1000, metrics=None):
+        """
+        :param loop: the event loop from which the callbacks are submitted
+        :param nb_threads: number of threads running the callbacks
+        :param max_pending: maximum number of callbacks queued to the threads but not done
+        :param metrics: the Metrics object in which the measures are stored. A new one is created if None
+        """
+        self._loop = loop
+        self._queues = [queue.Queue() for _ in range(nb_threads)]
+        self._max_pending = max_pending
+        self._slots = None  # created in submit(), so that it is bound to the loop of the callers
+        self._pending = 0
+        self._waiting = 0  # number of calls to submit() waiting for a free slot
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._metrics.add_collector(self._collect_metrics)
+        self._logger = logging.getLogger("inginious.client")
+
+        for index, callbacks in enumerate(self._queues):
+            threading.Thread(target=self._run, args=(callbacks,), name="inginious-callbacks-%i" % index, daemon=True).start()
+
+    async def submit(self, key, func, *args):
+        """ Queues func(*args), to be run after the callbacks previously submitted with the same key """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_pending)
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._pending += 1
+        self._queues[hash(key) % len(self._queues)].put((key, func, args, time.time()))
+
+    def close(self):
+        """ Stops the threads once the callbacks already submitted are done """
+        for callbacks in self._queues:
+            callbacks.put(None)
+
+    def _run(self, callbacks):
+        while True:
+            item = callbacks.get()
+            if item is None:
+                return
+            key, func, args, submit_time = item
+            start = time.time()
+            self._metrics.observe("client_callback_wait_seconds", start - submit_time)
+            try:
+                func(*args)
+            except Exception:
+                self._logger.exception("Error occurred while calling a callback of job %s", key)
+            self._metrics.observe("client_callback_run_seconds", time.time() - start)
+            try:
+                self._loop.call_soon_threadsafe(self._callback_done)
+            except RuntimeError:
+                pass  # the loop is closed
+
+    def _callback_done(self):
+        self._pending -= 1
+        self._slots.release()
+
+    def _collect_metrics(self, metrics):
+        metrics.set("client_callbacks_pending", self._pending)
+        metrics.set("client_callbacks_waiting", self._waiting)
@@ -10,8 +10,13 @@ from abc import abstractmethod, ABCMeta
 import time
 
 from inginious.client._zeromq_client import BetterParanoidPirateClient
+from inginious.client.callback_pool import CallbackPool
+from inginious.common.compression import get_codecs
+from inginious.common.message_meta import WIRE_VERSION
+from inginious.common.metrics import Metrics
 from inginious.common.messages import ClientHello, BackendUpdateEnvironments, BackendJobStarted, \
-    BackendJobDone, BackendJobSSHDebug, ClientNewJob, ClientKillJob, ClientGetQueue, BackendGetQueue
+    BackendJobDone, BackendJobSSHDebug, ClientNewJob, ClientKillJob, ClientGetQueue, BackendGetQueue, ClientSubscribeQueue, \
+    BackendQueueSnapshot, BackendQueueDelta, BackendQueueEstimates, ClientKillJobs
 
 
 def _callable_once(func):
@@ -79,6 +84,17 @@ class AbstractClient(object, metaclass=ABCMeta):
         """
         pass
 
+    @abstractmethod
+    def kill_jobs(self, course_id=None, task_id=None, launcher=None, all_clients=False):
+        """
+        Kills all the waiting and running jobs that match the given criteria
+        :param course_id: only kill the jobs of this course, or None
+        :param task_id: only kill the jobs of this task, or None
+        :param launcher: only kill the jobs of this launcher, or None
+        :param all_clients: if True, also kill the jobs started by the other clients of the backend
+        """
+        pass
+
     @abstractmethod
     def get_job_queue_snapshot(self):
         """ Get a snapshot of the remote backend job queue. May be a cached version.
@@ -116,19 +132,34 @@ class AbstractClient(object, metaclass=ABCMeta):
         pass
 
 class Client(BetterParanoidPirateClient):
-    def __init__(self, context, backend_addr, queue_update = 10):
+    def __init__(self, context, backend_addr, queue_update = 10, result_cache=None, compression=None, callback_threads=4,
+                 metrics=None):
         """
         Init a new RRR.
         :param context: 0MQ context
         :param backend_addr: 0MQ address of the backend
-        :param queue_update: interval in seconds between two updates of the distant queue. Set to something <= 0 to disable updates.
+        :param queue_update: interval in seconds between two updates of the distant queue, when the backend does not support queue
+            subscriptions. Set to something <= 0 to disable updates.
+        :param result_cache: a ResultCache in which the results of the deterministic tasks are kept, to answer identical
+            jobs without running them, or None
+        :param compression: name of the codec used to compress the large messages sent to the backend, or None
+        :param callback_threads: number of threads running the callbacks of the jobs
+        :param metrics: the Metrics object in which the client stores its metrics. A new one is created if None
         """
         super().__init__(context, backend_addr)
+        self._codec = compression
         self._logger = logging.getLogger("inginious.client")
         self._available_environments = {}
+        self._environment_versions = {}
+        self._result_cache = result_cache
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._callbacks = CallbackPool(self._loop, callback_threads, metrics=self._metrics)
 
         self._register_handler(BackendUpdateEnvironments, self._handle_update_environments)
         self._register_handler(BackendGetQueue, self._handle_job_queue_update)
+        self._register_handler(BackendQueueSnapshot, self._handle_job_queue_snapshot)
+        self._register_handler(BackendQueueDelta, self._handle_job_queue_delta)
+        self._register_handler(BackendQueueEstimates, self._handle_job_queue_estimates)
         self._register_transaction(ClientNewJob, BackendJobDone, self._handle_job_done, self._handle_job_abort,
                                    lambda x: x.job_id, [
                                        (BackendJobStarted, self._handle_job_started),
@@ -141,11 +172,21 @@ class Client(BetterParanoidPirateClient):
         self._queue_cache = None
         self._queue_job_cache = {} #format is job_id: (nb_tasks_before (can be -1 == running), approx_wait_time_in_seconds)
 
+        # State of the queue maintained from the BackendQueueSnapshot and BackendQueueDelta messages
+        self._queue_epoch = None  # epoch of the backend that sent the last snapshot
+        self._queue_seq = None  # sequence number of the last delta applied, None if no snapshot was received
+        self._queue_running = {}  # job_id: (is_local, agent_name, info, launcher, started_at, max_time)
+        self._queue_waiting = {}  # job_id: (is_local, info, launcher, max_time, order_key)
+        self._queue_estimates = {}  # job_id: time at which the job is expected to end (if running) or to start (if waiting)
+
     async def _ask_queue_update(self):
         """ Send a ClientGetQueue message to the backend, if one is not already sent """
         try:
             while True:
                 await asyncio.sleep(self._queue_update_timer)
+                if self._queue_seq is not None:
+                    continue  # the backend sends the changes of the queue by itself
+
                 if self._queue_update_last_attempt == 0 or self._queue_update_last_attempt > self._queue_update_last_attempt_max:
                     if self._queue_update_last_attempt:
                         self._logger.error("Asking for a job queue update despite previous update not yet received")
@@ -165,31 +206,106 @@ class Client(BetterParanoidPirateClient):
         """ Handles a BackendGetQueue containing a snapshot of the job queue """
         self._logger.debug("Received job queue update")
         self._queue_update_last_attempt = 0
-        self._queue_cache = message
+        self._set_job_queue_estimates(message.estimates or {})
+        self._update_job_queue_cache(message.jobs_running, message.jobs_waiting)
+
+    async def _handle_job_queue_snapshot(self, message: BackendQueueSnapshot):
+        """ Handles a BackendQueueSnapshot, sent after a ClientSubscribeQueue """
+        self._logger.debug("Received job queue snapshot")
+        self._queue_epoch = message.epoch
+        self._queue_seq = message.seq
+        self._queue_running = {job[0]: job[1:] for job in message.jobs_running}
+        self._queue_waiting = {job[0]: job[1:] for job in message.jobs_waiting}
+        self._set_job_queue_estimates(message.estimates)
+        self._update_job_queue_cache(message.jobs_running, [job[:-1] for job in message.jobs_waiting])
+
+    async def _handle_job_queue_delta(self, message: BackendQueueDelta):
+        """ Handles a BackendQueueDelta, containing the changes of the job queue since the previous one """
+        if self._queue_seq is None:
+            return  # no snapshot yet
+        if message.epoch != self._queue_epoch:
+            self._logger.info("The backend restarted, asking for a new job queue snapshot")
+            self._queue_seq = None
+            await self._simple_send(ClientSubscribeQueue())
+            return
+        if message.seq <= self._queue_seq:
+            return  # changes already included in the snapshot
+        if message.seq != self._queue_seq + 1:
+            self._logger.warning("Missed some job queue updates, asking for a new snapshot")
+            self._queue_seq = None
+            await self._simple_send(ClientSubscribeQueue())
+            return
+
+        self._queue_seq = message.seq
+        identity = self._socket.identity
+        for event in message.events:
+            # Events may already be included in the snapshot: applying them must not fail
+            if event[0] == "waiting":
+                _, client_addr, job_id, info, launcher, max_time, order_key = event
+                self._queue_waiting[job_id] = (client_addr == identity, info, launcher, max_time, order_key)
+            elif event[0] == "running":
+                _, client_addr, job_id, agent_name, info, launcher, started_at, max_time = event
+                self._queue_waiting.pop(job_id, None)
+                self._queue_running[job_id] = (client_addr == identity, agent_name, info, launcher, started_at, max_time)
+            elif event[0] == "done":
+                self._queue_waiting.pop(event[2], None)
+                self._queue_running.pop(event[2], None)
+                self._queue_estimates.pop(event[2], None)
+
+        jobs_waiting = sorted(self._queue_waiting.items(), key=lambda item: item[1][-1])
+        self._update_job_queue_cache([(job_id,) + job for job_id, job in self._queue_running.items()],
+                                     [(job_id,) + job[:-1] for job_id, job in jobs_waiting])
+
+    async def _handle_job_queue_estimates(self, message: BackendQueueEstimates):
+        """ Handles a BackendQueueEstimates, containing the estimates of the remaining time of the local jobs that changed """
+        self._set_job_queue_estimates(message.estimates, True)
+        if self._queue_cache is not None:
+            self._update_job_queue_cache(*self._queue_cache)
+
+    def _set_job_queue_estimates(self, estimates, update=False):
+        """
+        Stores the estimates sent by the backend, as absolute times (the clocks of the backend and the client may differ).
+        If update is True, only the estimates of the given jobs are replaced.
+        """
+        now = time.time()
+        if not update:
+            self._queue_estimates = {}
+        self._queue_estimates.update((job_id, now + estimate) for job_id, estimate in estimates.items())
+
+    def _update_job_queue_cache(self, jobs_running, jobs_waiting):
+        """ Updates the snapshot of the job queue given to the frontend, and precomputes the position of the local jobs """
+        self._queue_cache = (jobs_running, jobs_waiting)
 
         # Do some precomputation
         new_job_queue_cache = {}
         # format is job_id: (nb_jobs_before, max_remaining_time)
-        for (job_id, is_local, _, _2, _3, start_time, max_time) in message.jobs_running:
+        # The estimates of the backend are used when available, the timeouts of the jobs otherwise
+        now = time.time()
+        for (job_id, is_local, _, _2, _3, start_time, max_time) in jobs_running:
             if is_local:
                 remaining = 0
-                if max_time > 0:
-                    remaining = max(0, (start_time + max_time) - time.time())
+                if job_id in self._queue_estimates:
+                    remaining = max(0, self._queue_estimates[job_id] - now)
+                elif max_time > 0:
+                    remaining = max(0, (start_time + max_time) - now)
                 new_job_queue_cache[job_id] = (-1, remaining)
         wait_time = 0
         nb_tasks = 0
-        for (job_id, is_local, _, _2, timeout) in message.jobs_waiting:
+        for (job_id, is_local, _, _2, timeout) in jobs_waiting:
             if timeout > 0:
                 wait_time += timeout
             if is_local:
-                new_job_queue_cache[job_id] = (nb_tasks, wait_time)
+                if job_id in self._queue_estimates:
+                    new_job_queue_cache[job_id] = (nb_tasks, max(0, self._queue_estimates[job_id] - now))
+                else:
+                    new_job_queue_cache[job_id] = (nb_tasks, wait_time)
             nb_tasks += 1
 
         self._queue_job_cache = new_job_queue_cache
 
     def get_job_queue_snapshot(self):
         if self._queue_cache is not None:
-            return self._queue_cache.jobs_running, self._queue_cache.jobs_waiting
+            return self._queue_cache
         return None, None
 
     def get_job_queue_info(self, jobid):
@@ -197,6 +313,7 @@ class Client(BetterParanoidPirateClient):
 
     async def _handle_update_environments(self, message: BackendUpdateEnvironments):
         self._available_environments = message.available_environments
+        self._environment_versions = message.environment_versions or {}
         self._logger.info("Updated environments")
         self._logger.debug("Environments: %s", str(self._available_environments))
 
@@ -208,23 +325,15 @@ class Client(BetterParanoidPirateClient):
         job_id = message.job_id
 
         # Ensure ssh_callback is called at least once
-        try:
-            # NB: original ssh_callback was wrapped with _callable_once
-            await self._loop.run_in_executor(None, lambda: ssh_callback(None, None, None))
-        except:
-            self._logger.exception("Error occurred while calling ssh_callback for job %s", job_id)
+        # NB: original ssh_callback was wrapped with _callable_once
+        await self._callbacks.submit(job_id, ssh_callback, None, None, None)
 
-        # Call the callback
-        try:
-            callback(message.result, message.grade, message.problems, message.tests, message.custom, message.state, message.archive, message.stdout, message.stderr)
-        except Exception as e:
-            self._logger.exception("Failed to call the callback function for jobid %s: %s", job_id, repr(e), exc_info=True)
+        # Call the callback, in the threads of the pool, after the ssh_callback of the job
+        await self._callbacks.submit(job_id, callback, message.result, message.grade, message.problems, message.tests,
+                                     message.custom, message.state, message.archive, message.stdout, message.stderr)
 
     async def _handle_job_ssh_debug(self, message: BackendJobSSHDebug, ssh_callback, **kwargs):  # pylint: disable=unused-argument
-        try:
-            await self._loop.run_in_executor(None, lambda: ssh_callback(message.host, message.port, message.password))
-        except:
-            self._logger.exception("Error occurred while calling ssh_callback for job %s", message.job_id)
+        await self._callbacks.submit(message.job_id, ssh_callback, message.host, message.port, message.password)
 
     async def _handle_job_abort(self, job_id: str, task, callback, ssh_callback):
         await self._handle_job_done(BackendJobDone(job_id, ("crash", "Backend unavailable, retry later"), 0.0, {}, {}, {}, "", None, "", ""), task, callback,
@@ -235,8 +344,13 @@ class Client(BetterParanoidPirateClient):
 
     async def _on_connect(self):
         self._available_environments = {}
-        await self._simple_send(ClientHello("me"))
-        self._restartable_tasks.append(self._loop.create_task(self._ask_queue_update()))
+        self._environment_versions = {}
+        await self._simple_send(ClientHello("me", get_codecs(), [1, WIRE_VERSION]))
+        if self._queue_update_timer > 0:
+            # The backend will send the changes of the queue; until the first snapshot is received, the queue is polled
+            self._queue_seq = None
+            await self._simple_send(ClientSubscribeQueue())
+            self._restartable_tasks.append(self._loop.create_task(self._ask_queue_update()))
         self._logger.info("Connecting to backend")
 
     def start(self):
@@ -245,7 +359,7 @@ class Client(BetterParanoidPirateClient):
 
     def close(self):
         """ Close the Client """
-        pass
+        self._callbacks.close()
 
     def get_available_environments(self):
         """
@@ -254,6 +368,14 @@ class Client(BetterParanoidPirateClient):
         """
         return self._available_environments
 
+    def get_metrics(self):
+        """ Returns the Metrics object of the client """
+        return self._metrics
+
+    def get_result_cache_stats(self):
+        """ Returns the statistics of the result cache (see ResultCache.get_stats), or None if there is no cache """
+        return self._result_cache.get_stats() if self._result_cache is not None else None
+
     def new_job(self, priority, task, inputdata, callback, launcher_name="Unknown", debug=False, ssh_callback=None):
         """ Add a new job. Every callback will be called once and only once.
         :param priority: Priority of the job
@@ -307,14 +429,41 @@ class Client(BetterParanoidPirateClient):
 
         environment_parameters = task.get_environment_parameters()
 
+        if self._result_cache is not None and task.is_deterministic() and not debug:
+            cache_key = self._result_cache.get_key(task, self._environment_versions.get(environment), inputdata)
+            cached_result = self._result_cache.get(cache_key) if cache_key is not None else None
+            if cached_result is not None:
+                self._logger.debug("Job %s for task %s/%s answered from the result cache", job_id, task.get_course_id(), task.get_id())
+                self._loop.call_soon_threadsafe(asyncio.ensure_future, self._handle_job_done(BackendJobDone(job_id, *cached_result),
+                                                                                             task, callback, ssh_callback))
+                return job_id
+            if cache_key is not None:
+                callback = self._caching_callback(cache_key, callback)
+
         msg = ClientNewJob(job_id, priority, task.get_course_id(), task.get_id(), inputdata, environment, environment_parameters, debug, launcher_name)
         self._loop.call_soon_threadsafe(asyncio.ensure_future, self._create_transaction(msg, task=task, callback=callback,
                                                                                         ssh_callback=ssh_callback))
 
         return job_id
 
+    def _caching_callback(self, cache_key, callback):
+        """ Returns a job callback that stores the result in the result cache before calling callback """
+
+        def store_and_call(result, grade, problems, tests, custom, state, archive, stdout, stderr):
+            self._result_cache.put(cache_key, result, grade, problems, tests, custom, state, archive, stdout, stderr)
+            callback(result, grade, problems, tests, custom, state, archive, stdout, stderr)
+
+        return store_and_call
+
     def kill_job(self, job_id):
         """
         Kills a running job
         """
         self._loop.call_soon_threadsafe(asyncio.ensure_future, self._simple_send(ClientKillJob(job_id)))
+
+    def kill_jobs(self, course_id=None, task_id=None, launcher=None, all_clients=False):
+        """
+        Kills all the waiting and running jobs that match the given criteria
+        """
+        self._loop.call_soon_threadsafe(asyncio.ensure_future, self._simple_send(ClientKillJobs(course_id, task_id, launcher,
+                                                                                                all_clients)))
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+""" Cache of the results of the jobs of deterministic tasks """
+
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import msgpack
+
+from inginious.common.filesystems.provider import NotFoundException
+
+
+class ResultCache(object):
+    """
+        LRU cache of the results of the jobs of deterministic tasks (tasks that give the same result for the same input).
+
+        Results are identified by a hash of the version of the task files (and of the $common folder of the course),
+        the environment and its version, the environment parameters and the input data. The fields of the input data
+        that only describe the submission (such as the username or the number of attempts) are ignored.
+
+        Only successful and failed jobs are stored: crashes, timeouts, ... can depend on the load of the agents. The results
+        whose archive and outputs are larger than `max_entry_bytes` are not stored either.
+
+        The version of the files of a task is computed again only when the modification time of the task directory (or
+        of the $common folder) changes, or after `version_ttl` seconds, as the files modified in place do not change the
+        modification time of their directory.
+    """
+
+    VOLATILE_FIELDS = ("@username", "@attempts", "@email", "@time")
+    CACHED_RESULTS = ("success", "failed")
+
+    def __init__(self, max_size=1000, volatile_fields=VOLATILE_FIELDS, max_bytes=64 * 1024 * 1024, max_entry_bytes=1024 * 1024,
+                 version_ttl=10.0):
+        """
+        :param max_size: maximum number of results kept in the cache
+        :param volatile_fields: fields of the input data that are ignored when comparing inputs
+        :param max_bytes: maximum total size of the results kept in the cache, in bytes
+        :param max_entry_bytes: maximum size of a result kept in the cache, in bytes
+        :param version_ttl: maximum time, in seconds, during which the version of a task whose directory did not change
+                            is reused
+        """
+        self._max_size = max_size
+        self._max_bytes = max_bytes
+        self._max_entry_bytes = max_entry_bytes
+        self._version_ttl = version_ttl
+        self._volatile_fields = frozenset(volatile_fields)
+        self._results = OrderedDict()  # key -> (size, (result, grade, problems, tests, custom, state, archive, stdout, stderr))
+        self._bytes = 0
+        self._task_versions = {}  # prefix of the task directory -> (modification times of the directories, time of the computation, version)
+        self._lock = threading.Lock()  # jobs are submitted from the threads of the webapp, and done in the callback threads
+        self._hits = 0
+        self._misses = 0
+
+    def get_key(self, task, environment_version, inputdata):
+        """
+        :param task: the Task of the job
+        :param environment_version: an id of the version of the environment (such as the id of its image), or None if unknown
+        :param inputdata: the input data of the job
+        :return: the key identifying the result of the job in the cache, or None if the task is not found or if the version
+                 of the environment is unknown
+        """
+        if environment_version is None:
+            return None
+        try:
+            task_version = self._get_task_version(task)
+        except NotFoundException:
+            return None
+
+        inputdata = {key: value for key, value in inputdata.items() if key not in self._volatile_fields}
+        content = (task.get_course_id(), task.get_id(), task_version, task.get_environment_type(), task.get_environment_id(),
+                   environment_version, _canonicalize(task.get_environment_parameters()), _canonicalize(inputdata))
+        return hashlib.sha256(msgpack.dumps(content, use_bin_type=True)).hexdigest()
+
+    def get(self, key):
+        """ Returns a copy of the result stored for a key, or None """
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._results.move_to_end(key)
+        return copy.deepcopy(result[1])
+
+    def put(self, key, result, grade, problems, tests, custom, state, archive, stdout, stderr):
+        """ Stores the result of a job, if it can be reused """
+        if result[0] not in self.CACHED_RESULTS:
+            return
+        size = _get_size(archive) + _get_size(stdout) + _get_size(stderr) + 1024  # the feedback is usually small
+        if size > self._max_entry_bytes:
+            return
+        entry = copy.deepcopy((result, grade, problems, tests, custom, state, archive, stdout, stderr))
+        with self._lock:
+            previous = self._results.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[0]
+            self._results[key] = (size, entry)
+            self._bytes += size
+            while len(self._results) > self._max_size or self._bytes > self._max_bytes:
+                self._bytes -= self._results.popitem(last=False)[1][0]
+
+    def get_stats(self):
+        """
+        Returns a dict containing the number of hits and misses, the number of results in the cache, and an estimate of
+        their size in bytes
+        """
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "size": len(self._results), "bytes": self._bytes}
+
+    def _get_task_version(self, task):
+        """ Returns a description of the version of the files of the task, and of the $common folder of its course """
+        filesystems = (task.get_fs(), task.get_course().get_fs().from_subfolder("$common"))
+        mtimes = tuple(fs.get_last_modification_time("") if fs.exists() else None for fs in filesystems)
+        now = time.time()
+        with self._lock:
+            cached = self._task_versions.get(filesystems[0].prefix)
+        if cached is not None and cached[0] == mtimes and now - cached[1] < self._version_ttl:
+            return cached[2]
+
+        version = []
+        for fs in filesystems:
+            if not fs.exists():
+                continue
+            version.append(sorted((path, fs.get_last_modification_time(path)) for path in fs.list(folders=False, files=True,
+                                                                                                   recursive=True)))
+        with self._lock:
+            self._task_versions[filesystems[0].prefix] = (mtimes, now, version)
+        return version
+
+
+def _get_size(value):
+    """ Returns the size of an archive or an output, in bytes (approximately, for the outputs) """
+    return len(value) if value is not None else 0
+
+
+def _canonicalize(value):
+    """ Returns a representation of value that does not depend on the order of the keys of the dicts """
+    if isinstance(value, dict):
+        return sorted((str(key), _canonicalize(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_canonicalize(item) for item in value]
+    return value
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import asyncio
+import threading
+import time
+
+from inginious.client.callback_pool import CallbackPool
+
+
+class TestCallbackPool(object):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.done = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def callback(self, job_id, index, duration=0.0):
+        time.sleep(duration)
+        self.done.append((job_id, index, threading.current_thread().name))
+
+    def run(self, pool, jobs, total):
+        async def submit_and_wait():
+            for job_id, index, duration in jobs:
+                await pool.submit(job_id, self.callback, job_id, index, duration)
+            while len(self.done) < total:
+                await asyncio.sleep(0.01)
+        self.loop.run_until_complete(asyncio.wait_for(submit_and_wait(), 5))
+
+    def test_order(self):
+        """ The callbacks of a job run in the same thread, in order, even if the first one is slow """
+        pool = CallbackPool(self.loop, 4)
+        self.run(pool, [("a", 0, 0.1), ("b", 0, 0.0), ("a", 1, 0.0), ("b", 1, 0.0)], 4)
+        pool.close()
+        assert [index for job_id, index, _ in self.done if job_id == "a"] == [0, 1]
+        assert [index for job_id, index, _ in self.done if job_id == "b"] == [0, 1]
+        assert len({thread for job_id, _, thread in self.done if job_id == "a"}) == 1
+
+    def test_loop_not_blocked(self):
+        pool = CallbackPool(self.loop, 1)
+        start = time.time()
+        self.loop.run_until_complete(pool.submit("a", self.callback, "a", 0, 0.2))
+        assert time.time() - start < 0.1
+        self.run(pool, [], 1)
+        pool.close()
+
+    def test_max_pending(self):
+        pool = CallbackPool(self.loop, 1, max_pending=1)
+        start = time.time()
+        self.run(pool, [("a", 0, 0.1), ("a", 1, 0.0)], 2)
+        assert time.time() - start >= 0.1
+        assert pool._metrics.collect()["gauges"] == {("client_callbacks_pending", ()): 0, ("client_callbacks_waiting", ()): 0}
+        pool.close()
+
+    def test_exception(self):
+        pool = CallbackPool(self.loop, 1)
+        self.loop.run_until_complete(pool.submit("a", lambda: 1 / 0))
+        self.run(pool, [("a", 1, 0.0)], 1)
+        pool.close()
+        assert self.done[0][:2] == ("a", 1)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import asyncio
+
+from zmq.asyncio import Context
+
+from inginious.client.client import Client
+from inginious.common.messages import BackendQueueSnapshot, BackendQueueDelta, BackendQueueEstimates, ClientSubscribeQueue
+
+
+class RecordingClient(Client):
+    """ A Client whose messages are recorded instead of being sent """
+
+    def __init__(self, loop):
+        asyncio.set_event_loop(loop)
+        super().__init__(Context(), "inproc://backend")
+        self.sent = []
+
+    async def _simple_send(self, msg):
+        self.sent.append(msg)
+
+    def close(self):
+        super().close()
+        self._socket.close(linger=0)
+        self._context.term()
+
+
+class TestClientQueue(object):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.client = RecordingClient(self.loop)
+        identity = self.client._socket.identity
+        self.run(BackendQueueSnapshot("epoch", 3, [], [("1", True, "course/task", "launcher", 10, (0, 0.0, 1.0)),
+                                                       ("2", False, "course/task", "launcher", 10, (0, 5.0, 2.0))], {}))
+        self.events = {job_id: ("waiting", identity, job_id, "course/task", "launcher", 10, key)
+                       for job_id, key in (("3", (0, 2.0, 3.0)), ("4", (-1, 9.0, 4.0)))}
+
+    def tearDown(self):
+        self.client.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run(self, message):
+        handlers = {BackendQueueSnapshot: self.client._handle_job_queue_snapshot, BackendQueueDelta: self.client._handle_job_queue_delta}
+        self.loop.run_until_complete(handlers[type(message)](message))
+
+    def waiting(self):
+        return [job[0] for job in self.client.get_job_queue_snapshot()[1]]
+
+    def test_order(self):
+        """ The new waiting jobs are placed in the queue according to their order key """
+        self.run(BackendQueueDelta("epoch", 4, [self.events["3"], self.events["4"]]))
+        assert self.waiting() == ["4", "1", "3", "2"]
+        assert self.client.get_job_queue_info("3") == (2, 30)
+
+    def test_backend_restart(self):
+        """ A delta from another run of the backend makes the client subscribe again """
+        self.run(BackendQueueDelta("other", 1, [self.events["3"]]))
+        assert self.waiting() == ["1", "2"]
+        assert [type(message) for message in self.client.sent] == [ClientSubscribeQueue]
+        self.run(BackendQueueDelta("other", 2, [self.events["4"]]))
+        assert self.waiting() == ["1", "2"] and len(self.client.sent) == 1
+
+    def test_estimates(self):
+        """ The estimates sent after the snapshot only replace the estimates of their jobs """
+        self.client._set_job_queue_estimates({"1": 10, "2": 20})
+        self.loop.run_until_complete(self.client._handle_job_queue_estimates(BackendQueueEstimates({"1": 30})))
+        assert set(self.client._queue_estimates) == {"1", "2"}
+        assert self.client._queue_estimates["1"] > self.client._queue_estimates["2"]
+        self.run(BackendQueueDelta("epoch", 4, [("done", self.client._socket.identity, "1")]))
+        assert set(self.client._queue_estimates) == {"2"}
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import os
+import shutil
+import tempfile
+
+from inginious.client.result_cache import ResultCache
+from inginious.common.course_factory import create_factories
+from inginious.common.filesystems.local import LocalFSProvider
+from inginious.common.tasks_problems import CodeProblem, CodeSingleLineProblem, FileProblem, MultipleChoiceProblem, \
+    MatchProblem
+
+problem_types = {"code": CodeProblem, "code_single_line": CodeSingleLineProblem, "file": FileProblem,
+                 "multiple_choice": MultipleChoiceProblem, "match": MatchProblem}
+
+RESULT = (("success", "Well done"), 100.0, {}, {}, {}, "", None, "", "")
+
+
+class TestResultCache(object):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(os.path.dirname(__file__), "..", "..", "common", "tests", "tasks", "test"),
+                        os.path.join(self.dir_path, "test"))
+        self.course_factory, _ = create_factories(LocalFSProvider(self.dir_path), problem_types)
+        self.task = self.course_factory.get_task("test", "task1")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_key(self):
+        cache = ResultCache()
+        key = cache.get_key(self.task, "sha256:1", {"code": "print(1)", "@lang": "en", "@username": "a", "@attempts": "1"})
+        # volatile fields and the order of the keys are ignored
+        assert key == cache.get_key(self.task, "sha256:1", {"@attempts": "3", "@username": "b", "@lang": "en", "code": "print(1)"})
+        assert key != cache.get_key(self.task, "sha256:1", {"code": "print(2)", "@lang": "en"})
+        assert key != cache.get_key(self.task, "sha256:1", {"code": "print(1)", "@lang": "fr"})
+        assert key != cache.get_key(self.task, "sha256:2", {"code": "print(1)", "@lang": "en"})
+        assert key != cache.get_key(self.course_factory.get_task("test", "task2"), "sha256:1", {"code": "print(1)", "@lang": "en"})
+        assert cache.get_key(self.task, None, {"code": "print(1)", "@lang": "en"}) is None  # unknown version of the environment
+
+    def test_key_task_version(self):
+        cache = ResultCache()
+        key = cache.get_key(self.task, "sha256:1", {"code": "print(1)"})
+        task_file = os.path.join(self.dir_path, "test", "task1", "run")
+        with open(task_file, "w") as f:
+            f.write("#! /bin/bash\n")
+        os.utime(task_file, (0, 0))
+        os.utime(os.path.dirname(task_file), (0, 0))
+        assert key != cache.get_key(self.task, "sha256:1", {"code": "print(1)"})
+
+    def test_cached_task_version(self):
+        """ The files of the task are listed again only when its directory changes, or when the version is too old """
+        cache = ResultCache()
+        key = cache.get_key(self.task, "sha256:1", {"code": "print(1)"})
+        task_file = os.path.join(self.dir_path, "test", "task1", "run")
+        os.utime(task_file, (0, 0))
+        assert key == cache.get_key(self.task, "sha256:1", {"code": "print(1)"})
+        cache._version_ttl = 0
+        assert key != cache.get_key(self.task, "sha256:1", {"code": "print(1)"})
+
+    def test_get_put(self):
+        cache = ResultCache()
+        assert cache.get("key") is None
+        cache.put("key", *RESULT)
+        assert cache.get("key") == RESULT
+        cache.put("crash", ("crash", "Agent restarted"), 0.0, {}, {}, {}, "", None, "", "")
+        assert cache.get("crash") is None
+        assert cache.get_stats() == {"hits": 1, "misses": 2, "size": 1, "bytes": 1024}
+
+    def test_lru(self):
+        cache = ResultCache(max_size=2)
+        cache.put("a", *RESULT)
+        cache.put("b", *RESULT)
+        cache.get("a")
+        cache.put("c", *RESULT)
+        assert cache.get("b") is None
+        assert cache.get("a") == RESULT
+        assert cache.get("c") == RESULT
+
+    def test_max_bytes(self):
+        """ The cache is bounded by the size of the results, and the large results are not kept """
+        cache = ResultCache(max_bytes=5000, max_entry_bytes=3000)
+        archive = b"x" * 1000
+        for key in ("a", "b", "c"):
+            cache.put(key, ("success", ""), 100.0, {}, {}, {}, "", archive, "", "")
+        assert cache.get("a") is None and cache.get("b") is not None and cache.get("c") is not None
+        assert cache.get_stats()["bytes"] == 4048
+
+        cache.put("big", ("success", ""), 100.0, {}, {}, {}, "", b"x" * 3000, "", "")
+        assert cache.get("big") is None
@@ -9,17 +9,111 @@
 
 import asyncio
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps, partial
 
+from inginious.common.metrics import Metrics
+
+# Number of threads of the shared executors: "io" for the blocking calls to the filesystem, "docker" for the calls to the
+# Docker daemon, so that a slow daemon does not block the other blocking calls
+EXECUTOR_SIZES = {"io": 16, "docker": 16}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class BoundedExecutor(ThreadPoolExecutor):
+    """
+        A ThreadPoolExecutor whose load is exported in the metrics: number of threads, of running calls and of calls
+        waiting for a thread (executor_threads, executor_running, executor_queued), and the time spent waiting
+        (executor_wait_seconds), labelled by the name of the executor. Calls waiting for a thread mean that the executor
+        is saturated.
+    """
+
+    def __init__(self, name, max_workers, metrics=None):
+        """
+        :param name: name of the executor, used to name its threads and in the metrics
+        :param max_workers: maximum number of threads
+        :param metrics: the Metrics object in which the load is stored. A new one is created if None
+        """
+        super(BoundedExecutor, self).__init__(max_workers, thread_name_prefix="inginious-" + name)
+        self._name = name
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._metrics = None
+        self.set_metrics(metrics if metrics is not None else Metrics())
+
+    def set_metrics(self, metrics):
+        """ Stores the load of the executor in `metrics` from now on """
+        if metrics is not self._metrics:
+            self._metrics = metrics
+            metrics.add_collector(self._collect_metrics)
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self._queued += 1
+        try:
+            return super(BoundedExecutor, self).submit(self._run, time.time(), fn, *args, **kwargs)
+        except:
+            with self._lock:
+                self._queued -= 1
+            raise
+
+    def _run(self, submit_time, fn, *args, **kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        self._metrics.observe("executor_wait_seconds", time.time() - submit_time, {"executor": self._name})
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _collect_metrics(self, metrics):
+        if metrics is not self._metrics:
+            return  # the executor now reports to another Metrics object
+        labels = {"executor": self._name}
+        metrics.set("executor_threads", len(self._threads), labels)
+        metrics.set("executor_max_threads", self._max_workers, labels)
+        with self._lock:
+            metrics.set("executor_running", self._running, labels)
+            metrics.set("executor_queued", self._queued, labels)
+
+
+def get_executor(pool, metrics=None, max_workers=None):
+    """
+    Returns the executor shared by the whole process for a pool of threads, created at the first call.
+    :param pool: "io" or "docker"
+    :param metrics: if not None, the Metrics object in which the load of the executor is stored from now on
+    :param max_workers: number of threads of the pool, if it is created by this call. Defaults to EXECUTOR_SIZES[pool]
+    """
+    with _executors_lock:
+        executor = _executors.get(pool)
+        if executor is None:
+            executor = _executors[pool] = BoundedExecutor(pool, max_workers or EXECUTOR_SIZES[pool])
+    if metrics is not None:
+        executor.set_metrics(metrics)
+    return executor
+
 
 class AsyncIteratorWrapper(object):
-    """ A wrapper that converts old-style-generators to async generators using run_in_executor """
-    def __init__(self, obj):
+    """
+        A wrapper that converts old-style-generators to async generators, by iterating over them in a thread.
+
+        At most `max_queued` items are kept waiting for the consumer: when the queue is full, the thread stops iterating
+        until an item is consumed, so that a stream faster than its consumer does not fill the memory.
+    """
+    def __init__(self, obj, max_queued=100):
         self._it = obj
         self._loop = asyncio.get_event_loop()
         self._queue = asyncio.Queue()
+        self._slots = threading.Semaphore(max_queued)  # acquired by the thread for each item, released when consumed
         self._last_item = object()
-        self._thread = threading.Thread(target=self._unroll)
+        self._closed = False
+        self._thread = threading.Thread(target=self._unroll, name="inginious-iterator")
         self._thread.daemon = True
         self._thread.start()
 
@@ -28,28 +122,50 @@ class AsyncIteratorWrapper(object):
 
     async def __anext__(self):
         value = await self._queue.get()
-        if value == self._last_item:
+        self._slots.release()
+        if value is self._last_item:
             raise StopAsyncIteration
         return value
 
-    async def _add_to_queue(self, o):
-        await self._queue.put(o)
+    def close(self):
+        """ Stops iterating. The underlying iterator is closed, if it can be """
+        self._closed = True
+        if hasattr(self._it, "close"):
+            try:
+                self._it.close()
+            except Exception:
+                pass
+
+    def _put(self, item):
+        """ Puts an item in the queue, waiting for a free slot. Returns False if the wrapper is not used anymore """
+        while not self._closed and not self._loop.is_closed():
+            if self._slots.acquire(timeout=1):
+                try:
+                    self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+                    return True
+                except RuntimeError:  # the loop is closed
+                    return False
+        return False
 
     def _unroll(self):
         try:
             for i in self._it:
-                self._loop.call_soon_threadsafe(asyncio.ensure_future, self._add_to_queue(i))
+                if not self._put(i):
+                    return
         except Exception:
             pass
-        self._loop.call_soon_threadsafe(asyncio.ensure_future, self._add_to_queue(self._last_item))
+        self._put(self._last_item)
 
 
 class AsyncProxy(object):
-    """ An asyncio proxy for modules and classes """
+    """
+        An asyncio proxy for modules and classes. The calls are made in `executor`, or in the shared "io" executor if
+        None.
+    """
     def __init__(self, module, loop=None, executor=None):
         self._module = module
         self._loop = loop or asyncio.get_event_loop()
-        self._executor = executor
+        self._executor = executor if executor is not None else get_executor("io")
 
     @property
     def sync(self):
@@ -59,7 +175,7 @@ class AsyncProxy(object):
     def __getattr__(self, name):
         function = getattr(self._module, name)
         if not callable(function):
-            return AsyncProxy(function)
+            return AsyncProxy(function, self._loop, self._executor)
 
         @wraps(function)
         async def _inner(*args, **kwargs):
@@ -13,6 +13,10 @@ import re
 import inginious.common.custom_yaml
 from collections import OrderedDict
 
+# Memory (in MB) given to a grading container when the task does not set limits.memory, and the minimum given
+DEFAULT_MEMORY_LIMIT = 200
+MIN_MEMORY_LIMIT = 20
+
 
 def id_checker(id_to_test):
     """Checks if a id is correct"""
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+""" Compression of the large messages exchanged between the clients, the backend and the agents """
+
+import lzma
+import threading
+import time
+import zlib
+
+# name -> (id on the wire, compress function, decompress function)
+CODECS = {
+    "zlib": (1, zlib.compress, zlib.decompress),
+    "lzma": (2, lzma.compress, lzma.decompress)
+}
+CODEC_NAMES = {codec_id: name for name, (codec_id, _, _) in CODECS.items()}
+
+MIN_SIZE = 4096  # smaller data is never compressed
+
+_statistics = {}  # (codec, operation) -> [number of calls, uncompressed bytes, compressed bytes, seconds]
+_lock = threading.Lock()
+
+
+class CompressedBlob(object):
+    """ Compressed binary data received in a message, kept as is to be forwarded without being decompressed """
+
+    def __init__(self, codec_id, data):
+        self.codec_id = codec_id
+        self.data = data  # bytes or zmq.Frame
+
+    def decompress(self):
+        return decompress(self.codec_id, self.data)
+
+
+def get_codecs():
+    """ Returns the names of the supported codecs """
+    return sorted(CODECS)
+
+
+def compress(codec, data):
+    """
+    Compresses data, if it is large enough and if compression reduces its size
+    :param codec: name of the codec
+    :param data: a bytes-like object
+    :return: a tuple (codec id, compressed bytes), or None if data should be sent uncompressed
+    """
+    if len(data) < MIN_SIZE:
+        return None
+    codec_id, compress_func, _ = CODECS[codec]
+    start = time.perf_counter()
+    compressed = compress_func(data)
+    _record(codec, "compress", len(data), len(compressed), time.perf_counter() - start)
+    if len(compressed) >= len(data):
+        return None
+    return codec_id, compressed
+
+
+def decompress(codec_id, data):
+    """ Decompresses data compressed by compress(). data is a bytes-like object or a zmq.Frame """
+    try:
+        codec = CODEC_NAMES[codec_id]
+    except KeyError:
+        raise TypeError("Unknown compression codec %s" % codec_id) from None
+    if hasattr(data, "buffer"):  # zmq.Frame
+        data = data.buffer
+    start = time.perf_counter()
+    decompressed = CODECS[codec][2](data)
+    _record(codec, "decompress", len(decompressed), len(data), time.perf_counter() - start)
+    return decompressed
+
+
+def get_statistics():
+    """
+    :return: a dict {(codec, operation): {"count": ..., "uncompressed_bytes": ..., "compressed_bytes": ..., "seconds": ...}},
+             where operation is "compress" or "decompress", for the whole process
+    """
+    with _lock:
+        return {key: dict(zip(("count", "uncompressed_bytes", "compressed_bytes", "seconds"), values))
+                for key, values in _statistics.items()}
+
+
+def _record(codec, operation, uncompressed_bytes, compressed_bytes, seconds):
+    with _lock:
+        stats = _statistics.setdefault((codec, operation), [0, 0, 0, 0.0])
+        stats[0] += 1
+        stats[1] += uncompressed_bytes
+        stats[2] += compressed_bytes
+        stats[3] += seconds
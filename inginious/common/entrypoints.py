@@ -4,6 +4,7 @@
 # more information about the licensing of this file.
 
 """ Some basic functions for setuptools entrypoints """
+import argparse
 import pkg_resources
 import sys
 
@@ -47,6 +48,14 @@ def filesystem_from_config_dict(config_fs):
         print("Unable to load class " + config_fs["module"], file=sys.stderr)
         raise
 
+def check_host_port(value):
+    """ Argparse type of the addresses in the form host:port. Returns a tuple (host, port) """
+    try:
+        host, port = value.rsplit(":", 1)
+        return host, int(port)
+    except:
+        raise argparse.ArgumentTypeError("Address should be in the form host:port, for example 127.0.0.1:9100")
+
 def get_args_and_filesystem(parser):
     """Given a partially configured argparse parser, containing all the wanted data BUT the filesystem, this function will configure the parser
        to get the correct FS from the commandline, and return a tuple (args, filesystem_provider).
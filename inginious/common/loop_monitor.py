@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+""" Detection of the blocking calls that stall an asyncio event loop """
+
+import asyncio
+import logging
+import time
+
+from inginious.common.metrics import Metrics
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+
+_monitors = {}  # loop -> LoopMonitor
+_original_handle_run = asyncio.Handle._run
+
+
+class LoopMonitor(object):
+    """
+        Watches an event loop:
+
+        - its scheduling lag (the delay between the time at which a timer should fire and the time at which it fires)
+          is measured every `interval` seconds;
+        - the callbacks (including the steps of the coroutines) that run for more than `slow_callback_duration` seconds
+          are logged, with the name of their coroutine.
+
+        Both are exported as metrics, labelled with the name of the loop. Unlike the debug mode of asyncio, the monitor is
+        cheap enough to be enabled in production.
+    """
+
+    def __init__(self, loop, name, metrics=None, interval=1.0, slow_callback_duration=0.1):
+        """
+        :param loop: the event loop to watch
+        :param name: name of the loop, used in the logs and as the label of the metrics
+        :param metrics: the Metrics object in which the measures are stored. A new one is created if None
+        :param interval: number of seconds between two measures of the lag
+        :param slow_callback_duration: duration (in seconds) above which a callback is considered slow
+        """
+        self._loop = loop
+        self._name = name
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._interval = interval
+        self._slow_callback_duration = slow_callback_duration
+        self._timer = None
+        self._logger = logging.getLogger("inginious.loop_monitor")
+
+    def get_metrics(self):
+        """ Returns the Metrics object in which the measures are stored """
+        return self._metrics
+
+    def start(self):
+        """ Starts watching the loop. Must be called from the thread of the loop, or before the loop runs """
+        _install_hook()
+        _monitors[self._loop] = self
+        self._loop.slow_callback_duration = self._slow_callback_duration  # used by asyncio in debug mode
+        self._schedule()
+
+    def stop(self):
+        """ Stops watching the loop """
+        _monitors.pop(self._loop, None)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _schedule(self):
+        expected_time = self._loop.time() + self._interval
+        self._timer = self._loop.call_at(expected_time, self._measure_lag, expected_time)
+
+    def _measure_lag(self, expected_time):
+        lag = max(0.0, self._loop.time() - expected_time)
+        self._metrics.observe("loop_lag_seconds", lag, {"loop": self._name}, buckets=LAG_BUCKETS)
+        self._schedule()
+
+    def _callback_done(self, handle, duration):
+        """ Called after each callback run by the loop """
+        if duration < self._slow_callback_duration:
+            return
+        callback = _describe_callback(handle)
+        self._logger.warning("Callback %s blocked the %s loop for %.3f seconds", callback, self._name, duration)
+        self._metrics.inc("loop_slow_callbacks_total", {"loop": self._name, "callback": callback})
+        self._metrics.observe("loop_slow_callback_seconds", duration, {"loop": self._name}, buckets=LAG_BUCKETS)
+
+
+def _install_hook():
+    """ Times the callbacks of the monitored loops. The callbacks of the other loops only pay a dict lookup """
+    if asyncio.Handle._run is not _timed_handle_run:
+        asyncio.Handle._run = _timed_handle_run
+
+
+def _timed_handle_run(handle):
+    monitor = _monitors.get(handle._loop)
+    if monitor is None:
+        return _original_handle_run(handle)
+    start = time.perf_counter()
+    try:
+        return _original_handle_run(handle)
+    finally:
+        monitor._callback_done(handle, time.perf_counter() - start)
+
+
+def _describe_callback(handle):
+    """ Returns the name of the coroutine run by a callback, or the name of the callback itself """
+    callback = handle._callback
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return getattr(coro, "__qualname__", None) or repr(coro)
+    return getattr(callback, "__qualname__", None) or repr(callback)
@@ -3,8 +3,24 @@
 # This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
 # more information about the licensing of this file.
 import inspect
+import struct
 
 import msgpack
+import zmq
+
+from inginious.common import compression
+from inginious.common.compression import CompressedBlob
+
+# msgpack extension type of the placeholders of the binary fields sent in separate frames
+BLOB_EXT_TYPE = 42
+# msgpack extension type of a compressed message: a codec id byte followed by the compressed message
+COMPRESSED_EXT_TYPE = 43
+
+# Latest version of the wire format. Version 1 is a dict of the fields, including the type. Version 2 is a positional
+# array: (2, msgtype, field1, field2, ...), with the fields in the order of the __init__ arguments, whose large binary
+# fields may be sent in separate frames. load() accepts both; dump() writes version 1 unless asked otherwise, as
+# version 2 can only be sent to the peers that announced it.
+WIRE_VERSION = 2
 
 
 class MessageMeta(type):
@@ -20,6 +36,15 @@ class MessageMeta(type):
         Moreover, the class should define a argument `msgtype` for the metaclass, that gives the name
         of the message when parsed
 
+        Arguments added to an existing message should have a default value: the messages sent by the peers that do not
+        know them yet are loaded with this default value. Arguments whose default value is None are left out of the
+        messages written in the version 1 of the wire format when they are None, so that the peers that do not know
+        them can still load these messages. The unknown fields of the messages written in the version 1 are ignored.
+
+        In debug mode (the default), the contract of __init__ and the content of the received messages are checked.
+        In production mode (see set_debug), messages are built and loaded by constructors generated for each class,
+        without any check.
+
         Example:
 
         class SendNumberToContainer(metaclass=MessageMeta, msgtype="send_nbr_container"):
@@ -29,29 +54,85 @@ class MessageMeta(type):
     """
     _registered_messages = {}
     DEBUG = True
+    BLOB_MIN_SIZE = 65536  # binary fields of at least this size are sent in separate frames by dump_frames(), in the wire format 2
 
     def __new__(cls, name, bases, namespace, **kargs):  # pylint: disable=unused-argument
         return super().__new__(cls, name, bases, namespace)
 
     @classmethod
-    def load(cls, bmessage):
+    def set_debug(cls, debug):
+        """ Enables (the default) or disables the checks done when building and loading messages """
+        cls.DEBUG = debug
+        for message_cls in cls._registered_messages.values():
+            message_cls.__init__ = message_cls._checked_init if debug else message_cls._fast_init
+
+    @classmethod
+    def load(cls, bmessage, blobs=(), decompress_blobs=True):
         """
         From a bytestring given by a (distant) call to Message.dump(), retrieve the original message
-        :param bmessage: bytestring given by a .dump() call on a message
+        :param bmessage: bytestring given by a .dump() call on a message, or the first frame given by .dump_frames()
+        :param blobs: the other frames given by .dump_frames(). They are put in the message as they are (bytes or zmq.Frame)
+        :param decompress_blobs: if False, the compressed frames are put in the message as CompressedBlob, to be forwarded
+                                 without being decompressed
         :return: the original message
         """
-        message_dict = msgpack.loads(bmessage, encoding="utf8", use_list=False)
+        return cls.load_with_version(bmessage, blobs, decompress_blobs)[0]
 
-        try:
-            obj = MessageMeta._registered_messages[message_dict["type"]].__new__(MessageMeta._registered_messages[message_dict["type"]])
-            object.__setattr__(obj, "__dict__", message_dict)
-        except:
-            raise TypeError("Unknown message type") from None
+    @classmethod
+    def load_with_version(cls, bmessage, blobs=(), decompress_blobs=True):
+        """
+        Same as load()
+        :return: a tuple (message, version of the wire format in which it was written)
+        """
+        if blobs:
+            def ext_hook(code, data):
+                if code == BLOB_EXT_TYPE:
+                    if len(data) == 4:
+                        return blobs[struct.unpack(">I", data)[0]]
+                    index, codec_id = struct.unpack(">IB", data)
+                    blob = CompressedBlob(codec_id, blobs[index])
+                    return blob.decompress() if decompress_blobs else blob
+                return msgpack.ExtType(code, data)
+            content = msgpack.loads(bmessage, raw=False, use_list=False, ext_hook=ext_hook)
+        else:
+            ext_hook = None
+            content = msgpack.loads(bmessage, raw=False, use_list=False)
+
+        if isinstance(content, msgpack.ExtType) and content.code == COMPRESSED_EXT_TYPE:
+            bmessage = compression.decompress(content.data[0], memoryview(content.data)[1:])
+            content = msgpack.loads(bmessage, raw=False, use_list=False, **({"ext_hook": ext_hook} if ext_hook else {}))
+
+        if isinstance(content, dict):  # version 1
+            try:
+                message_cls = MessageMeta._registered_messages[content["type"]]
+                obj = message_cls.__new__(message_cls)
+            except:
+                raise TypeError("Unknown message type") from None
+            for field, default in message_cls._defaults.items():
+                content.setdefault(field, default)
+            if len(content) != message_cls._nb_fields + 1:  # fields added by a newer version of the message
+                content = {field: value for field, value in content.items() if field in message_cls._keys}
+            object.__setattr__(obj, "__dict__", content)
+            version = 1
+        else:
+            try:
+                version, msgtype = content[0], content[1]
+                message_cls = MessageMeta._registered_messages[msgtype]
+            except:
+                raise TypeError("Unknown message type") from None
+            if version != WIRE_VERSION:
+                raise TypeError("Unsupported message format version %s" % version)
+            missing = message_cls._nb_fields + 2 - len(content)
+            if missing < 0 or missing > len(message_cls._defaults):
+                raise TypeError("Invalid message content")
+            if missing:
+                content = tuple(content) + tuple(message_cls._defaults.values())[-missing:]
+            obj = message_cls._load_fields(content)
 
         if not obj._verify():  # pylint: disable=protected-access
             raise TypeError("Invalid message content")
 
-        return obj
+        return obj, version
 
     def __init__(cls, name, bases, attrs, msgtype):
         """
@@ -79,11 +160,20 @@ class MessageMeta(type):
 
         MessageMeta._registered_messages[msgtype] = cls
 
+        fields = list(parameters)
+        # default values of the last arguments, used to load the messages that do not contain them
+        defaults = {field: parameter.default for field, parameter in parameters.items()
+                    if parameter.default is not inspect.Parameter.empty}
+        fast_init, load_fields, get_fields = _compile_message(cls, msgtype, fields, defaults)
+        signature = inspect.signature(old_init)
+
         def new_init(self, *args, **kwargs):
             object.__setattr__(self, "__currently_mutable", True)
 
             # Get the message content
-            message_content = {x[0]: y for (x, y) in zip(parameters.items(), args)}
+            arguments = signature.bind(self, *args, **kwargs)
+            arguments.apply_defaults()
+            message_content = {field: arguments.arguments[field] for field in parameters}
 
             # Ask the init function to fill himself __dict__
             old_init(self, *args, **kwargs)
@@ -111,6 +201,13 @@ class MessageMeta(type):
                 raise TypeError("Immutable object")
 
         needed_keys = set(parameters.keys()) | {"type"}
+        # fields left out of the version 1 of the wire format when they are None
+        optional_fields = {field for field, default in defaults.items() if default is None}
+
+        def get_dict(self):
+            if optional_fields:
+                return {field: value for field, value in self.__dict__.items() if value is not None or field not in optional_fields}
+            return self.__dict__
 
         def _verify(self, force=False):
             """
@@ -124,22 +221,119 @@ class MessageMeta(type):
                 return content_present and type_ok
             return True
 
-        def dump(self):
+        def dump(self, wire_version=1):
             """
+            :param wire_version: version of the wire format, 1 or WIRE_VERSION
             :return: a bytestring containing a black-box representation of the message, that can be loaded using MessageMeta.load.
             """
-            return msgpack.dumps(self.__dict__, encoding="utf8", use_bin_type=True)
+            content = get_fields(self) if wire_version == WIRE_VERSION else get_dict(self)
+            return msgpack.dumps(content, use_bin_type=True, default=_frame_to_bytes)
+
+        def dump_frames(self, codec=None, wire_version=1):
+            """
+            :param codec: name of the compression codec to use for the large messages and fields, or None
+            :param wire_version: version of the wire format, 1 or WIRE_VERSION
+            :return: a list of frames containing a black-box representation of the message, that can be loaded using
+                     MessageMeta.load(frames[0], frames[1:]). In the wire format WIRE_VERSION, the large binary fields are
+                     not serialized: each of them is sent as is, in its own frame, so that they can be forwarded without
+                     being copied. The peers that only know the version 1 cannot load these frames: the fields are then
+                     serialized in the message.
+            """
+            blobs = []
+            if wire_version == WIRE_VERSION:
+                content = _extract_blobs(get_fields(self), blobs, codec)
+            else:
+                content = get_dict(self)
+            bmessage = msgpack.dumps(content, use_bin_type=True, default=_frame_to_bytes)
+            if codec is not None:
+                compressed = compression.compress(codec, bmessage)
+                if compressed is not None:
+                    codec_id, data = compressed
+                    bmessage = msgpack.dumps(msgpack.ExtType(COMPRESSED_EXT_TYPE, bytes((codec_id,)) + data))
+            return [bmessage] + blobs
 
         super().__init__(name, bases, attrs)
 
-        cls.__init__ = new_init
+        cls._checked_init = new_init
+        cls._fast_init = fast_init
+        cls._load_fields = staticmethod(load_fields)
+        cls._nb_fields = len(fields)
+        cls._defaults = defaults
+        cls._keys = needed_keys
+        cls.__init__ = new_init if MessageMeta.DEBUG else fast_init
         cls.__delattr__ = new_delattr
         cls.__setattr__ = new_setattr
         cls._verify = _verify
         cls.dump = dump
+        cls.dump_frames = dump_frames
         cls.__msgtype__ = msgtype
 
 
+def _compile_message(cls, msgtype, fields, defaults):
+    """
+    Generates the functions used by a message class in production mode, and to (de)serialize the messages
+    :return: a tuple (fast_init, load_fields, get_fields) where
+             - fast_init(self, *fields) is an __init__ that fills the message without calling the original __init__;
+             - load_fields(content) builds a message from a (WIRE_VERSION, msgtype, field1, ...) tuple;
+             - get_fields(message) returns the (WIRE_VERSION, msgtype, field1, ...) tuple of a message.
+    """
+    args = ", ".join(field if field not in defaults else "%s=defaults[%r]" % (field, field) for field in fields)
+    content = "".join("%r: %s, " % (field, field) for field in fields)
+    loaded_content = "".join("%r: content[%i], " % (field, idx + 2) for idx, field in enumerate(fields))
+    dumped_fields = "".join("fields[%r], " % field for field in fields)
+    source = "def fast_init(self, {args}):\n" \
+             "    set_dict(self, '__dict__', {{{content}'type': msgtype}})\n" \
+             "def load_fields(content):\n" \
+             "    obj = new(cls)\n" \
+             "    set_dict(obj, '__dict__', {{{loaded_content}'type': msgtype}})\n" \
+             "    return obj\n" \
+             "def get_fields(message):\n" \
+             "    fields = message.__dict__\n" \
+             "    return (WIRE_VERSION, msgtype, {dumped_fields})\n".format(args=args, content=content,
+                                                                        loaded_content=loaded_content, dumped_fields=dumped_fields)
+    namespace = {"set_dict": object.__setattr__, "new": object.__new__, "cls": cls, "msgtype": msgtype, "WIRE_VERSION": WIRE_VERSION,
+                 "defaults": defaults}
+    exec(source, namespace)  # pylint: disable=exec-used
+    return namespace["fast_init"], namespace["load_fields"], namespace["get_fields"]
+
+
+def _extract_blobs(value, blobs, codec=None):
+    """
+    Returns value, where the large binary values are replaced by placeholders, and appended to blobs (compressed with
+    codec, if it is not None)
+    """
+    if isinstance(value, CompressedBlob):
+        if codec is not None and compression.CODECS[codec][0] == value.codec_id:
+            blobs.append(value.data)  # forwarded as is
+            return msgpack.ExtType(BLOB_EXT_TYPE, struct.pack(">IB", len(blobs) - 1, value.codec_id))
+        value = value.decompress()
+    if isinstance(value, zmq.Frame) or (isinstance(value, bytes) and len(value) >= MessageMeta.BLOB_MIN_SIZE):
+        compressed = compression.compress(codec, value.buffer if isinstance(value, zmq.Frame) else value) \
+            if codec is not None else None
+        if compressed is not None:
+            blobs.append(compressed[1])
+            return msgpack.ExtType(BLOB_EXT_TYPE, struct.pack(">IB", len(blobs) - 1, compressed[0]))
+        blobs.append(value)
+        return msgpack.ExtType(BLOB_EXT_TYPE, struct.pack(">I", len(blobs) - 1))
+    if isinstance(value, dict):
+        return {key: _extract_blobs(item, blobs, codec) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_extract_blobs(item, blobs, codec) for item in value]
+    return value
+
+
+def _frame_to_bytes(obj):
+    """
+    Serializes the zmq.Frame and CompressedBlob received by the backend, when a message must be written as a single
+    bytestring
+    """
+    if isinstance(obj, zmq.Frame):
+        return obj.bytes
+    if isinstance(obj, CompressedBlob):
+        return obj.decompress()
+    raise TypeError("Cannot serialize %r" % obj)
+
+
 def run_tests():
     class StartContainer(metaclass=MessageMeta, msgtype="start_container"):
         def __init__(self, job_id: str, container_name: str):
@@ -232,22 +426,41 @@ class ZMQUtils(object):
 
     @classmethod
     async def recv_with_addr(cls, socket):
-        message = await socket.recv_multipart()
-        addr = message[0]
-        obj = MessageMeta.load(message[1])
+        """
+        Receives a message and the address of its sender. The large binary fields of the message are left in the
+        zmq.Frame in which they were received, without copy nor decompression, so they can be forwarded as they are
+        """
+        message = await socket.recv_multipart(copy=False)
+        addr = message[0].bytes
+        obj = MessageMeta.load(message[1].buffer, message[2:], decompress_blobs=False)
         return addr, obj
 
     @classmethod
-    async def send_with_addr(cls, socket, addr: bytes, obj):
-        message = [addr, obj.dump()]
-        await socket.send_multipart(message)
+    async def send_with_addr(cls, socket, addr: bytes, obj, codec=None, wire_version=1):
+        """ Sends a message to an address, compressing its large parts with codec if it is not None """
+        message = [addr] + obj.dump_frames(codec, wire_version)
+        await socket.send_multipart(message, copy=False)
+
+    @classmethod
+    async def send_to_many(cls, socket, addrs, obj, codec=None, wire_version=1):
+        """ Sends the same message to multiple addresses, serializing it only once """
+        message_frames = obj.dump_frames(codec, wire_version)
+        for addr in addrs:
+            await socket.send_multipart([addr] + message_frames, copy=False)
 
     @classmethod
     async def recv(cls, socket, skip_first=False):
+        return (await cls.recv_with_version(socket, skip_first))[0]
+
+    @classmethod
+    async def recv_with_version(cls, socket, skip_first=False):
+        """ Receives a message, and returns it with the version of the wire format in which it was written """
         message = await socket.recv_multipart()
-        return MessageMeta.load(message[0] if not skip_first else message[1])
+        if skip_first:
+            message = message[1:]
+        return MessageMeta.load_with_version(message[0], message[1:])
 
     @classmethod
-    async def send(cls, socket, obj, send_white=False):
-        message_obj = obj.dump()
-        await socket.send_multipart([message_obj] if not send_white else ["", message_obj])
+    async def send(cls, socket, obj, send_white=False, codec=None, wire_version=1):
+        message_frames = obj.dump_frames(codec, wire_version)
+        await socket.send_multipart(message_frames if not send_white else [b""] + message_frames)
@@ -24,11 +24,19 @@ class ClientHello(metaclass=MessageMeta, msgtype="client_hello"):
         Let the client say hello to the backend (and thus register to some events)
     """
 
-    def __init__(self, name: str):
+    def __init__(self, name: str, compression: Optional[List[str]] = None, wire_versions: Optional[List[int]] = None):
         """
         :param name: name of the client (do not need to be unique)
+        :param compression: names of the compression codecs that the client can decompress. The backend compresses the
+                            large messages it sends to the client with one of them. None (as sent by the clients that
+                            do not know compression) if the messages should not be compressed
+        :param wire_versions: versions of the wire format (see MessageMeta) that the client can load. The backend writes
+                              its messages to the client in the latest of them that it knows. None if only version 1
+                              can be loaded
         """
         self.name = name
+        self.compression = compression
+        self.wire_versions = wire_versions
 
 
 class ClientNewJob(metaclass=MessageMeta, msgtype="client_new_job"):
@@ -79,6 +87,26 @@ class ClientKillJob(metaclass=MessageMeta, msgtype="client_kill_job"):
         self.job_id = job_id
 
 
+class ClientKillJobs(metaclass=MessageMeta, msgtype="client_kill_jobs"):
+    """
+        Kills all the waiting and running jobs that match the given criteria.
+        C->B.
+    """
+
+    def __init__(self, course_id: Optional[str], task_id: Optional[str], launcher: Optional[str], all_clients: bool):
+        """
+        :param course_id: only kill the jobs of this course, or None
+        :param task_id: only kill the jobs of this task, or None
+        :param launcher: only kill the jobs of this launcher, or None
+        :param all_clients: if False, only the jobs of the client sending the message are killed. Otherwise, the jobs of
+                            all the clients are killed
+        """
+        self.course_id = course_id
+        self.task_id = task_id
+        self.launcher = launcher
+        self.all_clients = all_clients
+
+
 class ClientGetQueue(metaclass=MessageMeta, msgtype="client_get_queue"):
     """
        Ask the backend to send the status of its job queue
@@ -86,6 +114,15 @@ class ClientGetQueue(metaclass=MessageMeta, msgtype="client_get_queue"):
 
     def __init__(self): pass
 
+
+class ClientSubscribeQueue(metaclass=MessageMeta, msgtype="client_subscribe_queue"):
+    """
+       Subscribe to the updates of the job queue. The backend answers with a BackendQueueSnapshot, and then sends
+       BackendQueueDelta messages each time the queue changes. Sending it again asks for a new snapshot.
+    """
+
+    def __init__(self): pass
+
 #################################################################
 #                                                               #
 #                      Backend to Client                        #
@@ -98,11 +135,14 @@ class BackendUpdateEnvironments(metaclass=MessageMeta, msgtype="backend_update_e
         Update the information about the environments on the client, from the informations retrieved from the agents
     """
 
-    def __init__(self, available_environments: Dict[str, str]):
+    def __init__(self, available_environments: Dict[str, str], environment_versions: Optional[Dict[str, str]] = None):
         """
             :param available_environments: dict of available environment aliases (as keys) and type of the related agent (as value)
+            :param environment_versions: dict of available environment aliases (as keys) and id of their last version (as
+                value), or None if unknown (previous versions of the backend)
         """
         self.available_environments = available_environments
+        self.environment_versions = environment_versions
 
 
 class BackendJobStarted(metaclass=MessageMeta, msgtype="backend_job_started"):
@@ -177,7 +217,8 @@ class BackendGetQueue(metaclass=MessageMeta, msgtype="backend_get_queue"):
         Send the status of the job queue to the client
     """
     def __init__(self, jobs_running: List[Tuple[ClientJobId, bool, str, str, str, int, int]],
-                       jobs_waiting: List[Tuple[ClientJobId, bool, str, str, int]]):
+                       jobs_waiting: List[Tuple[ClientJobId, bool, str, str, int]],
+                       estimates: Optional[Dict[ClientJobId, float]] = None):
         """
         :param jobs_running: a list of tuples in the form
             (job_id, is_current_client_job, info, launcher, started_at, max_tuime)
@@ -197,9 +238,75 @@ class BackendGetQueue(metaclass=MessageMeta, msgtype="backend_get_queue"):
             - info is "courseid/taskid"
             - launcher is the name of the launcher, which may be anything
             - max_time the maximum time that can be used, or -1 if no timeout is set
+            The waiting jobs are given in the order in which they will be started.
+        :param estimates: a dict {job_id: seconds}, for the jobs of the client, giving the estimated time before the job
+            ends (for running jobs) or before the job starts (for waiting jobs). Estimates are based on the run times of
+            the last jobs of each task, and on the number of job slots of the agents. Jobs for which no agent is
+            available have no estimate. None if the backend gives no estimates (previous versions of the backend).
+        """
+        self.jobs_running = jobs_running
+        self.jobs_waiting = jobs_waiting
+        self.estimates = estimates
+
+
+class BackendQueueSnapshot(metaclass=MessageMeta, msgtype="backend_queue_snapshot"):
+    """
+        Send the full status of the job queue to a client that subscribed with ClientSubscribeQueue
+    """
+    def __init__(self, epoch: str, seq: int, jobs_running: List[Tuple[ClientJobId, bool, str, str, str, int, int]],
+                 jobs_waiting: List[Tuple[ClientJobId, bool, str, str, int, Tuple[int, float, float]]],
+                 estimates: Dict[ClientJobId, float]):
+        """
+        :param epoch: identifier of this run of the backend. It changes when the backend restarts, and the sequence
+            numbers start again from 0.
+        :param seq: sequence number of the last BackendQueueDelta whose changes are included in this snapshot
+        :param jobs_running: same as in BackendGetQueue
+        :param jobs_waiting: same as in BackendGetQueue, with the order key of each job appended to its tuple: the
+            waiting jobs are started in the order of their keys
+        :param estimates: same as in BackendGetQueue
         """
+        self.epoch = epoch
+        self.seq = seq
         self.jobs_running = jobs_running
         self.jobs_waiting = jobs_waiting
+        self.estimates = estimates
+
+
+class BackendQueueDelta(metaclass=MessageMeta, msgtype="backend_queue_delta"):
+    """
+        Send the changes of the job queue to the clients that subscribed with ClientSubscribeQueue
+    """
+    def __init__(self, epoch: str, seq: int, events: List[Tuple]):
+        """
+        :param epoch: same as in BackendQueueSnapshot. A client that receives a delta from another epoch than its
+            snapshot should subscribe again: the backend restarted.
+        :param seq: sequence number of this delta. Each delta has the sequence number of the previous one plus one. A client
+            that receives a delta whose number is not the expected one has missed changes, and should subscribe again.
+        :param events: a list of events, in the order in which they happened, in the form
+            - ("waiting", client_addr, job_id, info, launcher, max_time, order_key): the job was added to the queue, at
+              the position given by its order key (see BackendQueueSnapshot)
+            - ("running", client_addr, job_id, agent_name, info, launcher, started_at, max_time): the job was sent to an agent
+            - ("done", client_addr, job_id): the job is not in the queue anymore
+            where
+            - client_addr is the identity of the client that started the job
+            - the other fields are the same as in BackendGetQueue
+        """
+        self.epoch = epoch
+        self.seq = seq
+        self.events = events
+
+
+class BackendQueueEstimates(metaclass=MessageMeta, msgtype="backend_queue_estimates"):
+    """
+        Send new estimates of the remaining time of the jobs of a client that subscribed with ClientSubscribeQueue. Sent
+        after the BackendQueueDelta messages, at most once every few seconds.
+    """
+    def __init__(self, estimates: Dict[ClientJobId, float]):
+        """
+        :param estimates: same as in BackendGetQueue, for the jobs whose estimate changed noticeably since it was last
+            sent. Replaces the previous estimates of these jobs.
+        """
+        self.estimates = estimates
 
 #################################################################
 #                                                               #
@@ -251,6 +358,19 @@ class BackendKillJob(metaclass=MessageMeta, msgtype="backend_kill_job"):
         self.job_id = job_id
 
 
+class BackendKillJobs(metaclass=MessageMeta, msgtype="backend_kill_jobs"):
+    """
+        Kills several running jobs at once.
+        B->A.
+    """
+
+    def __init__(self, job_ids: List[BackendJobId]):
+        """
+        :param job_ids: the backend-side job ids of the jobs to kill
+        """
+        self.job_ids = job_ids
+
+
 #################################################################
 #                                                               #
 #                      Agent to Backend                         #
@@ -263,7 +383,9 @@ class AgentHello(metaclass=MessageMeta, msgtype="agent_hello"):
         Let the agent say hello and announce which environments it has available
     """
 
-    def __init__(self, friendly_name: str, available_job_slots: int, available_environments: Dict[str, Dict[str, Any]]):
+    def __init__(self, friendly_name: str, available_job_slots: int, available_environments: Dict[str, Dict[str, Any]],
+                 available_resources: Optional[Dict[str, int]] = None, compression: Optional[List[str]] = None,
+                 wire_versions: Optional[List[int]] = None):
         """
             :param friendly_name: a string containing a friendly name to identify agent
             :param available_job_slots: an integer giving the number of concurrent
@@ -276,11 +398,26 @@ class AgentHello(metaclass=MessageMeta, msgtype="agent_hello"):
                     "type": "agent type id"        # type of the environment
                 }
             }
+            :param available_resources: dict of the resources that the agent shares between its jobs. The backend
+                reserves, for each job sent to the agent, the resources asked in its environment_parameters["limits"].
+            {
+                "memory": 8192,                    # in MB
+                "cpu": 4                           # number of CPUs
+            }
+            Resources that are not in the dict are not limited. None (as sent by the agents that do not know
+            resources) if no resource is limited.
+            :param compression: names of the compression codecs that the agent can decompress. The backend compresses
+                the large messages it sends to the agent with one of them. None if the messages should not be compressed
+            :param wire_versions: versions of the wire format (see MessageMeta) that the agent can load. The backend
+                writes its messages to the agent in the latest of them that it knows. None if only version 1 can be loaded
         """
 
         self.friendly_name = friendly_name
         self.available_job_slots = available_job_slots
         self.available_environments = available_environments
+        self.available_resources = available_resources
+        self.compression = compression
+        self.wire_versions = wire_versions
 
 class AgentJobStarted(metaclass=MessageMeta, msgtype="agent_job_started"):
     """
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+""" Lightweight metrics (counters, gauges and histograms), with an optional HTTP exporter in the Prometheus text format """
+
+import asyncio
+import bisect
+import logging
+import threading
+
+
+class Histogram(object):
+    """ A histogram with fixed buckets. Buckets are upper bounds; a last bucket containing everything is always added """
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Returns an upper bound of the q-quantile (0 <= q <= 1) of the observed values, or None if there are none """
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.buckets[-1]
+
+
+class Metrics(object):
+    """
+        A set of metrics, identified by a name and a dict of labels.
+
+        - counters only increase (number of events)
+        - gauges are set to a value (current state)
+        - histograms count observations in buckets (durations)
+
+        Collectors are functions called with this object before each export. They allow to set gauges from the state of
+        a component only when the metrics are read, instead of maintaining them at each change.
+
+        Thread-safe.
+    """
+
+    def __init__(self, prefix="inginious"):
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._collectors = []
+        self._logger = logging.getLogger("inginious.metrics")
+
+    @classmethod
+    def _key(cls, name, labels):
+        return name, tuple(sorted(labels.items())) if labels else ()
+
+    def inc(self, name, labels=None, value=1):
+        """ Increments a counter """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        """ Sets the value of a gauge """
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, labels=None, buckets=Histogram.DEFAULT_BUCKETS):
+        """ Adds an observation to a histogram. `buckets` is only used when the histogram is created """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def clear_gauges(self, name):
+        """ Removes all the values of a gauge, for all labels. Useful in collectors, for gauges whose labels disappear """
+        with self._lock:
+            for key in [key for key in self._gauges if key[0] == name]:
+                del self._gauges[key]
+
+    def add_collector(self, collector):
+        """ Adds a function, called with this object as argument before each export """
+        self._collectors.append(collector)
+
+    def collect(self):
+        """
+        Calls the collectors, and returns a snapshot of the metrics.
+        :return: a dict {"counters": {(name, labels): value}, "gauges": {(name, labels): value},
+                 "histograms": {(name, labels): Histogram}}, where labels is a tuple of (label, value) tuples sorted by label
+        """
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception:
+                self._logger.exception("An exception occurred while collecting metrics")
+
+        with self._lock:
+            histograms = {}
+            for key, histogram in self._histograms.items():
+                copy = Histogram(histogram.buckets[:-1])
+                copy.counts, copy.sum, copy.count = list(histogram.counts), histogram.sum, histogram.count
+                histograms[key] = copy
+            return {"counters": dict(self._counters), "gauges": dict(self._gauges), "histograms": histograms}
+
+    def to_prometheus(self):
+        """ Returns the metrics in the Prometheus text exposition format """
+        snapshot = self.collect()
+        lines = []
+
+        def fmt_labels(labels, extra=()):
+            labels = labels + extra
+            if not labels:
+                return ""
+            return "{" + ",".join('%s="%s"' % (label, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                                  for label, value in labels) + "}"
+
+        for kind, metric_type in (("counters", "counter"), ("gauges", "gauge")):
+            last_name = None
+            for (name, labels), value in sorted(snapshot[kind].items(), key=lambda x: x[0]):
+                full_name = self._prefix + "_" + name
+                if name != last_name:
+                    lines.append("# TYPE %s %s" % (full_name, metric_type))
+                    last_name = name
+                lines.append("%s%s %s" % (full_name, fmt_labels(labels), repr(float(value))))
+
+        last_name = None
+        for (name, labels), histogram in sorted(snapshot["histograms"].items(), key=lambda x: x[0]):
+            full_name = self._prefix + "_" + name
+            if name != last_name:
+                lines.append("# TYPE %s histogram" % full_name)
+                last_name = name
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % (full_name, fmt_labels(labels, (("le", "+Inf" if bound == float("inf") else repr(float(bound))),)),
+                                                 cumulative))
+            lines.append("%s_sum%s %s" % (full_name, fmt_labels(labels), repr(histogram.sum)))
+            lines.append("%s_count%s %d" % (full_name, fmt_labels(labels), histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(metrics, host, port):
+    """
+    Starts a minimal HTTP server, on the current event loop, that answers to every GET request with the metrics in the
+    Prometheus text format.
+    :return: the asyncio Server object
+    """
+    logger = logging.getLogger("inginious.metrics")
+
+    async def handle(reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # ignore headers
+
+            if request.startswith(b"GET "):
+                body = metrics.to_prometheus().encode("utf8")
+                writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: %d\r\n\r\n" % len(body))
+                writer.write(body)
+            else:
+                writer.write(b"HTTP/1.0 405 Method Not Allowed\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+        except Exception:
+            logger.exception("Error while serving metrics")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info("Metrics available on http://%s:%i/", host, port)
+    return server
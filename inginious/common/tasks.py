@@ -110,6 +110,10 @@ class Task(object):
         """ Returns the raw environment parameters, which is a dictionnary that is envtype dependent. """
         return self._environment_parameters
 
+    def is_deterministic(self):
+        """ Returns True if the task always gives the same result for the same input, which allows to reuse results """
+        return bool(self._data.get("deterministic", False))
+
     def get_response_type(self):
         """ Returns the method used to parse the output of the task: HTML or rst """
         return "HTML" if self._environment_parameters.get('response_is_html', False) else "rst"
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import asyncio
+import os
+import threading
+import time
+
+from inginious.common.asyncio_utils import AsyncIteratorWrapper, AsyncProxy, BoundedExecutor, get_executor
+from inginious.common.metrics import Metrics
+
+
+class TestAsyncIteratorWrapper(object):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.produced = 0
+
+    def tearDown(self):
+        self.loop.close()
+
+    def stream(self, nb):
+        for i in range(nb):
+            self.produced += 1
+            yield i
+
+    def test_order(self):
+        async def consume():
+            return [i async for i in AsyncIteratorWrapper(self.stream(1000))]
+        assert self.loop.run_until_complete(consume()) == list(range(1000))
+
+    def test_back_pressure(self):
+        """ The thread stops iterating when max_queued items wait for the consumer """
+        async def consume():
+            source = AsyncIteratorWrapper(self.stream(1000), max_queued=10)
+            await asyncio.sleep(0.2)
+            assert self.produced <= 12  # the queue, the item being put and the one produced next
+            assert await source.__anext__() == 0
+            source.close()
+            await asyncio.sleep(0.1)
+            return source
+        source = self.loop.run_until_complete(consume())
+        source._thread.join(2)
+        assert not source._thread.is_alive()
+        assert self.produced < 1000
+
+    def test_loop_closed(self):
+        """ The thread stops when the loop is closed """
+        source = AsyncIteratorWrapper(self.stream(1000), max_queued=10)
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.loop.close()
+        source._thread.join(3)
+        assert not source._thread.is_alive()
+
+
+class TestBoundedExecutor(object):
+    def test_saturation(self):
+        metrics = Metrics()
+        executor = BoundedExecutor("test", 2, metrics)
+        release = threading.Event()
+        futures = [executor.submit(release.wait) for _ in range(5)]
+        time.sleep(0.1)
+
+        gauges = metrics.collect()["gauges"]
+        labels = (("executor", "test"),)
+        assert gauges[("executor_threads", labels)] == 2
+        assert gauges[("executor_running", labels)] == 2
+        assert gauges[("executor_queued", labels)] == 3
+
+        release.set()
+        for future in futures:
+            future.result()
+        gauges = metrics.collect()["gauges"]
+        assert gauges[("executor_running", labels)] == 0
+        assert gauges[("executor_queued", labels)] == 0
+        assert metrics.collect()["histograms"][("executor_wait_seconds", labels)].count == 5
+        executor.shutdown()
+
+    def test_shared(self):
+        """ AsyncProxy uses the shared io executor by default """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        proxy = AsyncProxy(os)
+        assert proxy._executor is get_executor("io")
+        assert proxy.path._executor is get_executor("io")
+        assert loop.run_until_complete(proxy.path.exists(".")) is True
+        loop.close()
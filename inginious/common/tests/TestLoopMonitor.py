@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import asyncio
+import time
+
+from inginious.common.loop_monitor import LoopMonitor
+
+
+async def blocking_coroutine():
+    await asyncio.sleep(0)
+    time.sleep(0.1)  # a blocking call
+
+
+class TestLoopMonitor(object):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.monitor = LoopMonitor(self.loop, "test", interval=0.01, slow_callback_duration=0.05)
+        self.monitor.start()
+
+    def tearDown(self):
+        self.monitor.stop()
+        self.loop.close()
+
+    def test_slow_callbacks(self):
+        self.loop.run_until_complete(blocking_coroutine())
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        counters = self.monitor.get_metrics().collect()["counters"]
+        assert counters == {("loop_slow_callbacks_total", (("callback", "blocking_coroutine"), ("loop", "test"))): 1}
+
+    def test_lag(self):
+        self.loop.call_soon(time.sleep, 0.1)
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        histograms = self.monitor.get_metrics().collect()["histograms"]
+        lag = histograms[("loop_lag_seconds", (("loop", "test"),))]
+        assert lag.count >= 1
+        assert lag.sum >= 0.05
+
+    def test_stop(self):
+        self.monitor.stop()
+        self.loop.run_until_complete(blocking_coroutine())
+        assert self.monitor.get_metrics().collect()["counters"] == {}
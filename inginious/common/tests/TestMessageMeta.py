@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+import os
+from typing import Any, Dict
+
+import msgpack
+import zmq
+
+from inginious.common.compression import CompressedBlob, get_codecs
+from inginious.common.message_meta import MessageMeta, WIRE_VERSION
+from inginious.common.messages import ClientNewJob, BackendJobDone, ClientHello, AgentHello, BackendUpdateEnvironments, BackendGetQueue
+
+
+def new_job(inputdata):
+    return ClientNewJob("job", 0, "course", "task", inputdata, "env", {}, False, "launcher")
+
+
+class TestDumpFrames(object):
+    def test_small_message(self):
+        message = new_job({"q1": "answer", "file": {"filename": "a.txt", "value": b"content"}})
+        frames = message.dump_frames()
+        assert len(frames) == 1
+        assert MessageMeta.load(frames[0]).inputdata == message.inputdata
+
+    def test_large_fields(self):
+        big = b"x" * MessageMeta.BLOB_MIN_SIZE
+        message = new_job({"file": {"filename": "a.txt", "value": big}, "files": [big, b"small"]})
+        frames = message.dump_frames(None, WIRE_VERSION)
+        assert len(frames) == 3
+        assert frames[1] is big and frames[2] is big
+        assert len(frames[0]) < 1000
+
+        loaded = MessageMeta.load(frames[0], frames[1:])
+        assert loaded.inputdata["file"] == {"filename": "a.txt", "value": big}
+        assert loaded.inputdata["files"] == (big, b"small")
+
+    def test_version_1(self):
+        """ The peers that only know the version 1 of the wire format receive the large fields in the message """
+        big = b"x" * MessageMeta.BLOB_MIN_SIZE
+        message = BackendJobDone("job", ("success", ""), 100.0, {}, {}, {}, "", zmq.Frame(big), "", "")
+        for codec in (None, "zlib"):
+            frames = message.dump_frames(codec)
+            assert len(frames) == 1
+            assert MessageMeta.load(frames[0]).archive == big
+
+    def test_frames(self):
+        """ zmq.Frame received by the backend are sent again as separate frames, or serialized by dump() """
+        archive = zmq.Frame(b"y" * 10)
+        message = BackendJobDone("job", ("success", ""), 100.0, {}, {}, {}, "", archive, "", "")
+        frames = message.dump_frames(None, WIRE_VERSION)
+        assert len(frames) == 2 and frames[1] is archive
+        assert MessageMeta.load(message.dump()).archive == b"y" * 10
+
+
+class TestCompression(object):
+    def test_codecs(self):
+        big = b"x" * MessageMeta.BLOB_MIN_SIZE
+        message = new_job({"file": {"filename": "a.txt", "value": big}, "code": "print('hello')\n" * 1000})
+        for codec in get_codecs():
+            frames = message.dump_frames(codec, WIRE_VERSION)
+            assert len(frames) == 2
+            assert len(frames[0]) < 1000 and len(frames[1]) < 1000
+            assert MessageMeta.load(frames[0], frames[1:]).__dict__ == message.__dict__
+
+    def test_incompressible(self):
+        data = os.urandom(MessageMeta.BLOB_MIN_SIZE)
+        message = new_job({"file": {"filename": "a.bin", "value": data}})
+        frames = message.dump_frames("zlib", WIRE_VERSION)
+        assert frames[1] is data
+        assert MessageMeta.load(frames[0], frames[1:]).inputdata["file"]["value"] == data
+
+    def test_forward(self):
+        """ The compressed fields received by the backend are forwarded without being decompressed when possible """
+        archive = b"y" * MessageMeta.BLOB_MIN_SIZE
+        frames = BackendJobDone("job", ("success", ""), 100.0, {}, {}, {}, "", archive, "", "").dump_frames("zlib", WIRE_VERSION)
+        received = MessageMeta.load(frames[0], frames[1:], decompress_blobs=False)
+        assert isinstance(received.archive, CompressedBlob)
+
+        forwarded = received.dump_frames("zlib", WIRE_VERSION)
+        assert forwarded[1] is frames[1]
+        assert MessageMeta.load(forwarded[0], forwarded[1:]).archive == archive
+
+        for codec in ("lzma", None):
+            for wire_version in (1, WIRE_VERSION):
+                forwarded = received.dump_frames(codec, wire_version)
+                assert MessageMeta.load(forwarded[0], forwarded[1:]).archive == archive
+        assert MessageMeta.load(received.dump()).archive == archive
+
+
+class TestWireFormat(object):
+    def tearDown(self):
+        MessageMeta.set_debug(True)
+
+    def test_positional(self):
+        message = new_job({"q1": "answer"})
+        content = msgpack.loads(message.dump(WIRE_VERSION), encoding="utf8")
+        assert content[:4] == [WIRE_VERSION, "client_new_job", "job", 0]
+        loaded, version = MessageMeta.load_with_version(message.dump(WIRE_VERSION))
+        assert version == WIRE_VERSION and loaded.__dict__ == message.__dict__
+
+    def test_mixed_versions(self):
+        """ Peers that only know version 1 can read the messages written by default, and both versions can be received """
+        message = new_job({"q1": "answer"})
+        content = msgpack.loads(message.dump(), encoding="utf8")
+        assert content["type"] == "client_new_job" and content["job_id"] == "job"
+
+        message = new_job({"q1": "answer", "file": b"x" * MessageMeta.BLOB_MIN_SIZE})
+        for wire_version in (1, WIRE_VERSION, 1):
+            frames = message.dump_frames("zlib", wire_version)
+            loaded, version = MessageMeta.load_with_version(frames[0], frames[1:])
+            assert version == wire_version and loaded.__dict__ == message.__dict__
+
+    def test_announced_versions(self):
+        """ Only the peers that announce version 2 in their hello receive it """
+        old_hello = MessageMeta.load(msgpack.dumps({"type": "client_hello", "name": "old", "compression": []}, encoding="utf8",
+                                                   use_bin_type=True))
+        assert old_hello.wire_versions is None
+        assert WIRE_VERSION in MessageMeta.load(ClientHello("new", [], [1, WIRE_VERSION]).dump()).wire_versions
+
+    def test_version_1(self):
+        """ Messages serialized as dicts (such as in the journals written by previous versions) can still be loaded """
+        message = new_job({"q1": "answer"})
+        loaded = MessageMeta.load(msgpack.dumps(message.__dict__, encoding="utf8", use_bin_type=True))
+        assert loaded.__dict__ == message.__dict__
+
+    def test_invalid(self):
+        for content in ([WIRE_VERSION + 1, "ping"], [WIRE_VERSION, "no_such_message"], [WIRE_VERSION, "client_kill_job"]):
+            try:
+                MessageMeta.load(msgpack.dumps(content))
+                assert False, "%s should not load" % content
+            except TypeError:
+                pass
+
+    def test_production_mode(self):
+        MessageMeta.set_debug(False)
+        message = new_job({"q1": "answer"})
+        assert message.type == "client_new_job" and message.inputdata == {"q1": "answer"}
+        assert MessageMeta.load(message.dump()).__dict__ == message.__dict__
+        try:
+            message.job_id = "other"
+            assert False, "messages should be immutable"
+        except TypeError:
+            pass
+
+        MessageMeta.set_debug(True)
+        assert new_job({"q1": "answer"}).__dict__ == message.__dict__
+
+
+class TestOptionalFields(object):
+    def tearDown(self):
+        MessageMeta.set_debug(True)
+
+    def test_old_hellos(self):
+        """ The hellos of the clients and agents that do not know the new fields can still be loaded """
+        hello = MessageMeta.load(msgpack.dumps({"type": "client_hello", "name": "old"}, encoding="utf8", use_bin_type=True))
+        assert isinstance(hello, ClientHello) and hello.name == "old" and hello.compression is None
+
+        environments = {"default": {"id": "id", "created": 0, "ports": [], "type": "docker"}}
+        hello = MessageMeta.load(msgpack.dumps({"type": "agent_hello", "friendly_name": "old", "available_job_slots": 2,
+                                                "available_environments": environments}, encoding="utf8", use_bin_type=True))
+        assert isinstance(hello, AgentHello) and hello.available_job_slots == 2
+        assert hello.available_resources is None and hello.compression is None
+
+    def test_baseline_definitions(self):
+        """ The hellos without the new fields can be loaded by the peers that only know the previous definitions """
+        registered = dict(MessageMeta._registered_messages)
+        try:
+            class BaselineClientHello(metaclass=MessageMeta, msgtype="client_hello"):
+                def __init__(self, name: str):
+                    self.name = name
+
+            class BaselineAgentHello(metaclass=MessageMeta, msgtype="agent_hello"):
+                def __init__(self, friendly_name: str, available_job_slots: int, available_environments: Dict[str, Dict[str, Any]]):
+                    self.friendly_name = friendly_name
+                    self.available_job_slots = available_job_slots
+                    self.available_environments = available_environments
+
+            def baseline_load(bmessage):
+                """ MessageMeta.load as in the previous versions, which only know the version 1 of the wire format """
+                message_dict = msgpack.loads(bmessage, encoding="utf8", use_list=False)
+                obj = MessageMeta._registered_messages[message_dict["type"]].__new__(MessageMeta._registered_messages[message_dict["type"]])
+                object.__setattr__(obj, "__dict__", message_dict)
+                assert obj._verify(force=True)
+                return obj
+
+            environments = {"default": {"id": "id", "created": 0, "ports": [], "type": "docker"}}
+            hello = baseline_load(ClientHello("new").dump())
+            assert isinstance(hello, BaselineClientHello) and hello.name == "new"
+            hello = baseline_load(AgentHello("new", 2, environments).dump_frames()[0])
+            assert isinstance(hello, BaselineAgentHello) and hello.available_job_slots == 2
+        finally:
+            MessageMeta._registered_messages.clear()
+            MessageMeta._registered_messages.update(registered)
+
+    def test_unknown_fields(self):
+        """ The fields added by newer versions of a message are ignored """
+        for debug in (True, False):
+            MessageMeta.set_debug(debug)
+            hello = MessageMeta.load(msgpack.dumps({"type": "client_hello", "name": "newer", "compression": ["zlib"], "other": 1},
+                                                   encoding="utf8", use_bin_type=True))
+            assert hello.__dict__ == {"type": "client_hello", "name": "newer", "compression": ("zlib",), "wire_versions": None}
+
+    def test_old_backend_messages(self):
+        """ The messages of the backends that do not know the new fields can still be loaded """
+        message = MessageMeta.load(msgpack.dumps({"type": "backend_update_environments", "available_environments": {"default": "docker"}},
+                                                 encoding="utf8", use_bin_type=True))
+        assert isinstance(message, BackendUpdateEnvironments) and message.environment_versions is None
+
+        message = MessageMeta.load(msgpack.dumps({"type": "backend_get_queue", "jobs_running": [], "jobs_waiting": []},
+                                                 encoding="utf8", use_bin_type=True))
+        assert isinstance(message, BackendGetQueue) and message.estimates is None
+
+    def test_positional_defaults(self):
+        hello = MessageMeta.load(msgpack.dumps([WIRE_VERSION, "agent_hello", "old", 2, {}]))
+        assert hello.__dict__ == AgentHello("old", 2, {}).__dict__
+
+    def test_defaults(self):
+        for debug in (True, False):
+            MessageMeta.set_debug(debug)
+            assert ClientHello("name").compression is None
+            assert ClientHello("name", compression=["zlib"]).compression == ["zlib"]
+            assert MessageMeta.load(ClientHello("name").dump()).__dict__ == {"type": "client_hello", "name": "name",
+                                                                          "compression": None, "wire_versions": None}
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+from inginious.common.metrics import Histogram, Metrics
+
+
+class TestHistogram(object):
+    def test_observe(self):
+        histogram = Histogram((1, 10))
+        for value in (0.5, 1, 5, 100):
+            histogram.observe(value)
+        assert histogram.counts == [2, 1, 1]
+        assert histogram.count == 4
+        assert histogram.sum == 106.5
+
+    def test_quantile(self):
+        histogram = Histogram((1, 10))
+        assert histogram.quantile(0.5) is None
+        for value in (0.5, 0.5, 0.5, 5):
+            histogram.observe(value)
+        assert histogram.quantile(0.5) == 1
+        assert histogram.quantile(1) == 10
+
+
+class TestMetrics(object):
+    def test_collect(self):
+        metrics = Metrics()
+        metrics.inc("jobs_total", {"environment": "default"})
+        metrics.inc("jobs_total", {"environment": "default"}, 2)
+        metrics.observe("wait_seconds", 3, {"environment": "default"})
+        metrics.add_collector(lambda m: m.set("waiting", 42))
+
+        snapshot = metrics.collect()
+        assert snapshot["counters"] == {("jobs_total", (("environment", "default"),)): 3}
+        assert snapshot["gauges"] == {("waiting", ()): 42}
+        assert snapshot["histograms"][("wait_seconds", (("environment", "default"),))].count == 1
+
+    def test_clear_gauges(self):
+        metrics = Metrics()
+        metrics.set("waiting", 1, {"environment": "a"})
+        metrics.set("waiting", 2, {"environment": "b"})
+        metrics.set("running", 3)
+        metrics.clear_gauges("waiting")
+        assert metrics.collect()["gauges"] == {("running", ()): 3}
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.inc("jobs_total", {"environment": 'a"b'})
+        metrics.observe("wait_seconds", 0.5, buckets=(1,))
+        text = metrics.to_prometheus()
+        assert '# TYPE inginious_jobs_total counter' in text
+        assert 'inginious_jobs_total{environment="a\\"b"} 1.0' in text
+        assert 'inginious_wait_seconds_bucket{le="1.0"} 1' in text
+        assert 'inginious_wait_seconds_bucket{le="+Inf"} 1' in text
+        assert 'inginious_wait_seconds_count 1' in text
@@ -32,6 +32,7 @@ from inginious import get_root_path
 from inginious.common.course_factory import create_factories
 from inginious.common.entrypoints import filesystem_from_config_dict
 from inginious.common.filesystems.local import LocalFSProvider
+from inginious.common.metrics import Metrics
 from inginious.frontend.lti_outcome_manager import LTIOutcomeManager
 
 from inginious.frontend.task_problems import *
@@ -183,7 +184,9 @@ def get_app(config):
     default_allowed_file_extensions = config['allowed_file_extensions']
     default_max_file_size = config['max_file_size']
 
-    zmq_context, __ = start_asyncio_and_zmq(config.get('debug_asyncio', False))
+    metrics = Metrics()
+    zmq_context, __ = start_asyncio_and_zmq(config.get('debug_asyncio', False), config.get('loop_monitor'), metrics,
+                                            config.get('metrics'))
 
     # Init the different parts of the app
     plugin_manager = PluginManager()
@@ -212,7 +215,7 @@ def get_app(config):
 
     update_pending_jobs(database)
 
-    client = create_arch(config, fs_provider, zmq_context, course_factory)
+    client = create_arch(config, fs_provider, zmq_context, course_factory, metrics)
 
     lti_outcome_manager = LTIOutcomeManager(database, user_manager, course_factory)
 
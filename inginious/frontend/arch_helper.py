@@ -14,15 +14,26 @@ from inginious.agent.docker_agent import DockerAgent
 from inginious.agent.mcq_agent import MCQAgent
 from inginious.backend.backend import Backend
 from inginious.client.client import Client
+from inginious.client.result_cache import ResultCache
+from inginious.common.loop_monitor import LoopMonitor
+from inginious.common.metrics import start_metrics_server
 
-def start_asyncio_and_zmq(debug_asyncio=False):
+def start_asyncio_and_zmq(debug_asyncio=False, loop_monitor=None, metrics=None, metrics_address=None):
     """ Init asyncio and ZMQ. Starts a daemon thread in which the asyncio loops run.
+    :param loop_monitor: None, or a dict with the key slow_callback_duration (in seconds)
+    :param metrics: the Metrics object in which the measures of the loop monitor are stored, or None
+    :param metrics_address: None, or the address on which metrics are served, in the form host:port
     :return: a ZMQ context and a Thread object (as a tuple)
     """
     loop = ZMQEventLoop()
     asyncio.set_event_loop(loop)
     if debug_asyncio:
         loop.set_debug(True)
+    if loop_monitor is not None:
+        LoopMonitor(loop, "frontend", metrics, slow_callback_duration=loop_monitor.get("slow_callback_duration", 0.1)).start()
+    if metrics is not None and metrics_address:
+        host, port = metrics_address.rsplit(":", 1)
+        loop.create_task(start_metrics_server(metrics, host, int(port)))
     zmq_context = Context()
 
     t = threading.Thread(target=_run_asyncio, args=(loop, zmq_context), daemon=True)
@@ -55,13 +66,14 @@ async def _restart_on_cancel(logger, agent):
             logger.exception("Restarting agent")
             pass
 
-def create_arch(configuration, tasks_fs, context, course_factory):
+def create_arch(configuration, tasks_fs, context, course_factory, metrics=None):
     """ Helper that can start a simple complete INGInious arch locally if needed, or a client to a remote backend.
         Intended to be used on command line, makes uses of exit() and the logger inginious.frontend.
     :param configuration: configuration dict
     :param tasks_fs: FileSystemProvider to the courses/tasks folders
     :param context: a ZMQ context
     :param course_factory: The course factory to be used by the frontend
+    :param metrics: the Metrics object in which the client stores its metrics, or None
     :param is_testing: boolean
     :return: a Client object
     """
@@ -69,6 +81,10 @@ def create_arch(configuration, tasks_fs, context, course_factory):
     logger = logging.getLogger("inginious.frontend")
 
     backend_link = configuration.get("backend", "local")
+    result_cache_size = configuration.get("result_cache_size", 1000)
+    result_cache_memory = configuration.get("result_cache_memory", 64)
+    result_cache = ResultCache(result_cache_size, max_bytes=result_cache_memory * 1024 * 1024) if result_cache_size > 0 else None
+    callback_threads = configuration.get("callback_threads", 4)
     if backend_link == "local":
         logger.info("Starting a simple arch (backend, docker-agent and mcq-agent) locally")
 
@@ -88,9 +104,11 @@ def create_arch(configuration, tasks_fs, context, course_factory):
         else:
             debug_ports = range(64100, 64111)
 
-        client = Client(context, "inproc://backend_client")
+        client = Client(context, "inproc://backend_client", result_cache=result_cache, callback_threads=callback_threads,
+                        metrics=metrics)
         backend = Backend(context, "inproc://backend_agent", "inproc://backend_client")
-        agent_docker = DockerAgent(context, "inproc://backend_agent", "Docker - Local agent", concurrency, tasks_fs, debug_host, debug_ports, tmp_dir)
+        agent_docker = DockerAgent(context, "inproc://backend_agent", "Docker - Local agent", concurrency, tasks_fs, debug_host, debug_ports, tmp_dir,
+                                   metrics=metrics)
         agent_mcq = MCQAgent(context, "inproc://backend_agent", "MCQ - Local agent", 1, tasks_fs, course_factory)
 
         asyncio.ensure_future(_restart_on_cancel(logger, agent_docker))
@@ -103,7 +121,7 @@ def create_arch(configuration, tasks_fs, context, course_factory):
         return None #... pycharm returns a warning else :-(
     else:
         logger.info("Creating a client to backend at %s", backend_link)
-        client = Client(context, backend_link)
+        client = Client(context, backend_link, result_cache=result_cache, callback_threads=callback_threads, metrics=metrics)
 
     # check for old-style configuration entries
     old_style_configs = ["agents", 'containers', "machines", "docker_daemons"]
@@ -29,6 +29,13 @@ class CourseReplaySubmissions(INGIniousSubmissionAdminPage):
             web.header('Content-Type', 'application/json')
             self.submission_manager.replay_job(course.get_task(submission["taskid"]), submission)
             return json.dumps({"status": "waiting"})
+        elif user_input.get("action") == "kill":
+            # Kill the jobs of the selected tasks. No selection is not taken as the whole course, to avoid mistakes.
+            if not user_input.tasks:
+                return self.show_page(course, web.input(), _("Please select the tasks whose jobs should be killed."), True)
+            for taskid in user_input.tasks:
+                self.submission_manager.kill_jobs(course.get_id(), taskid)
+            return self.show_page(course, web.input(), _("The waiting and running jobs of the selected tasks were killed."))
         else:
             # Replay several submissions, check input
             tasks = course.get_tasks()
@@ -174,6 +174,10 @@ class CourseEditTask(INGIniousAdminPage):
             if "groups" in data:
                 data["groups"] = True if data["groups"] == "true" else False
 
+            # Deterministic grading
+            if "deterministic" in data:
+                data["deterministic"] = True if data["deterministic"] == "true" else False
+
             # Submission storage
             if "store_all" in data:
                 try:
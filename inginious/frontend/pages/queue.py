@@ -7,6 +7,8 @@
 
 from datetime import datetime
 
+import web
+
 from inginious.frontend.pages.utils import INGIniousAuthPage
 
 
@@ -15,4 +17,22 @@ class QueuePage(INGIniousAuthPage):
 
     def GET_AUTH(self):
         """ GET request """
-        return self.template_helper.get_renderer().queue(*self.submission_manager.get_job_queue_snapshot(), datetime.fromtimestamp)
+        return self.show_page()
+
+    def POST_AUTH(self):
+        """ POST request: kill the jobs matching the given criteria (superadmins only) """
+        if not self.user_manager.user_is_superadmin():
+            raise web.forbidden()
+
+        user_input = web.input()
+        courseid, taskid, launcher = (user_input.get(key) or None for key in ("courseid", "taskid", "launcher"))
+        if courseid is None and taskid is None and launcher is None:
+            # Do not kill every job of the backend by mistake
+            return self.show_page(_("Please give a course, a task or a launcher."), True)
+
+        self.submission_manager.kill_jobs(courseid, taskid, launcher, "all_clients" in user_input)
+        return self.show_page(_("The matching jobs were killed."))
+
+    def show_page(self, msg="", error=False):
+        return self.template_helper.get_renderer().queue(*self.submission_manager.get_job_queue_snapshot(), datetime.fromtimestamp,
+                                                         msg, error)
@@ -322,6 +322,9 @@ class BaseTaskPage(object):
             else:
                 text = _("<b>There are {} tasks in front of you in the waiting queue.</b>").format(nb_tasks_before)
 
+            if nb_tasks_before >= 0 and wait_time > 0:
+                text += " " + _("(Approx. wait time: {} seconds)").format(wait_time)
+
             return json.dumps({'status': "waiting", 'text': text})
 
         tojson = {
@@ -48,8 +48,8 @@ class WebAppSubmissionManager:
         job """
         submission = self.get_submission(submissionid, False)
 
-        if "jobid" not in submission:
-            return  # ignore, duplicate message
+        if submission["status"] != "waiting":
+            return  # ignore, duplicate message (the job id may not be stored yet, if the job was done at once)
 
         submission = self.get_input_from_submission(submission)
 
@@ -184,17 +184,23 @@ class WebAppSubmissionManager:
             submission["tests"] = {} # Be sure tags are reinitialized
             submissionid = self._database.submissions.insert(submission)
 
+        # Clean the submission document in db. This must be done before creating the job, as the job may be done at once
+        # (if its result is in the cache of the client)
+        self._database.submissions.update(
+            {"_id": submission["_id"]},
+            {"$set": {"status": "waiting", "response_type": task.get_response_type()},
+             "$unset": {"result": "", "grade": "", "text": "", "tests": "", "problems": "", "archive": "", "state": "", "custom": ""}
+             })
+
         jobid = self._client.new_job(1, task, inputdata,
                                      (lambda result, grade, problems, tests, custom, state, archive, stdout, stderr:
                                       self._job_done_callback(submissionid, task, result, grade, problems, tests, custom, state, archive, stdout, stderr, copy)),
                                      "Frontend - {}".format(submission["username"]), debug, ssh_callback)
 
-        # Clean the submission document in db
         self._database.submissions.update(
-            {"_id": submission["_id"]},
-            {"$set": {"jobid": jobid, "status": "waiting", "response_type": task.get_response_type()},
-             "$unset": {"result": "", "grade": "", "text": "", "tests": "", "problems": "", "archive": "", "state": "", "custom": ""}
-             })
+            {"_id": submission["_id"], "status": "waiting"},
+            {"$set": {"jobid": jobid}}
+        )
 
         if not copy:
             self._logger.info("Replaying submission %s - %s - %s - %s", submission["username"], submission["courseid"],
@@ -410,6 +416,12 @@ class WebAppSubmissionManager:
 
         return self._client.kill_job(submission["jobid"])
 
+    def kill_jobs(self, course_id=None, task_id=None, launcher=None, all_clients=False):
+        """ Kills all the waiting and running jobs of a course, a task or a launcher.
+        :param all_clients: if True, also kill the jobs started by the other clients of the backend (other webapps, LTI, ...)
+        """
+        self._client.kill_jobs(course_id, task_id, launcher, all_clients)
+
     def user_is_submission_owner(self, submission):
         """ Returns true if the current user is the owner of this jobid, false else """
         if not self._user_manager.session_logged_in():
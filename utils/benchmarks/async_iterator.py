@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+"""
+    Stress benchmark of the asyncio utilities used by the agent:
+
+    - chatty streams (such as docker stats or events), producing items faster than their consumer, are read through
+      AsyncIteratorWrapper, with its bounded queue, and through the wrapper of previous versions, whose queue is
+      unbounded. The peak of memory allocated while the streams are consumed is reported;
+    - many concurrent blocking calls are made through AsyncProxy in the shared executor, whose threads and saturation
+      (calls waiting for a thread) are reported.
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+import tracemalloc
+
+from inginious.common.asyncio_utils import AsyncIteratorWrapper, AsyncProxy, BoundedExecutor
+from inginious.common.metrics import Metrics
+
+
+class UnboundedIteratorWrapper(AsyncIteratorWrapper):
+    """ The wrapper of previous versions: every item is posted to the loop as soon as it is produced """
+
+    def __init__(self, obj):
+        super(UnboundedIteratorWrapper, self).__init__(obj, 1)
+
+    async def __anext__(self):
+        value = await self._queue.get()
+        if value is self._last_item:
+            raise StopAsyncIteration
+        return value
+
+    async def _add_to_queue(self, o):
+        await self._queue.put(o)
+
+    def _unroll(self):
+        for i in self._it:
+            self._loop.call_soon_threadsafe(asyncio.ensure_future, self._add_to_queue(i))
+        self._loop.call_soon_threadsafe(asyncio.ensure_future, self._add_to_queue(self._last_item))
+
+
+def chatty_stream(nb_items, item_size):
+    for _ in range(nb_items):
+        yield bytearray(item_size)
+
+
+async def consume(source, delay):
+    count = 0
+    async for _ in source:
+        count += 1
+        if count % 100 == 0:
+            await asyncio.sleep(delay)
+    return count
+
+
+def measure_streams(wrapper, nb_streams, nb_items, item_size, delay):
+    """ Returns the peak of allocated memory (in MB) and the duration of the consumption of the streams """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    tracemalloc.start()
+    start = time.perf_counter()
+    sources = [wrapper(chatty_stream(nb_items, item_size)) for _ in range(nb_streams)]
+    loop.run_until_complete(asyncio.gather(*[consume(source, delay) for source in sources]))
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    loop.close()
+    return peak / 1024 / 1024, duration
+
+
+def measure_proxy(nb_threads, nb_calls, call_duration):
+    """ Returns the duration of the calls, the maximum number of threads and of calls waiting for a thread """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    metrics = Metrics()
+    executor = BoundedExecutor("benchmark", nb_threads, metrics)
+    proxy = AsyncProxy(time, executor=executor)
+    max_threads, max_queued = 0, 0
+
+    async def watch():
+        nonlocal max_threads, max_queued
+        while True:
+            gauges = metrics.collect()["gauges"]
+            max_threads = max(max_threads, threading.active_count())
+            max_queued = max(max_queued, gauges[("executor_queued", (("executor", "benchmark"),))])
+            await asyncio.sleep(0.01)
+
+    watcher = loop.create_task(watch())
+    start = time.perf_counter()
+    loop.run_until_complete(asyncio.gather(*[proxy.sleep(call_duration) for _ in range(nb_calls)]))
+    duration = time.perf_counter() - start
+    watcher.cancel()
+    loop.run_until_complete(asyncio.sleep(0))
+    executor.shutdown()
+    loop.close()
+    return duration, max_threads, max_queued
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", help="Number of streams read concurrently", default=8, type=int)
+    parser.add_argument("--items", help="Number of items per stream", default=5000, type=int)
+    parser.add_argument("--item-size", help="Size of the items, in bytes", default=16384, type=int)
+    parser.add_argument("--delay", help="Seconds the consumer sleeps every 100 items", default=0.01, type=float)
+    parser.add_argument("--threads", help="Number of threads of the executor", default=16, type=int)
+    parser.add_argument("--calls", help="Number of concurrent blocking calls", default=2000, type=int)
+    args = parser.parse_args()
+
+    print("%-20s %15s %15s" % ("queue", "peak MB", "seconds"))
+    for name, wrapper in (("unbounded", UnboundedIteratorWrapper), ("bounded (100)", AsyncIteratorWrapper)):
+        peak, duration = measure_streams(wrapper, args.streams, args.items, args.item_size, args.delay)
+        print("%-20s %15.1f %15.2f" % (name, peak, duration))
+
+    print()
+    duration, max_threads, max_queued = measure_proxy(args.threads, args.calls, 0.005)
+    print("%i calls of 5ms in %i threads: %.2f seconds, at most %i threads alive, at most %i calls waiting" %
+          (args.calls, args.threads, duration, max_threads, max_queued))
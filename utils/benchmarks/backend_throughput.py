@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+"""
+    Benchmark of the message throughput of the backend. A simulated fleet of agents answers immediately to every job,
+    while simulated clients submit a burst of jobs. Measures the time needed for all the jobs to be done, for
+    several batch sizes of the backend.
+"""
+
+import argparse
+import asyncio
+import time
+
+import zmq
+from zmq.asyncio import Context
+
+from inginious.backend.backend import Backend
+from inginious.common.message_meta import ZMQUtils
+from inginious.common.messages import AgentHello, AgentJobDone, AgentJobStarted, BackendNewJob, ClientHello, ClientNewJob, \
+    BackendJobDone, Ping, Pong
+
+ENVIRONMENTS = {"env%d" % i: {"id": "env%d" % i, "created": 0, "ports": [], "type": "docker"} for i in range(10)}
+
+
+async def simulated_agent(context, address, name, slots):
+    """ An agent that says hello and answers immediately to every job """
+    socket = context.socket(zmq.DEALER)
+    socket.connect(address)
+    await ZMQUtils.send(socket, AgentHello(name, slots, ENVIRONMENTS, {}, []))
+    try:
+        while True:
+            message = await ZMQUtils.recv(socket)
+            if isinstance(message, BackendNewJob):
+                await ZMQUtils.send(socket, AgentJobStarted(message.job_id))
+                await ZMQUtils.send(socket, AgentJobDone(message.job_id, ("success", ""), 100.0, {}, {}, {}, "", None, "", ""))
+            elif isinstance(message, Ping):
+                await ZMQUtils.send(socket, Pong())
+    finally:
+        socket.close(0)
+
+
+async def simulated_client(context, address, name, nb_jobs):
+    """ A client that submits nb_jobs jobs at once, and waits for all of them to be done """
+    socket = context.socket(zmq.DEALER)
+    socket.connect(address)
+    await ZMQUtils.send(socket, ClientHello(name, []))
+    await ZMQUtils.recv(socket)  # environments
+    for i in range(nb_jobs):
+        await ZMQUtils.send(socket, ClientNewJob(str(i), 0, "course", "task", {"input": "x" * 100}, "env%d" % (i % len(ENVIRONMENTS)),
+                                                 {}, False, name))
+    done = 0
+    while done < nb_jobs:
+        if isinstance(await ZMQUtils.recv(socket), BackendJobDone):
+            done += 1
+    socket.close(0)
+
+
+async def run(batch_size, nb_agents, slots, nb_clients, nb_jobs, run_id):
+    context = Context()
+    agent_addr, client_addr = "inproc://agents%d" % run_id, "inproc://clients%d" % run_id
+    backend = Backend(context, agent_addr, client_addr, batch_size=batch_size)
+    backend_task = asyncio.ensure_future(backend.run())
+    await asyncio.sleep(0.1)
+
+    agents = [asyncio.ensure_future(simulated_agent(context, agent_addr, "agent%d" % i, slots)) for i in range(nb_agents)]
+    await asyncio.sleep(0.5)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[simulated_client(context, client_addr, "client%d" % i, nb_jobs) for i in range(nb_clients)])
+    elapsed = time.perf_counter() - start
+
+    for task in agents + [backend_task]:
+        task.cancel()
+    await asyncio.gather(*agents, backend_task, return_exceptions=True)
+    context.destroy(0)
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", help="Number of simulated agents", default=20, type=int)
+    parser.add_argument("--slots", help="Number of job slots per agent", default=16, type=int)
+    parser.add_argument("--clients", help="Number of simulated clients", default=3, type=int)
+    parser.add_argument("--jobs", help="Number of jobs submitted by each client", default=5000, type=int)
+    parser.add_argument("--batch-sizes", help="Batch sizes to compare", default=[1, 10, 100, 1000], type=int, nargs="+")
+    args = parser.parse_args()
+
+    # Each job implies 4 messages through the backend: new job, job started, job done, and job done sent to the client
+    nb_messages = 4 * args.clients * args.jobs
+    for run_id, batch_size in enumerate(args.batch_sizes):
+        # A new event loop for each run, so that the periodic tasks of the previous backend are discarded
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        elapsed = loop.run_until_complete(run(batch_size, args.agents, args.slots, args.clients, args.jobs, run_id))
+        loop.close()
+        print("batch size %5d: %7.2f s  %8.0f jobs/s  %8.0f messages/s" % (batch_size, elapsed, args.clients * args.jobs / elapsed,
+                                                                           nb_messages / elapsed))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+"""
+    Benchmark of the container churn (create, start, kill and remove) of the Docker interface of the agent, against a
+    local stand-in HTTP server answering to the few calls of the Docker API that are needed. The shared client (with its
+    pool of connections) is compared to a client created at each call, as done by previous versions.
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import docker
+
+from inginious.agent.docker_agent._docker_interface import DockerInterface
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    """ Answers to the calls made to create, start, kill and remove containers, with keep-alive connections """
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.connections.add(self.client_address)
+
+    def _answer(self, status, content=None):
+        body = json.dumps(content).encode("utf8") if content is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, method):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = re.sub(r"^/v[0-9.]+", "", self.path.split("?")[0])
+        if method == "GET" and path == "/version":
+            self._answer(200, {"ApiVersion": "1.41", "Version": "20.10.0", "MinAPIVersion": "1.12"})
+        elif method == "POST" and path == "/containers/create":
+            self._answer(201, {"Id": uuid.uuid4().hex, "Warnings": []})
+        elif method == "GET" and re.match(r"^/containers/\w+/json$", path):
+            self._answer(200, {"Id": path.split("/")[2], "Name": "/container", "Config": {}, "State": {"Status": "created"}})
+        elif method == "POST" and re.match(r"^/containers/\w+/(start|kill)$", path):
+            self._answer(204)
+        elif method == "DELETE" and re.match(r"^/containers/\w+$", path):
+            self._answer(204)
+        else:
+            self._answer(404, {"message": "not found"})
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+
+class PerCallClientInterface(DockerInterface):
+    """ The Docker interface of previous versions: a new client for each call, and an inspection before each operation """
+
+    @property
+    def _docker(self):
+        return docker.from_env()
+
+    def start_container(self, container_id):
+        self._docker.containers.get(container_id).start()
+
+    def remove_container(self, container_id):
+        self._docker.containers.get(container_id).remove(v=True, link=False, force=True)
+
+    def kill_container(self, container_id, signal=None):
+        self._docker.containers.get(container_id).kill(signal)
+
+
+def churn(interface):
+    container_id = interface.create_container("env", False, 100, "/tmp", "/tmp", "/tmp", "/tmp")
+    interface.start_container(container_id)
+    interface.kill_container(container_id)
+    interface.remove_container(container_id)
+
+
+def measure(interface, nb, threads):
+    """ Returns the number of containers created, started, killed and removed per second """
+    with ThreadPoolExecutor(threads) as executor:
+        start = time.perf_counter()
+        for future in [executor.submit(churn, interface) for _ in range(nb)]:
+            future.result()
+        return nb / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nb", help="Number of containers", default=500, type=int)
+    parser.add_argument("--threads", help="Number of threads making calls to Docker", default=8, type=int)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeDockerHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["DOCKER_HOST"] = "tcp://127.0.0.1:%i" % server.server_address[1]
+
+    print("%-20s %15s %15s" % ("client", "containers/s", "connections"))
+    for name, interface in (("per call", PerCallClientInterface()),
+                            ("shared", DockerInterface(max_connections=args.threads))):
+        FakeDockerHandler.connections.clear()
+        result = measure(interface, args.nb, args.threads)
+        print("%-20s %15.0f %15i" % (name, result, len(FakeDockerHandler.connections)))
+
+    server.shutdown()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+"""
+    Micro-benchmark of the construction, serialization and loading of the messages exchanged between the clients, the
+    backend and the agents, in debug and in production mode. The version 1 wire format (a dict of the fields) is
+    measured for comparison.
+"""
+
+import argparse
+import time
+
+from inginious.common.message_meta import MessageMeta, WIRE_VERSION
+from inginious.common.messages import AgentJobDone, ClientNewJob, Ping
+
+MESSAGES = {
+    "ping": (Ping, ()),
+    "client_new_job": (ClientNewJob, ("42", 0, "course", "task", {"q1": "x" * 100, "@username": "user", "@lang": "en"},
+                                      "env", {"limits": {"time": 30, "memory": 100}}, False, "Frontend - user")),
+    "agent_job_done": (AgentJobDone, ((b"client", "42"), ("success", "Well done"), 100.0, {"q1": ("success", "")}, {}, {},
+                                      "", None, "", ""))
+}
+
+
+def measure(func, nb):
+    """ Returns the number of calls to func per second """
+    start = time.perf_counter()
+    for _ in range(nb):
+        func()
+    return nb / (time.perf_counter() - start)
+
+
+def run(nb):
+    for name, (message_cls, args) in MESSAGES.items():
+        message = message_cls(*args)
+        dumped = message.dump(WIRE_VERSION)
+        dumped_v1 = message.dump()
+        results = (measure(lambda: message_cls(*args), nb),
+                   measure(lambda: message.dump(WIRE_VERSION), nb),
+                   measure(lambda: MessageMeta.load(dumped), nb),
+                   measure(lambda: MessageMeta.load(dumped_v1), nb))
+        print("%-15s %12.0f %12.0f %12.0f %12.0f" % ((name,) + results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nb", help="Number of operations of each kind", default=200000, type=int)
+    args = parser.parse_args()
+
+    for debug in (True, False):
+        MessageMeta.set_debug(debug)
+        print("%s mode (operations/s)" % ("Debug" if debug else "Production"))
+        print("%-15s %12s %12s %12s %12s" % ("message", "init", "dump", "load", "load (v1)"))
+        run(args.nb)
+        print()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of INGInious. See the LICENSE and the COPYRIGHTS files for
+# more information about the licensing of this file.
+
+"""
+    Micro-benchmark comparing TopicPriorityQueue and IndexedTopicPriorityQueue on a workload that looks like an exam
+    peak: many environments, a large waiting queue, agents supporting most of the environments, and some killed jobs.
+"""
+
+import argparse
+import queue
+import random
+import time
+
+from inginious.backend.topic_priority_queue import TopicPriorityQueue, IndexedTopicPriorityQueue
+
+
+def make_workload(nb_topics, nb_jobs, nb_gets, nb_agent_kinds, kill_ratio, seed):
+    """ Returns the list of jobs to put, the list of jobs killed, and the list of topic sets used by get() """
+    rand = random.Random(seed)
+    topics = ["env%d" % i for i in range(nb_topics)]
+    jobs = [(rand.choice(topics), [rand.randint(0, 1), i, b"client", str(i), object()]) for i in range(nb_jobs)]
+    killed = rand.sample(jobs, int(nb_jobs * kill_ratio))
+    agent_kinds = [frozenset(rand.sample(topics, max(1, int(nb_topics * 0.9)))) for _ in range(nb_agent_kinds)]
+    gets = [rand.choice(agent_kinds) for _ in range(nb_gets)]
+    return jobs, killed, gets
+
+
+def run_old(jobs, killed, gets):
+    """ Original queue: killed jobs are tombstones that must be popped """
+    pq = TopicPriorityQueue()
+    for topic, job in jobs:
+        pq.put(topic, job)
+    for _, job in killed:
+        job[-1] = None
+    start = time.perf_counter()
+    for topics in gets:
+        try:
+            job = None
+            while job is None:
+                job = pq.get(topics)
+                if job[-1] is None:
+                    job = None
+        except queue.Empty:
+            pass
+    return time.perf_counter() - start
+
+
+def run_new(jobs, killed, gets):
+    """ Indexed queue: killed jobs are removed """
+    pq = IndexedTopicPriorityQueue()
+    for topic, job in jobs:
+        pq.put(topic, job)
+    for topic, job in killed:
+        pq.remove(topic, job)
+    start = time.perf_counter()
+    for topics in gets:
+        try:
+            pq.get(topics)
+        except queue.Empty:
+            pass
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--topics", help="Number of environments", default=40, type=int)
+    parser.add_argument("--jobs", help="Number of waiting jobs", default=50000, type=int)
+    parser.add_argument("--gets", help="Number of dispatches", default=40000, type=int)
+    parser.add_argument("--agent-kinds", help="Number of distinct sets of environments supported by agents", default=3, type=int)
+    parser.add_argument("--kill-ratio", help="Ratio of waiting jobs that are killed", default=0.1, type=float)
+    parser.add_argument("--seed", default=42, type=int)
+    args = parser.parse_args()
+
+    for name, func in [("TopicPriorityQueue", run_old), ("IndexedTopicPriorityQueue", run_new)]:
+        # the workload is regenerated as run_old modifies the jobs
+        workload = make_workload(args.topics, args.jobs, args.gets, args.agent_kinds, args.kill_ratio, args.seed)
+        elapsed = func(*workload)
+        print("%-26s %8.3f s  %10.0f get/s" % (name, elapsed, args.gets / elapsed))